@@ -2,82 +2,288 @@
 import os
 import datetime
 import hashlib
-from flask import Flask, session, url_for, redirect, render_template, request, abort, flash
+import hmac
+import mimetypes
+import re
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import (
+    Flask, Markup, Request, Response, current_app, g, session, url_for, redirect, render_template, request, abort, flash,
+    escape, get_flashed_messages, jsonify, send_file, stream_with_context
+)
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from database import (
-    list_users, verify, delete_user_from_db, add_user,
-    read_note_from_db, write_note_into_db, delete_note_from_db,
+    list_users_page, user_exists, verify, add_user, user_deletions,
+    read_notes_page, write_note_into_db, delete_note_from_db,
     match_user_id_with_note_id, image_upload_record,
-    list_images_for_user, match_user_id_with_image_uid,
-    delete_image_from_db
+    list_images_page, match_user_id_with_image_uid, image_file_from_db,
+    delete_image_from_db, new_note, create_items, delete_items, export_items,
+    search_notes, open_connections, SNIPPET_START, SNIPPET_END
 )
+from image_store import allowed_file
+import archive
+import assets
+import cache
+import image_store
+import metrics
+import passwords
+import profiling
+import sessions
+import thumbnails
+import user_deletion
+import write_behind
+
+
+class UploadRequest(Request):
+    """
+    Request whose uploaded files are written by the form parser straight into
+    the image pool and hashed on the way, so that image_store.receive() only
+    finalizes them. Files no route received are removed when the request is
+    closed.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = image_store.Upload(current_app.config['UPLOAD_FOLDER'])
+        self.__dict__.setdefault("uploads", []).append(upload)
+        return upload
+
+    def close(self):
+        super().close()
+        # including the files of a form whose parsing failed half way
+        for upload in self.__dict__.get("uploads", ()):
+            upload.close()
+
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config.from_object('config')
+app.session_interface = sessions.from_config(app.config)
+
+# notes and images of a user only change through the routes below, which
+# invalidate the user's entries
+user_cache = cache.from_config(app.config)
+
+# pages whose content only depends on the template and on who is logged in
+page_cache = cache.LocalBackend(app.config['PAGE_CACHE_SIZE'])
+
+# notes are committed in batches by a background thread when enabled
+note_writer = None
+if app.config['NOTE_WRITE_BEHIND']:
+    note_writer = write_behind.NoteWriter(
+        app.config['NOTE_WRITE_BATCH_SIZE'], app.config['NOTE_WRITE_INTERVAL'], user_cache.invalidate
+    )
+
+# users are tombstoned by delete_user and their data deleted by background
+# threads; _remove_image_files is defined with the helpers below
+user_deleter = user_deletion.UserDeleter(
+    lambda paths: _remove_image_files(paths), app.config['USER_DELETE_BATCH_SIZE'],
+    app.config['USER_DELETE_WORKERS'], app.config['USER_DELETE_LEASE']
+)
+
+passwords.configure(app.config['PASSWORD_HASHER'], app.config['PASSWORD_WORKERS'])
+
+# route, database, template and file timings; see metrics.py
+metrics.configure(app.config['METRICS_ENABLED'])
+app.jinja_env.template_class = metrics.timed_template_class(app.jinja_env.template_class)
+metrics.Collected(
+    "cache_requests_total", "Cache lookups, by cache and result.", "counter", ("cache", "result"),
+    lambda: {
+        (name, result): count
+        for name, stats in (
+            ("user", user_cache.stats()),
+            ("page", {"hits": page_cache.hits, "misses": page_cache.misses}),
+            ("password", passwords.cache_stats()),
+        )
+        for result, count in (("hit", stats["hits"]), ("miss", stats["misses"]))
+    }
+)
+metrics.Collected(
+    "db_connections_open", "SQLite connections held by the threads of this process.", "gauge", (),
+    lambda: {(): open_connections()}
+)
+
+# sampled stacks of requests per route, read on /profiling/; see profiling.py
+profiler = profiling.Profiler(
+    app.config['PROFILING_ENABLED'], app.config['PROFILING_SAMPLE_RATE'],
+    app.config['PROFILING_INTERVAL'], app.config['PROFILING_TOKEN']
+)
+app.wsgi_app = profiler.middleware(app.wsgi_app)
+
+@app.context_processor
+def inject_asset_url():
+    return {"asset_url": _asset_url}
+
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled:
+        g.request_started = time.perf_counter()
+        metrics.HTTP_IN_PROGRESS.inc()
+    profile = request.environ.get(profiling.ENVIRON_KEY)
+    if profile is not None:
+        profile.endpoint = request.endpoint
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+@app.after_request
+def observe_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.HTTP_SECONDS.observe(
+            time.perf_counter() - started, request.endpoint or "none", request.method, response.status_code
+        )
+        metrics.HTTP_IN_PROGRESS.dec()
+    return response
 
-def allowed_file(filename):
-    """Checks if file is allowed."""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+@app.teardown_request
+def end_request_timer(exc):
+    # after_request is skipped when a view raises
+    if g.pop("request_started", None) is not None:
+        metrics.HTTP_IN_PROGRESS.dec()
 
 
 # === Error Handlers === #
 @app.errorhandler(401)
-def handle_401_error(error): return render_template("page_401.html"), 401
+def handle_401_error(error): return _render_cached("page_401.html", 401)
 
 @app.errorhandler(403)
-def handle_403_error(error): return render_template("page_403.html"), 403
+def handle_403_error(error): return _render_cached("page_403.html", 403)
 
 @app.errorhandler(404)
-def handle_404_error(error): return render_template("page_404.html"), 404
+def handle_404_error(error): return _render_cached("page_404.html", 404)
 
 @app.errorhandler(405)
-def handle_405_error(error): return render_template("page_405.html"), 405
+def handle_405_error(error): return _render_cached("page_405.html", 405)
 
 @app.errorhandler(413)
-def handle_413_error(error): return render_template("page_413.html"), 413
+def handle_413_error(error): return _render_cached("page_413.html", 413)
 
 
 # === Routes === #
 @app.route("/")
-def get_root(): return render_template("index.html")
+def get_root(): return _render_cached("index.html")
 
 @app.route("/public/")
-def get_public(): return render_template("public_page.html")
+def get_public(): return _render_cached("public_page.html")
+
+@app.route("/metrics")
+def get_metrics():
+    if not metrics.enabled:
+        return abort(404)
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + token):
+        return abort(401)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/profiling/", methods=["GET", "POST"])
+def get_profiling():
+    _check_profiling_access()
+    if request.method == "POST":
+        rate = request.form.get("sample_rate", type=float)
+        if rate is not None:
+            profiler.sample_rate = min(max(rate, 0.0), 1.0)
+        if request.form.get("reset"):
+            profiler.reset()
+    return jsonify(profiler.summary())
+
+@app.route("/profiling/stacks")
+def get_profiling_stacks():
+    _check_profiling_access()
+    # one request (its X-Profile-Id), one endpoint, or every endpoint
+    profile_id = request.args.get("request")
+    if profile_id is not None:
+        stacks = profiler.request_collapsed(profile_id)
+    else:
+        stacks = profiler.collapsed(request.args.get("endpoint"))
+    if stacks is None:
+        return abort(404)
+    return Response(stacks, content_type="text/plain; charset=utf-8")
+
+@app.route("/assets/<path:filename>")
+def get_asset(filename):
+    path = safe_join(app.config['ASSETS_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        return abort(404)
+
+    encoding, path = assets.choose_encoding(path, request.accept_encodings)
+    response = send_file(
+        os.path.abspath(path), mimetype=mimetypes.guess_type(filename)[0],
+        add_etags=False, conditional=False
+    )
+    fingerprinted = assets.is_fingerprinted(filename)
+    version = filename
+    if not fingerprinted:
+        stat = os.stat(path)
+        version = f"{filename}:{stat.st_mtime_ns}-{stat.st_size}"
+    response.set_etag(f"{version}:{encoding or 'identity'}")
+    response.make_conditional(request)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    if fingerprinted:
+        # names change with the content, so a given URL never needs revalidation
+        response.headers['Cache-Control'] = "public, max-age=31536000, immutable"
+    else:
+        # manifest.json and other unhashed names are rewritten in place by a build
+        response.headers['Cache-Control'] = "no-cache"
+    return response
 
 @app.route("/private/")
 def get_private():
-    user = session.get("current_user")
+    user = _current_user()
     if not user: return abort(401)
 
-    notes = read_note_from_db(user)
-    notes_table = zip(
-        [n[0] for n in notes],
-        [n[1] for n in notes],
-        [n[2] for n in notes],
-        [f"/delete_note/{n[0]}" for n in notes]
+    # the rendered tables are cached until the data changes; their pagination
+    # links depend on the whole query string, which is part of the key
+    query = request.query_string.decode()
+    notes_table = user_cache.get_or_load(
+        user, f"notes:{query}",
+        lambda: _render_notes_table(user, _page_size("notes_limit"), request.args.get("notes_before"))
     )
-
-    images = list_images_for_user(user)
-    images_table = zip(
-        [img[0] for img in images],
-        [img[1] for img in images],
-        [img[2] for img in images],
-        [f"/delete_image/{img[0]}" for img in images]
+    images_table = user_cache.get_or_load(
+        user, f"images:{query}",
+        lambda: _render_images_table(user, _page_size("images_limit"), request.args.get("images_before"))
     )
 
-    return render_template("private_page.html", notes=notes_table, images=images_table)
+    return _stream_template("private_page.html", notes_table=notes_table, images_table=images_table)
+
+
+@app.route("/search")
+def search():
+    user = _current_user()
+    if not user: return abort(401)
+
+    q = request.args.get("q", "").strip()
+    terms = re.findall(r"\w+", q)[:app.config['SEARCH_MAX_TERMS']]
+    limit = _page_size("limit")
+    # deep pages cost as much as all the pages before them
+    offset = min(max(request.args.get("offset", 0, type=int), 0), app.config['SEARCH_MAX_OFFSET'])
+    results, more = [], False
+    if terms:
+        results, more = user_cache.get_or_load(
+            user, f"search:{' '.join(terms)}:{limit}:{offset}",
+            lambda: search_notes(user, terms, limit, offset)
+        )
+
+    return render_template(
+        "search.html", q=q,
+        results=[(note_id, timestamp, note, _highlight(snippet)) for note_id, timestamp, note, snippet in results],
+        results_next=more and offset + limit <= app.config['SEARCH_MAX_OFFSET'] and _page_url(offset=offset + limit),
+        results_previous=offset > 0 and _page_url(offset=max(offset - limit, 0) or None),
+    )
 
 
 @app.route("/admin/")
 def get_admin():
-    if session.get("current_user") != "ADMIN":
+    if _current_user() != "ADMIN":
         return abort(401)
-    users = list_users()
-    user_table = zip(range(1, len(users) + 1), users, [f"/delete_user/{u}" for u in users])
-    return render_template("admin.html", users=user_table)
+    return render_template(
+        "admin.html", q=request.args.get("q", ""),
+        users_table=_render_users(request.args.get("q", ""), request.args.get("users_after"), _page_size("users_limit")),
+        deletions=[_deletion_progress(job) for job in user_deletions()]
+    )
 
 
 @app.route("/login", methods=["POST"])
@@ -85,7 +291,9 @@ def login():
     user_id = request.form.get("id", "").upper()
     password = request.form.get("pw")
 
-    if user_id in list_users() and verify(user_id, password):
+    if verify(user_id, password):
+        # a new session id, so that an id known before the login is worthless
+        session.regenerate()
         session['current_user'] = user_id
     return redirect(url_for("get_root"))
 
@@ -99,16 +307,23 @@ def logout():
 @app.route("/write_note", methods=["POST"])
 def write_note():
     text = request.form.get("text_note_to_take")
-    write_note_into_db(session['current_user'], text)
+    if note_writer is not None:
+        note_writer.submit(_current_user(), text)
+    else:
+        write_note_into_db(_current_user(), text)
+    user_cache.invalidate(_current_user())
     return redirect(url_for("get_private"))
 
 
-@app.route("/delete_note/<note_id>", methods=["GET"])
+@app.route("/delete_note/<int:note_id>", methods=["GET"])
 def delete_note(note_id):
-    user = session.get("current_user")
+    user = _current_user()
+    if note_writer is not None and note_writer.is_pending(note_id):
+        note_writer.flush()
     if user != match_user_id_with_note_id(note_id):
         return abort(401)
     delete_note_from_db(note_id)
+    user_cache.invalidate(user)
     return redirect(url_for("get_private"))
 
 
@@ -127,40 +342,187 @@ def upload_image():
         filename = secure_filename(file.filename)
         upload_time = str(datetime.datetime.now())
         image_uid = hashlib.sha256((upload_time + filename).encode()).hexdigest()
-        path = os.path.join(app.config['UPLOAD_FOLDER'], f"{image_uid}-{filename}")
-        file.save(path)
-        image_upload_record(image_uid, session['current_user'], filename, upload_time)
+        folder = app.config['UPLOAD_FOLDER']
+        digest, size, tmp_path = image_store.receive(folder, file.stream)
+        key = image_store.content_key(digest, filename)
+        try:
+            image_upload_record(
+                image_uid, _current_user(), filename, upload_time, digest, size,
+                lambda existing_key: image_store.place(folder, tmp_path, key, existing_key), _remove_image_file
+            )
+        finally:
+            image_store.discard(tmp_path)
+        user_cache.invalidate(_current_user())
+        thumbnails.queue(folder, key)
 
     return redirect(url_for("get_private"))
 
 
+@app.route("/image/<image_uid>", methods=["GET"])
+def get_image(image_uid):
+    image = image_file_from_db(image_uid)
+    if image is None or image[1] is None:
+        return abort(404)
+
+    owner, key, content_hash = image
+    if _current_user() != owner:
+        return abort(401)
+
+    # files never change once stored, so the content hash is a strong validator
+    etag = content_hash or image_uid
+    variant = request.args.get("variant")
+    if variant is not None:
+        if variant not in thumbnails.VARIANTS:
+            return abort(404)
+        try:
+            key = thumbnails.generate(app.config['UPLOAD_FOLDER'], key, variant)
+            etag = f"{etag}@{variant}"
+        except thumbnails.DECODE_ERRORS:
+            # not an image Pillow can decode: fall back to the original
+            pass
+    return _send_image(key, etag)
+
+
 @app.route("/delete_image/<image_uid>", methods=["GET"])
 def delete_image(image_uid):
-    user = session.get("current_user")
+    user = _current_user()
     if user != match_user_id_with_image_uid(image_uid):
         return abort(401)
 
-    delete_image_from_db(image_uid)
-    folder = app.config['UPLOAD_FOLDER']
-    file = next((f for f in os.listdir(folder) if f.startswith(image_uid)), None)
-    if file:
-        os.remove(os.path.join(folder, file))
+    delete_image_from_db(image_uid, _remove_image_file)
+    user_cache.invalidate(user)
     return redirect(url_for("get_private"))
 
 
+@app.route("/bulk/create", methods=["POST"])
+def bulk_create():
+    user = _current_user()
+    if not user: return abort(401)
+
+    notes = _bulk_values("note")
+    files = [file for file in request.files.getlist("file") if file.filename and allowed_file(file.filename)]
+    if len(notes) + len(files) > app.config['BULK_MAX_ITEMS']:
+        return abort(413)
+
+    note_rows = [new_note(user, text) for text in notes]
+    folder = app.config['UPLOAD_FOLDER']
+    upload_time = str(datetime.datetime.now())
+    image_rows, keys, received = [], [], []
+    try:
+        for sequence, file in enumerate(files):
+            filename = secure_filename(file.filename)
+            digest, size, tmp_path = image_store.receive(folder, file.stream)
+            received.append(tmp_path)
+            key = image_store.content_key(digest, filename)
+            image_uid = hashlib.sha256((upload_time + str(sequence) + filename).encode()).hexdigest()
+            image_rows.append((
+                image_uid, user, filename, upload_time, digest, size,
+                lambda existing_key, tmp_path=tmp_path, key=key: image_store.place(folder, tmp_path, key, existing_key)
+            ))
+            keys.append(key)
+        create_items(note_rows, image_rows, _remove_image_files)
+    finally:
+        for tmp_path in received:
+            image_store.discard(tmp_path)
+
+    user_cache.invalidate(user)
+    for key in set(keys):
+        thumbnails.queue(folder, key)
+    return _bulk_response({"notes": [row[3] for row in note_rows], "images": [row[0] for row in image_rows]}, 201)
+
+
+@app.route("/bulk/delete", methods=["POST"])
+def bulk_delete():
+    user = _current_user()
+    if not user: return abort(401)
+
+    note_ids, image_uids = _bulk_note_ids(), _bulk_values("image_uid")
+    if note_ids is None:
+        return abort(400)
+    if len(note_ids) + len(image_uids) > app.config['BULK_MAX_ITEMS']:
+        return abort(413)
+    if note_writer is not None and any(note_writer.is_pending(note_id) for note_id in note_ids):
+        note_writer.flush()
+
+    deleted = delete_items(user, note_ids, image_uids, _remove_image_files)
+    if deleted is None:
+        return abort(401)
+    user_cache.invalidate(user)
+    return _bulk_response({"notes": deleted[0], "images": deleted[1]})
+
+
+@app.route("/bulk/export", methods=["GET", "POST"])
+def bulk_export():
+    user = _current_user()
+    if not user: return abort(401)
+
+    note_ids, image_uids = _bulk_note_ids(), _bulk_values("image_uid")
+    if note_ids is None:
+        return abort(400)
+    if note_writer is not None:
+        note_writer.flush(user)
+    # nothing selected exports everything
+    if not note_ids and not image_uids:
+        notes, images = export_items(user)
+    else:
+        notes, images = export_items(user, note_ids, image_uids)
+        if len(notes) != len(set(note_ids)) or len(images) != len(set(image_uids)):
+            return abort(401)
+
+    return jsonify(
+        notes=[{"id": note_id, "timestamp": timestamp, "note": note} for note_id, timestamp, note in notes],
+        images=[
+            {"id": uid, "timestamp": timestamp, "name": name, "size": size, "sha256": content_hash,
+             "url": url_for("get_image", image_uid=uid, _external=True)}
+            for uid, timestamp, name, size, content_hash in images
+        ],
+    )
+
+
+@app.route("/archive", methods=["GET"])
+def export_archive():
+    user = _archive_user()
+    if note_writer is not None:
+        note_writer.flush(user)
+    return Response(
+        archive.export_user(user, app.config['UPLOAD_FOLDER']), content_type=archive.CONTENT_TYPE,
+        headers={"Content-Disposition": 'attachment; filename="%s.tar"' % (secure_filename(user.lower()) or "notes")}
+    )
+
+
+@app.route("/archive", methods=["POST"])
+def import_archive():
+    user = _archive_user()
+    # the body is read as a stream, which MAX_CONTENT_LENGTH does not limit
+    if request.content_length is None:
+        return abort(411)
+    if request.content_length > app.config['ARCHIVE_IMPORT_MAX_LENGTH']:
+        return abort(413)
+
+    try:
+        notes, images, missing = archive.import_user(
+            user, app.config['UPLOAD_FOLDER'], request.stream, app.config['ARCHIVE_IMPORT_BATCH_SIZE']
+        )
+    except (tarfile.TarError, ValueError, KeyError, TypeError):
+        return abort(400)
+    finally:
+        user_cache.invalidate(user)
+    return jsonify(notes=notes, images=images, missing=missing), 201
+
+
 @app.route("/add_user", methods=["POST"])
 def add_user_route():
-    if session.get("current_user") != "ADMIN":
+    if _current_user() != "ADMIN":
         return abort(401)
 
     new_id = request.form.get("id", "").upper()
     pw = request.form.get("pw")
 
-    if new_id in list_users():
-        return render_template("admin.html", users=_render_users(), id_to_add_is_duplicated=True)
+    if user_exists(new_id):
+        return render_template("admin.html", users_table=_render_users(), id_to_add_is_duplicated=True)
 
     if " " in new_id or "'" in new_id:
-        return render_template("admin.html", users=_render_users(), id_to_add_is_invalid=True)
+        return render_template("admin.html", users_table=_render_users(), id_to_add_is_invalid=True)
 
     add_user(new_id, pw)
     return redirect(url_for("get_admin"))
@@ -168,27 +530,261 @@ def add_user_route():
 
 @app.route("/delete_user/<user_id>/", methods=["GET"])
 def delete_user(user_id):
-    if session.get("current_user") != "ADMIN":
+    if _current_user() != "ADMIN":
         return abort(401)
     if user_id == "ADMIN":
         return abort(403)
 
-    images = [img[0] for img in list_images_for_user(user_id)]
-    folder = app.config['UPLOAD_FOLDER']
+    user_deleter.submit(user_id)
+    app.session_interface.forget_user(user_id)
+    user_cache.invalidate(user_id)
+    return redirect(url_for("get_admin"))
 
-    for uid in images:
-        file = next((f for f in os.listdir(folder) if f.startswith(uid)), None)
-        if file:
-            os.remove(os.path.join(folder, file))
 
-    delete_user_from_db(user_id)
-    return redirect(url_for("get_admin"))
+@app.route("/delete_user/<user_id>/status", methods=["GET"])
+def delete_user_status(user_id):
+    if _current_user() != "ADMIN":
+        return abort(401)
+
+    jobs = user_deletions(user_id)
+    if jobs:
+        return jsonify(_deletion_progress(jobs[0]))
+    if user_exists(user_id):
+        return abort(404)
+    return jsonify(user=user_id, state="deleted")
 
 
 # === Helpers === #
-def _render_users():
-    user_list = list_users()
-    return zip(range(1, len(user_list) + 1), user_list, [f"/delete_user/{u}" for u in user_list])
+def _check_profiling_access():
+    """Aborts unless profiling is enabled and the configured token, if any, is given."""
+    if not profiler.enabled:
+        abort(404)
+    token = profiler.token
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + token):
+        abort(401)
+
+
+def _current_user():
+    """User logged in for the current request, looked up once per request."""
+    if "current_user" not in g:
+        g.current_user = session.get("current_user")
+    return g.current_user
+
+
+def _archive_user():
+    """User whose archive is read or written: the current user, or any user named by ADMIN."""
+    user = _current_user()
+    if not user:
+        abort(401)
+    requested = request.args.get("user", "").upper()
+    if not requested or requested == user:
+        return user
+    if user != "ADMIN":
+        abort(401)
+    if not user_exists(requested):
+        abort(404)
+    return requested
+
+
+def _render_users(prefix="", after=None, limit=None):
+    # not cached: the counts change with every note and image of every user,
+    # and a page is one range of the users primary key
+    prefix = prefix.strip().upper()
+    users, users_next = list_users_page(limit or app.config['PAGE_SIZE'], after or None, prefix)
+    # links go to /admin/ also when rendered by add_user_route
+    query = {"q": prefix} if prefix else {}
+    if "users_limit" in request.args:
+        query["users_limit"] = limit
+    return Markup(render_template(
+        "users_table.html", users=users,
+        users_next=users_next and url_for("get_admin", users_after=users_next, **query),
+        users_first=after is not None and url_for("get_admin", **query)
+    ))
+
+
+def _deletion_progress(job):
+    user, requested, notes_total, images_total, notes_deleted, images_deleted, files_removed, _ = job
+    # items created after the request are deleted too and may exceed the totals
+    done = min(notes_deleted + images_deleted, notes_total + images_total)
+    return {
+        "user": user, "state": "deleting", "requested": requested,
+        "notes": {"deleted": notes_deleted, "total": notes_total},
+        "images": {"deleted": images_deleted, "total": images_total},
+        "files_removed": files_removed,
+        "percent": 100 * done // max(notes_total + images_total, 1),
+    }
+
+
+def _render_notes_table(user, limit, before):
+    # queued notes are read first: one committed in between is then read from
+    # the database, and shows up once
+    pending = note_writer.pending(user) if note_writer is not None and before is None else []
+    notes, notes_next = read_notes_page(user, limit, _decode_cursor(before))
+    if pending:
+        committed = {note[0] for note in notes}
+        notes = [note for note in pending if note[0] not in committed] + notes
+    return Markup(render_template(
+        "notes_table.html", notes=notes,
+        notes_next=notes_next and _page_url(notes_before=_encode_cursor(notes_next)),
+        notes_first=before is not None and _page_url(notes_before=None)
+    ))
+
+
+def _render_images_table(user, limit, before):
+    images, images_next = list_images_page(user, limit, _decode_cursor(before))
+    return Markup(render_template(
+        "images_table.html", images=images,
+        images_next=images_next and _page_url(images_before=_encode_cursor(images_next)),
+        images_first=before is not None and _page_url(images_before=None)
+    ))
+
+
+def _render_cached(template_name, status=200):
+    """
+    Serve a page whose content only depends on the template and on the
+    logged-in user from memory, with an ETag and Last-Modified date so that
+    browsers can revalidate it with a 304 response.
+    """
+    if session.get("_flashes"):
+        # flashed messages are shown once: such a page cannot be reused
+        return render_template(template_name), status
+
+    key = f"{template_name}:{_current_user()}"
+    entry = page_cache.get(key)
+    if entry is cache.MISSING:
+        body = render_template(template_name).encode()
+        entry = (body, hashlib.sha256(body).hexdigest()[:32], datetime.datetime.utcnow().replace(microsecond=0))
+        page_cache.set(key, entry, app.config['PAGE_CACHE_TTL'])
+
+    body, etag, last_modified = entry
+    response = Response(body, status=status, mimetype="text/html")
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = "private, no-cache"
+    if status == 200:
+        response.make_conditional(request)
+    return response
+
+
+def _stream_template(template_name, **context):
+    """Render a template chunk by chunk instead of building the whole page first."""
+    # Flashed messages are popped from the session, which is saved before a
+    # streamed body is produced: read them now so they are only shown once.
+    get_flashed_messages(with_categories=True)
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return Response(stream_with_context(template.generate(context)))
+
+
+def _asset_url(name):
+    """URL of a static asset, fingerprinted when `python assets.py` has been run."""
+    fingerprinted = assets.load_manifest(app.config['ASSETS_FOLDER']).get(name)
+    if fingerprinted is None:
+        return url_for("static", filename=name)
+    return url_for("get_asset", filename=fingerprinted)
+
+
+def _remove_image_file(key):
+    """
+    Remove an image file and its resized variants from the image store. The
+    file goes first: a variant generated meanwhile is then removed by
+    thumbnails.generate().
+    """
+    image_store.remove(app.config['UPLOAD_FOLDER'], key)
+    thumbnails.remove_variants(app.config['UPLOAD_FOLDER'], key)
+
+
+def _remove_image_files(keys):
+    """Remove many image files and their variants in parallel."""
+    if len(keys) <= 1:
+        for key in keys:
+            _remove_image_file(key)
+        return
+    with ThreadPoolExecutor(max_workers=min(len(keys), app.config['BULK_REMOVE_WORKERS'])) as pool:
+        list(pool.map(_remove_image_file, keys))
+
+
+def _bulk_values(name):
+    """Values of a list argument, from a JSON body or from repeated form or query fields."""
+    if request.is_json:
+        values = (request.get_json(silent=True) or {}).get(name, [])
+        return [str(value) for value in values] if isinstance(values, list) else []
+    return request.values.getlist(name)
+
+
+def _bulk_note_ids():
+    """note_id values of a bulk request as integers; None when one cannot be a note id."""
+    try:
+        return [int(value) for value in _bulk_values("note_id")]
+    except ValueError:
+        return None
+
+
+def _bulk_response(result, status=200):
+    """JSON for API clients; forms posted from the private page go back to it."""
+    if request.is_json or request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json":
+        return jsonify(result), status
+    return redirect(url_for("get_private"))
+
+
+def _send_image(key, etag):
+    """
+    Serve the file stored under key. The body is handed to the front-end
+    server through X-Accel-Redirect when IMAGE_ACCEL_REDIRECT_PREFIX is set,
+    or to the WSGI server's file wrapper (sendfile) otherwise.
+    """
+    prefix = app.config['IMAGE_ACCEL_REDIRECT_PREFIX']
+    if prefix:
+        response = Response(mimetype=mimetypes.guess_type(key)[0])
+        response.headers['X-Accel-Redirect'] = prefix.rstrip("/") + "/" + key
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+    else:
+        path = os.path.abspath(image_store.path_for(app.config['UPLOAD_FOLDER'], key))
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return abort(404)
+        response = send_file(path, add_etags=False, conditional=False)
+        response.set_etag(etag)
+        response = response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+    # only the owner may see an image, so shared caches must not keep it
+    response.headers['Cache-Control'] = "private, max-age=%d, immutable" % app.config['IMAGE_MAX_AGE']
+    return response
+
+
+def _page_size(arg):
+    """Page size requested through the query string, bounded by MAX_PAGE_SIZE."""
+    size = request.args.get(arg, app.config['PAGE_SIZE'], type=int)
+    return min(max(size, 1), app.config['MAX_PAGE_SIZE'])
+
+
+def _encode_cursor(key):
+    return "|".join(map(str, key))
+
+
+def _decode_cursor(value):
+    """Turn a 'timestamp|id' query string value back into a keyset position."""
+    if not value or "|" not in value:
+        return None
+    return tuple(value.split("|", 1))
+
+
+def _highlight(snippet):
+    """HTML of a search snippet, with the matches marked."""
+    return escape(snippet).replace(SNIPPET_START, Markup("<mark>")).replace(SNIPPET_END, Markup("</mark>"))
+
+
+def _page_url(**args):
+    """URL of the current page with the given query string arguments replaced."""
+    query = request.args.to_dict()
+    for name, value in args.items():
+        if value is None:
+            query.pop(name, None)
+        else:
+            query[name] = value
+    return url_for(request.endpoint, **query)
 
 
 # === Run Server === #
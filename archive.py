@@ -0,0 +1,260 @@
+"""
+Streaming export and import of the notes and images of one user, as a tar
+archive.
+
+An archive holds, in this order:
+
+    notes/000001.jsonl    up to PAGE_SIZE notes, one JSON object per line:
+    notes/000002.jsonl    {"id", "timestamp", "note"}
+    ...
+    images/000001.jsonl   up to PAGE_SIZE images: {"id", "timestamp", "name",
+                          "size", "sha256", "file"}
+    files/<sha256>        the files of these images not already in the archive
+    images/000002.jsonl
+    ...
+
+Neither side holds more than one page of rows in memory, and files are
+copied in chunks of image_store.CHUNK_SIZE, so the size of an archive is
+only bounded by the disk. Export reads the database page by page; import
+commits every batch_size notes or images. An import that fails keeps the
+batches committed before the failure.
+
+Usage: python archive.py export USER [ARCHIVE] [--pool POOL] [--target DB]
+       python archive.py import USER [ARCHIVE] [--pool POOL] [--target DB]
+"""
+
+import argparse
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import sys
+import tarfile
+import time
+
+from werkzeug.utils import secure_filename
+
+import database
+import image_store
+
+# Notes or images per member of the archive, and per database query on export.
+PAGE_SIZE = 1000
+
+CONTENT_TYPE = "application/x-tar"
+
+
+def export_user(user_id, pool):
+    """Generate the archive of the notes and images of user_id, chunk by chunk."""
+    mtime = int(time.time())
+    number, before = 0, None
+    while True:
+        notes, before = database.read_notes_page(user_id, PAGE_SIZE, before)
+        if notes:
+            number += 1
+            yield from _member("notes/%06d.jsonl" % number, mtime, _json_lines(
+                {"id": note_id, "timestamp": timestamp, "note": note} for note_id, timestamp, note in notes
+            ))
+        if before is None:
+            break
+
+    written = set()
+    number, before = 0, None
+    while True:
+        images, before = database.list_image_files_page(user_id, PAGE_SIZE, before)
+        files = {}
+        for uid, timestamp, name, size, content_hash, key in images:
+            if key is not None:
+                files.setdefault("files/%s" % (content_hash or uid), key)
+        if images:
+            number += 1
+            yield from _member("images/%06d.jsonl" % number, mtime, _json_lines(
+                {"id": uid, "timestamp": timestamp, "name": name, "size": size, "sha256": content_hash,
+                 "file": key and "files/%s" % (content_hash or uid)}
+                for uid, timestamp, name, size, content_hash, key in images
+            ))
+        for member_name, key in files.items():
+            if member_name not in written:
+                written.add(member_name)
+                yield from _file_member(member_name, mtime, image_store.path_for(pool, key))
+        if before is None:
+            break
+
+    yield b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+def _checked(record, *fields):
+    """record, once fields are known to be strings; raises ValueError otherwise."""
+    for field in fields:
+        if not isinstance(record[field], str):
+            raise ValueError("%s is not a string" % field)
+    return record
+
+
+def import_user(user_id, pool, stream, batch_size=500):
+    """
+    Add the notes and images of the archive read from stream to user_id, with
+    new ids. Returns the numbers of notes and images added, and of images
+    left out because the archive did not hold their file or their name has no
+    allowed extension. Raises ValueError when a record field is not a string.
+    """
+    notes, images = [], []
+    added = [0, 0]
+    # records waiting for their file, and files already stored, by member name
+    waiting, stored = {}, {}
+    # records without a file at all
+    missing = 0
+    upload_time, sequence = str(datetime.datetime.now()), itertools.count()
+
+    def remove_files(keys):
+        for key in keys:
+            image_store.remove(pool, key)
+
+    def flush_notes():
+        database.create_items(notes)
+        added[0] += len(notes)
+        notes.clear()
+
+    def flush_images():
+        try:
+            database.create_items((), [row[:7] for row in images], remove_files)
+        finally:
+            for row in images:
+                if row[7] is not None:
+                    image_store.discard(row[7])
+        added[1] += len(images)
+        images.clear()
+
+    def add_image(record, digest, size, key, tmp_path):
+        uid = hashlib.sha256((upload_time + str(next(sequence)) + record["name"]).encode()).hexdigest()
+        if tmp_path is None:
+            place_file = lambda existing_key: existing_key or key
+        else:
+            place_file = lambda existing_key: image_store.place(pool, tmp_path, key, existing_key)
+        images.append((uid, user_id, record["name"], record["timestamp"], digest, size, place_file, tmp_path))
+        if len(images) >= batch_size:
+            flush_images()
+
+    try:
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if member.name.startswith("notes/"):
+                    for line in tar.extractfile(member):
+                        record = _checked(json.loads(line), "note", "timestamp")
+                        notes.append(database.new_note(user_id, record["note"], record["timestamp"]))
+                        if len(notes) >= batch_size:
+                            flush_notes()
+                elif member.name.startswith("images/"):
+                    for line in tar.extractfile(member):
+                        record = _checked(json.loads(line), "name", "timestamp")
+                        # the name ends up in the storage key and gives the
+                        # type the image is served with, as for an upload
+                        record["name"] = secure_filename(record["name"])
+                        if record["file"] is None or not image_store.allowed_file(record["name"]):
+                            missing += 1
+                        elif record["file"] in stored:
+                            add_image(record, *stored[record["file"]], None)
+                        else:
+                            waiting.setdefault(record["file"], []).append(record)
+                elif member.name in waiting:
+                    records = waiting.pop(member.name)
+                    digest, size, tmp_path = image_store.receive(pool, tar.extractfile(member))
+                    key = image_store.content_key(digest, records[0]["name"])
+                    stored[member.name] = (digest, size, key)
+                    # the first image places the file, the others share it
+                    add_image(records[0], digest, size, key, tmp_path)
+                    for record in records[1:]:
+                        add_image(record, digest, size, key, None)
+        if notes:
+            flush_notes()
+        if images:
+            flush_images()
+    except BaseException:
+        for row in images:
+            if row[7] is not None:
+                image_store.discard(row[7])
+        raise
+
+    return added[0], added[1], missing + sum(len(records) for records in waiting.values())
+
+
+def _member(name, mtime, data):
+    info = tarfile.TarInfo(name)
+    info.size, info.mtime = len(data), mtime
+    yield info.tobuf(tarfile.PAX_FORMAT)
+    yield data + _padding(len(data))
+
+
+def _file_member(name, mtime, path):
+    try:
+        stored = open(path, "rb")
+    except FileNotFoundError:
+        # deleted since its page was read: its images are left out on import
+        return
+    with stored:
+        # stored files never change, so the size read now is the size sent
+        info = tarfile.TarInfo(name)
+        info.size, info.mtime = os.fstat(stored.fileno()).st_size, mtime
+        yield info.tobuf(tarfile.PAX_FORMAT)
+        for chunk in iter(lambda: stored.read(image_store.CHUNK_SIZE), b""):
+            yield chunk
+        yield _padding(info.size)
+
+
+def _padding(size):
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
+
+
+def _json_lines(records):
+    return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode()
+
+
+def _export_command(args):
+    if not database.user_exists(args.user):
+        sys.exit("archive.py: no user %s" % args.user)
+    out = sys.stdout.buffer if args.archive == "-" else open(args.archive, "wb")
+    with out:
+        for chunk in export_user(args.user, args.pool):
+            out.write(chunk)
+
+
+def _import_command(args):
+    if not database.user_exists(args.user):
+        sys.exit("archive.py: no user %s" % args.user)
+    source = sys.stdin.buffer if args.archive == "-" else open(args.archive, "rb")
+    with source:
+        notes, images, missing = import_user(args.user, args.pool, source)
+    print("notes   %6d imported" % notes)
+    print("images  %6d imported, %6d files missing" % (images, missing))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import the notes and images of a user.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("export", help="write the archive of a user")
+    command.add_argument("user", type=str.upper)
+    command.add_argument("archive", nargs="?", default="-", help="file to write (default: standard output)")
+    command.set_defaults(func=_export_command)
+
+    command = commands.add_parser("import", help="add the notes and images of an archive to a user")
+    command.add_argument("user", type=str.upper)
+    command.add_argument("archive", nargs="?", default="-", help="file to read (default: standard input)")
+    command.set_defaults(func=_import_command)
+
+    for command in commands.choices.values():
+        command.add_argument("--pool", default="image_pool")
+        command.add_argument("--target", default=database.DB_FILE_LOCATION)
+
+    args = parser.parse_args(argv)
+    database.DB_FILE_LOCATION = args.target
+    try:
+        args.func(args)
+    finally:
+        database.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+ASGI entry point: python serve.py --asgi, or any ASGI server, e.g.
+`uvicorn asgi:application`.
+
+Request bodies are received by the event loop and spooled to a temporary
+file, in memory up to ASGI_SPOOL_SIZE bytes, so a client sending a large
+upload slowly does not hold a thread. Once a body is complete the request
+runs on a pool of ASGI_THREADS threads, where the database queries and the
+file I/O of the routes happen; the event loop only relays the response.
+Bodies larger than MAX_CONTENT_LENGTH are not read past the limit.
+"""
+
+import asyncio
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, note_writer
+
+_END = object()
+
+
+class ASGIAdapter:
+    """Serve a WSGI application through ASGI, running it on a thread pool."""
+
+    def __init__(self, wsgi_app, threads=16, spool_size=1024 * 1024, max_content_length=None):
+        self.wsgi_app = wsgi_app
+        self.spool_size = spool_size
+        self.max_content_length = max_content_length
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError("unsupported ASGI scope type %r" % scope["type"])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if note_writer is not None:
+                    await asyncio.get_running_loop().run_in_executor(self._executor, note_writer.flush)
+                self._executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        received = await self._receive_body(scope, receive)
+        if received is None:
+            return
+        body, length = received
+        try:
+            environ = self._environ(scope, body, length)
+            chunks = asyncio.Queue(maxsize=8)
+            stop = threading.Event()
+            task = loop.run_in_executor(self._executor, self._run, environ, loop, chunks, stop)
+            try:
+                while True:
+                    item = await chunks.get()
+                    if item is _END:
+                        break
+                    await send(item)
+            finally:
+                # let the worker thread finish if the client went away
+                stop.set()
+                while not chunks.empty():
+                    chunks.get_nowait()
+                await task
+        finally:
+            body.close()
+
+    async def _receive_body(self, scope, receive):
+        """
+        Spool the request body. Returns the file and the length to report to
+        the application, or None when the client went away.
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        declared = dict(scope["headers"]).get(b"content-length")
+        limit = self.max_content_length
+        if declared is not None and limit is not None and int(declared) > limit:
+            # the application answers 413 from the declared length alone
+            return body, int(declared)
+
+        loop = asyncio.get_running_loop()
+        length = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return None
+            chunk = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            length += len(chunk)
+            if limit is not None and length > limit:
+                return body, length
+            if length > self.spool_size:
+                # past spool_size the file is on disk
+                await loop.run_in_executor(self._executor, body.write, chunk)
+            else:
+                body.write(chunk)
+        body.seek(0)
+        return body, length
+
+    def _environ(self, scope, body, length):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/%s" % scope["http_version"],
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "CONTENT_LENGTH": str(length),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                if name == "CONTENT_TYPE":
+                    environ[name] = value
+                continue
+            key = "HTTP_" + name
+            environ[key] = environ[key] + "," + value if key in environ else value
+        return environ
+
+    def _run(self, environ, loop, chunks, stop):
+        """
+        Run the application and iterate its response on one thread, since
+        streamed responses use the request context bound to that thread.
+        """
+        def put(item):
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        response_start, started = [], []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start[:] = [status, headers]
+            return send_body
+
+        def send_body(data):
+            if not started:
+                status, headers = response_start
+                put({
+                    "type": "http.response.start",
+                    "status": int(status.split(" ", 1)[0]),
+                    "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+                })
+                started.append(True)
+            if data:
+                put({"type": "http.response.body", "body": data, "more_body": True})
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for data in result:
+                    if stop.is_set():
+                        break
+                    send_body(data)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            send_body(b"")
+            put({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            put(_END)
+
+
+application = ASGIAdapter(
+    app, app.config['ASGI_THREADS'], app.config['ASGI_SPOOL_SIZE'], app.config['MAX_CONTENT_LENGTH']
+)
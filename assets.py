@@ -0,0 +1,208 @@
+"""
+Build step for the static assets referenced by layout.html.
+
+Every asset is written to ASSETS_FOLDER under a name containing a hash of its
+content, together with gzip and, when the brotli package is installed,
+brotli compressed copies. CSS rules whose selectors use classes that appear
+in no template are dropped first. manifest.json maps every asset to its
+fingerprinted name, so that pages can link to it and browsers can cache it
+forever.
+
+Usage: python assets.py [--static static] [--templates templates] [--output static/dist]
+"""
+
+import argparse
+import functools
+import gzip
+import hashlib
+import json
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Assets referenced by the templates, relative to the static folder.
+ASSETS = (
+    "css/bootstrap.min.united.css",
+    "js/jquery.min.js",
+    "js/bootstrap.min.js",
+)
+
+# Classes that never appear in a template but are added at runtime by
+# bootstrap.js, or built from a variable (alert-{{ category }}).
+SAFELIST = {
+    "active", "collapse", "collapsing", "disabled", "dropdown-backdrop", "fade", "in", "open",
+    "modal-backdrop", "modal-open", "popover", "tooltip",
+    "alert-success", "alert-info", "alert-warning", "alert-danger",
+}
+
+# Precompressed copies, by content coding, in order of preference.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+MANIFEST = "manifest.json"
+
+_CLASS_ATTRIBUTE = re.compile(r'class="([^"]*)"')
+_JINJA = re.compile(r"{{.*?}}|{%.*?%}")
+_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_SELECTOR_CLASS = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+_FINGERPRINT = re.compile(r"\.[0-9a-f]{12}\.\w+$")
+
+
+def used_classes(template_folder):
+    """Every class name used in a class attribute of the templates."""
+    used = set(SAFELIST)
+    for name in os.listdir(template_folder):
+        with open(os.path.join(template_folder, name), encoding="utf-8") as template:
+            for value in _CLASS_ATTRIBUTE.findall(template.read()):
+                used.update(_JINJA.sub(" ", value).split())
+    return used
+
+
+def _rules(css):
+    """Split a stylesheet into (prelude, block) pairs; block is None for statements."""
+    i = 0
+    while i < len(css):
+        brace = css.find("{", i)
+        semicolon = css.find(";", i)
+        if brace == -1:
+            if css[i:].strip():
+                yield css[i:].strip(), None
+            return
+        if semicolon != -1 and semicolon < brace:
+            yield css[i:semicolon + 1].strip(), None
+            i = semicolon + 1
+            continue
+
+        depth, j = 0, brace
+        while j < len(css):
+            if css[j] == "{":
+                depth += 1
+            elif css[j] == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+            j += 1
+        yield css[i:brace].strip(), css[brace + 1:j]
+        i = j + 1
+
+
+def purge_css(css, used):
+    """
+    Drop the selectors of css that use a class missing from used, and the
+    rules left without selectors. /*! license comments are kept at the top.
+    """
+    licenses = [comment for comment in _COMMENT.findall(css) if comment.startswith("/*!")]
+    return "\n".join(licenses + [_purge_rules(_COMMENT.sub("", css), used)])
+
+
+def _purge_rules(css, used):
+    kept = []
+    for prelude, block in _rules(css):
+        if block is None:
+            kept.append(prelude)
+        elif prelude.startswith(("@media", "@supports")):
+            inner = _purge_rules(block, used)
+            if inner:
+                kept.append(prelude + "{" + inner + "}")
+        elif prelude.startswith("@"):
+            kept.append(prelude + "{" + block + "}")
+        else:
+            selectors = [
+                selector for selector in prelude.split(",")
+                if used.issuperset(_SELECTOR_CLASS.findall(selector))
+            ]
+            if selectors:
+                kept.append(",".join(selectors) + "{" + block + "}")
+    return "".join(kept)
+
+
+def build(static_folder, template_folder, output_folder):
+    """Fingerprint and precompress ASSETS into output_folder; returns the manifest."""
+    used = used_classes(template_folder)
+    manifest = {}
+    for name in ASSETS:
+        with open(os.path.join(static_folder, name), "rb") as source:
+            data = source.read()
+        if name.endswith(".css"):
+            data = purge_css(data.decode("utf-8"), used).encode("utf-8")
+
+        base, extension = os.path.splitext(name)
+        fingerprinted = f"{base}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+        target = os.path.join(output_folder, fingerprinted)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as out:
+            out.write(data)
+        with open(target + ".gz", "wb") as out:
+            out.write(gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(target + ".br", "wb") as out:
+                out.write(brotli.compress(data))
+        manifest[name] = fingerprinted
+
+    with open(os.path.join(output_folder, MANIFEST), "w") as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+    return manifest
+
+
+def is_fingerprinted(name):
+    """Whether name was written by build() under a hash of its content."""
+    return _FINGERPRINT.search(name) is not None
+
+
+def load_manifest(output_folder):
+    """
+    Manifest written by build(), or an empty one when assets were not built.
+    It is read again when its modification time changes, so a new build is
+    picked up without a restart.
+    """
+    path = os.path.join(output_folder, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    return _read_manifest(path, mtime)
+
+
+@functools.lru_cache(maxsize=8)
+def _read_manifest(path, mtime):
+    try:
+        with open(path) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+
+
+def choose_encoding(path, accept_encodings):
+    """
+    Best precompressed copy of path accepted by the client, as a
+    (content coding, file path) pair; the coding is None for the original.
+    """
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings[encoding] and os.path.exists(path + suffix):
+            return encoding, path + suffix
+    return None, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build fingerprinted, precompressed static assets.")
+    parser.add_argument("--static", default="static")
+    parser.add_argument("--templates", default="templates")
+    parser.add_argument("--output", default=os.path.join("static", "dist"))
+    args = parser.parse_args()
+
+    manifest = build(args.static, args.templates, args.output)
+    for name, fingerprinted in sorted(manifest.items()):
+        sizes = [os.path.getsize(os.path.join(args.static, name))]
+        sizes += [
+            os.path.getsize(os.path.join(args.output, fingerprinted + suffix))
+            for suffix in ("",) + tuple(suffix for _, suffix in ENCODINGS)
+            if os.path.exists(os.path.join(args.output, fingerprinted + suffix))
+        ]
+        print("%-40s %s" % (fingerprinted, " -> ".join("%d" % size for size in sizes)))
+
+
+if __name__ == "__main__":
+    main()
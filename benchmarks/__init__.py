@@ -0,0 +1,3 @@
+"""
+Benchmarks for the web application, run with ``python -m benchmarks.<name>``.
+"""
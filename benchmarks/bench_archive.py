@@ -0,0 +1,74 @@
+"""
+Measure the throughput and the memory used by the export and import of
+archives as the images of a user grow.
+
+Every size is seeded into a fresh temporary database and image pool: one user
+with --notes notes and `count` distinct images of --image-size MB. Its archive
+is exported to a file, then imported into another user. The peak of memory
+allocated by Python during each step (tracemalloc) stays flat as the archive
+grows.
+
+Usage: python -m benchmarks.bench_archive [--images 10,100,...] [--image-size MB] [--notes N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import archive
+import database
+from benchmarks import seed
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func()
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", default="10,100,500")
+    parser.add_argument("--image-size", type=float, default=1.0, help="MB per image")
+    parser.add_argument("--notes", type=int, default=10000)
+    args = parser.parse_args()
+
+    seed.IMAGE_SIZE = int(args.image_size * 1024 * 1024)
+    print("%8s %10s %16s %12s %16s %12s" % ("images", "archive", "export", "peak", "import", "peak"))
+    for count in (int(n) for n in args.images.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            database.close_connections()
+            database.DB_FILE_LOCATION = os.path.join(tmp, "app.db")
+            pool = os.path.join(tmp, "pool")
+            seed.seed(database.DB_FILE_LOCATION, pool, users=1, notes=args.notes, images=count)
+            database.add_user("copy", "pw")
+            path = os.path.join(tmp, "user0.tar")
+
+            def export():
+                with open(path, "wb") as out:
+                    for chunk in archive.export_user("USER0", pool):
+                        out.write(chunk)
+
+            def import_():
+                with open(path, "rb") as source:
+                    return archive.import_user("COPY", pool, source)
+
+            _, exported, export_peak = _measure(export)
+            size = os.path.getsize(path) / 1024 / 1024
+            _, imported, import_peak = _measure(import_)
+            print("%8d %7.0f MB %10.0f MB/s %9.1f MB %10.0f MB/s %9.1f MB" % (
+                count, size, size / exported, export_peak / 1024 / 1024, size / imported, import_peak / 1024 / 1024
+            ))
+            database.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compare the pooled connection manager of database.py against the former
+connect-per-call behaviour.
+
+Usage: python -m benchmarks.bench_connections [--calls N] [--notes N]
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import database
+
+
+def _seed(notes):
+    """Give a single user `notes` notes, in the database at DB_FILE_LOCATION."""
+    database.add_user("bench", "pw")
+    database.create_items([database.new_note("bench", "note %d" % i) for i in range(notes)])
+    database.close_connections()
+
+
+def _read_per_call(path, user_id):
+    """The connect -> query -> close sequence used before the connection manager."""
+    _conn = sqlite3.connect(path)
+    _c = _conn.cursor()
+    _c.execute("SELECT note_id, timestamp, note FROM notes WHERE user = ?;", (user_id,))
+    result = _c.fetchall()
+    _conn.commit()
+    _conn.close()
+    return result
+
+
+def _time(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--notes", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "app.db")
+        # both runs read the same file, created with the current schema
+        database.close_connections()
+        database.DB_FILE_LOCATION = path
+        _seed(args.notes)
+
+        per_call = _time(lambda: _read_per_call(path, "BENCH"), args.calls)
+        try:
+            pooled = _time(lambda: database.read_note_from_db("BENCH"), args.calls)
+        finally:
+            database.close_connections()
+
+    print("read_note_from_db, %d calls, %d notes" % (args.calls, args.notes))
+    print("  connect per call : %8.1f us/call" % per_call)
+    print("  pooled connection: %8.1f us/call" % pooled)
+    print("  speedup          : %8.1fx" % (per_call / pooled))
+
+
+if __name__ == "__main__":
+    main()
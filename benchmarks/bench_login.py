@@ -0,0 +1,62 @@
+"""
+Measure /login latency as the number of users grows.
+
+Every size is seeded into a fresh temporary database. The keyed lookup used
+by login() is compared with the former `user_id in list_users()` check.
+
+Usage: python -m benchmarks.bench_login [--sizes 100,1000,...] [--logins N]
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import database
+from app import app
+
+
+def _seed(users):
+    """Insert `users` accounts sharing the password 'pw', plus USER0."""
+    _conn = database._connect(database.DB_FILE_LOCATION)
+    pw = hashlib.sha256(b"pw").hexdigest()
+    _conn.executemany(
+        "INSERT INTO users (id, pw) VALUES (?, ?);",
+        (("USER%d" % i, pw) for i in range(users))
+    )
+    _conn.commit()
+
+
+def _time(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument("--logins", type=int, default=500)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    target = "USER0"
+    print("%10s %18s %18s %18s" % ("users", "POST /login", "user_exists", "in list_users()"))
+    for size in (int(n) for n in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            database.close_connections()
+            database.DB_FILE_LOCATION = os.path.join(tmp, "app.db")
+            _seed(size)
+
+            login = _time(lambda: client.post("/login", data={"id": target, "pw": "pw"}), args.logins)
+            keyed = _time(lambda: database.user_exists(target), args.logins)
+            scan = _time(lambda: target in database.list_users(), max(args.logins // 10, 1))
+            database.close_connections()
+
+        print("%10d %15.1f us %15.1f us %15.1f us" % (size, login, keyed, scan))
+
+
+if __name__ == "__main__":
+    main()
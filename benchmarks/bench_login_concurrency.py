@@ -0,0 +1,91 @@
+"""
+Measure /login throughput and latency percentiles under concurrent logins.
+
+Each hasher is seeded into a fresh temporary database and hammered by
+--threads clients, first with the verification cache disabled, so that every
+login derives a key, then with it enabled. --workers sets the size of the
+pool running the key derivation.
+
+Usage: python -m benchmarks.bench_login_concurrency [--users N] [--logins N] [--threads N] [--workers N]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import cache
+import database
+import passwords
+from app import app
+
+
+def _seed(users, encoded):
+    """Insert `users` accounts whose stored password is `encoded`."""
+    _conn = database._connect(database.DB_FILE_LOCATION)
+    _conn.executemany(
+        "INSERT INTO users (id, pw) VALUES (?, ?);",
+        (("USER%d" % i, encoded) for i in range(users))
+    )
+    _conn.commit()
+
+
+def _hammer(users, logins, threads):
+    """Run `logins` logins spread over `threads` clients; returns (seconds, latencies)."""
+    latencies = []
+    lock = threading.Lock()
+
+    def client_loop(offset):
+        client = app.test_client()
+        mine = []
+        for i in range(offset, logins, threads):
+            start = time.perf_counter()
+            client.post("/login", data={"id": "USER%d" % (i % users), "pw": "pw"})
+            mine.append(time.perf_counter() - start)
+        database.close_connections()
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=client_loop, args=(offset,)) for offset in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--logins", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=passwords.WORKERS)
+    args = parser.parse_args()
+
+    passwords.configure(workers=args.workers)
+    hashers = (passwords.HASHERS["scrypt"], passwords.HASHERS["pbkdf2_sha256"])
+    print("%-14s %-6s %12s %12s %12s" % ("hasher", "cache", "logins/s", "p50", "p99"))
+    for hasher in hashers:
+        passwords.hasher = hasher
+        for cached in (False, True):
+            # a backend holding no entry forgets every verification at once
+            passwords._verified = cache.LocalBackend(passwords.VERIFY_CACHE_SIZE if cached else 0)
+            with tempfile.TemporaryDirectory() as tmp:
+                database.close_connections()
+                database.DB_FILE_LOCATION = os.path.join(tmp, "app.db")
+                _seed(args.users, passwords.make("pw"))
+                elapsed, latencies = _hammer(args.users, args.logins, args.threads)
+                database.close_connections()
+
+            quantiles = statistics.quantiles(latencies, n=100)
+            print("%-14s %-6s %12.1f %9.1f ms %9.1f ms" % (
+                hasher.algorithm, "on" if cached else "off",
+                len(latencies) / elapsed, quantiles[49] * 1e3, quantiles[98] * 1e3,
+            ))
+
+
+if __name__ == "__main__":
+    main()
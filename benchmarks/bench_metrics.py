@@ -0,0 +1,55 @@
+"""
+Measure the cost of the instrumentation of metrics.py.
+
+A database call (database.user_exists) is timed without its wrapper, with the
+metrics disabled and with them enabled; then / and /private/ are requested
+through the Flask test client as ADMIN, with the metrics disabled and enabled.
+
+Usage: python -m benchmarks.bench_metrics [--calls N] [--requests N]
+"""
+
+import argparse
+import time
+
+import database
+import metrics
+from app import app
+
+
+def _per_call(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    unwrapped = database.user_exists.__wrapped__
+    print("%-32s %12s" % ("database.user_exists", "per call"))
+    print("%-32s %9.2f us" % ("without wrapper", _per_call(lambda: unwrapped("ADMIN"), args.calls)))
+    for enabled in (False, True):
+        metrics.configure(enabled)
+        print("%-32s %9.2f us" % (
+            "metrics %s" % ("enabled" if enabled else "disabled"),
+            _per_call(lambda: database.user_exists("ADMIN"), args.calls)
+        ))
+
+    client = app.test_client()
+    client.post("/login", data={"id": "admin", "pw": "admin"})
+    print("\n%-32s %12s" % ("request", "per request"))
+    for path in ("/", "/private/"):
+        for enabled in (False, True):
+            metrics.configure(enabled)
+            print("%-32s %9.1f us" % (
+                "%s, metrics %s" % (path, "enabled" if enabled else "disabled"),
+                _per_call(lambda: client.get(path).close(), args.requests)
+            ))
+
+
+if __name__ == "__main__":
+    main()
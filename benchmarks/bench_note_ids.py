@@ -0,0 +1,98 @@
+"""
+Measure the storage and lookup cost of note ids before and after schema 8.
+
+Every size is seeded into a database at schema 7, where notes are keyed by a
+64 hex characters SHA-256, which is then copied and migrated to schema 8,
+where they are keyed by an integer. For both, the space used by the notes
+table and its indexes (the full-text index is not counted) is read from the
+dbstat table, and the owner lookup of /delete_note and the deletion of a note,
+which also updates the full-text index, are timed.
+
+Usage: python -m benchmarks.bench_note_ids [--sizes 1000,10000,...] [--lookups N]
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import database
+
+USERS = 100
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua").split()
+
+
+def _seed(db_file, notes):
+    _conn = sqlite3.connect(db_file)
+    for number, script in enumerate(database.SCHEMA_MIGRATIONS[:7], start=1):
+        _conn.executescript("%s\nPRAGMA user_version = %d;" % (script, number))
+    _conn.executemany("INSERT INTO users (id, pw) VALUES (?, 'x');", (("USER%d" % u,) for u in range(USERS)))
+    rng = random.Random(0)
+    _conn.executemany(
+        "INSERT INTO notes (note_id, user, timestamp, note) VALUES (?, ?, ?, ?);",
+        ((hashlib.sha256(b"%d" % i).hexdigest(), "USER%d" % (i % USERS), "2025-01-01 %09d" % i,
+          " ".join(rng.choices(WORDS, k=10))) for i in range(notes))
+    )
+    _conn.commit()
+    _conn.close()
+
+
+def _measure(db_file, lookups):
+    """Bytes used by notes and its indexes, and microseconds per lookup and per deletion."""
+    _conn = sqlite3.connect(db_file)
+    _conn.execute("VACUUM;")
+    size = _conn.execute(
+        "SELECT SUM(pgsize) FROM dbstat WHERE name = 'notes' "
+        "OR name IN (SELECT name FROM sqlite_master WHERE tbl_name = 'notes' AND type = 'index');"
+    ).fetchone()[0]
+    ids = [x[0] for x in _conn.execute("SELECT note_id FROM notes;")]
+    random.Random(0).shuffle(ids)
+    ids = ids[:lookups]
+
+    start = time.perf_counter()
+    for note_id in ids:
+        _conn.execute("SELECT user FROM notes WHERE note_id = ?;", (note_id,)).fetchone()
+    lookup = (time.perf_counter() - start) / len(ids) * 1e6
+
+    start = time.perf_counter()
+    for note_id in ids:
+        _conn.execute("DELETE FROM notes WHERE note_id = ?;", (note_id,))
+    delete = (time.perf_counter() - start) / len(ids) * 1e6
+    _conn.rollback()
+    _conn.close()
+    return size, lookup, delete
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("%10s %-8s %12s %12s %12s %12s" % ("notes", "ids", "notes size", "lookup", "delete", "migration"))
+    for size in (int(n) for n in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            before, after = os.path.join(tmp, "v7.db"), os.path.join(tmp, "v8.db")
+            _seed(before, size)
+            shutil.copy(before, after)
+            _conn = sqlite3.connect(after)
+            start = time.perf_counter()
+            database.ensure_schema(_conn)
+            migration = time.perf_counter() - start
+            _conn.close()
+
+            for label, db_file, extra in (("sha256", before, ""), ("integer", after, "%9.2f s" % migration)):
+                used, lookup, delete = _measure(db_file, args.lookups)
+                print("%10d %-8s %9.1f KB %9.2f us %9.2f us %12s" % (
+                    size, label, used / 1024, lookup, delete, extra
+                ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Measure the cost of the request profiler of profiling.py.
+
+/ and /private/ are requested through the Flask test client as ADMIN with the
+profiler disabled, enabled without profiling any request, and profiling
+every request.
+
+Usage: python -m benchmarks.bench_profiling [--requests N]
+"""
+
+import argparse
+import time
+
+from app import app, profiler
+
+
+def _per_request(client, path, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(path)
+        response.get_data()
+        response.close()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    client.post("/login", data={"id": "admin", "pw": "admin"})
+    print("%-36s %12s" % ("request", "per request"))
+    for path in ("/", "/private/"):
+        for label, enabled, rate in (("disabled", False, 0.0), ("enabled, rate 0", True, 0.0),
+                                     ("enabled, rate 1", True, 1.0)):
+            profiler.enabled, profiler.sample_rate = enabled, rate
+            print("%-36s %9.1f us" % ("%s, %s" % (path, label), _per_request(client, path, args.requests)))
+    profiler.enabled, profiler.sample_rate = False, 0.0
+    profiler.reset()
+
+
+if __name__ == "__main__":
+    main()
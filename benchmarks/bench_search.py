@@ -0,0 +1,80 @@
+"""
+Measure note search latency as the number of notes grows.
+
+Every size is seeded into a fresh temporary database, with the notes spread
+over 100 users. The full-text search of /search is compared with a
+`note LIKE '%word%'` scan of the user's notes, for a word found in about one
+note in ten and for a word found in one note per user.
+
+Usage: python -m benchmarks.bench_search [--sizes 1000,10000,...] [--searches N]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import database
+
+USERS = 100
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua").split()
+
+
+def _seed(notes):
+    """Insert `notes` notes of ten random words, plus 'common' in one in ten and one 'rare' per user."""
+    _conn = database._connect(database.DB_FILE_LOCATION)
+    _conn.executemany("INSERT INTO users (id, pw) VALUES (?, 'x');", (("USER%d" % u,) for u in range(USERS)))
+    rng = random.Random(0)
+
+    def rows():
+        for i in range(notes):
+            words = rng.choices(WORDS, k=10)
+            if i % 10 == 0:
+                words.append("common")
+            if i < USERS:
+                words.append("rare")
+            yield i + 1, "USER%d" % (i % USERS), "2025-01-01 %09d" % i, " ".join(words)
+
+    _conn.executemany("INSERT INTO notes (note_id, user, timestamp, note) VALUES (?, ?, ?, ?);", rows())
+    _conn.commit()
+
+
+def _like(user, word, limit):
+    _conn = database._connect(database.DB_FILE_LOCATION)
+    return _conn.execute(
+        "SELECT note_id, timestamp, note FROM notes WHERE user = ? AND note LIKE ? LIMIT ?;",
+        (user, "%" + word + "%", limit)
+    ).fetchall()
+
+
+def _time(func, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        func("USER%d" % (i % USERS))
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--searches", type=int, default=500)
+    args = parser.parse_args()
+
+    print("%10s %-8s %15s %15s" % ("notes", "word", "FTS", "LIKE"))
+    for size in (int(n) for n in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            database.close_connections()
+            database.DB_FILE_LOCATION = os.path.join(tmp, "app.db")
+            _seed(size)
+            for word in ("common", "rare"):
+                fts = _time(lambda user: database.search_notes(user, [word], 50), args.searches)
+                like = _time(lambda user: _like(user, word, 50), args.searches)
+                print("%10d %-8s %12.1f us %12.1f us" % (size, word, fts, like))
+            database.close_connections()
+
+
+if __name__ == "__main__":
+    main()
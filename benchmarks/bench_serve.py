@@ -0,0 +1,118 @@
+"""
+Compare the throughput of serve.py with the development server of app.py.
+
+Each server is started in its own process and loaded by --clients threads,
+each opening a new connection per request, for --seconds seconds per page.
+Requests are made as ADMIN, logged in through /login, so that /private/
+exercises the session, the database and the page cache.
+
+Usage: python -m benchmarks.bench_serve [--clients N] [--seconds S] [--workers N] [--threads N]
+"""
+
+import argparse
+import http.client
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+PORT = 8765
+
+PAGES = ("/", "/public/", "/private/")
+
+DEV_SERVER = "from app import app; app.run(debug=False, host='127.0.0.1', port=%d)" % PORT
+
+
+def _request(method, path, headers=None, body=None):
+    connection = http.client.HTTPConnection("127.0.0.1", PORT, timeout=30)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        response.read()
+        return response
+    finally:
+        connection.close()
+
+
+def _wait_until_up(process):
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError("server exited with status %d" % process.returncode)
+        try:
+            _request("GET", "/public/")
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def _login():
+    body = urllib.parse.urlencode({"id": "admin", "pw": "admin"})
+    response = _request("POST", "/login", {"Content-Type": "application/x-www-form-urlencoded"}, body)
+    return response.getheader("Set-Cookie").split(";", 1)[0]
+
+
+def _load(path, cookie, clients, seconds):
+    """Requests per second and latencies of `clients` threads requesting path."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client_loop():
+        mine = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = _request("GET", path, {"Cookie": cookie}).status
+            except OSError as error:
+                status = error
+            if status != 200:
+                errors.append(status)
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client_loop) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / seconds, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    servers = (
+        ("app.run()", [sys.executable, "-c", DEV_SERVER]),
+        ("serve.py", [sys.executable, "serve.py", "--port", str(PORT),
+                      "--workers", str(args.workers), "--threads", str(args.threads)]),
+    )
+    print("%-10s %-10s %10s %10s %10s %7s" % ("server", "page", "req/s", "p50", "p99", "errors"))
+    for name, command in servers:
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_until_up(process)
+            cookie = _login()
+            for path in PAGES:
+                rate, latencies, errors = _load(path, cookie, args.clients, args.seconds)
+                quantiles = statistics.quantiles(latencies, n=100)
+                print("%-10s %-10s %10.0f %7.1f ms %7.1f ms %7d" % (
+                    name, path, rate, quantiles[49] * 1e3, quantiles[98] * 1e3, len(errors)
+                ))
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Seed a database and an image pool of a given size for the benchmarks.
+
+Apart from the salts of the password hashes, the content only depends on
+the arguments: users USER0, USER1, ... (and ADMIN) all have the password
+'pw' ('admin' for ADMIN), their notes are made of words drawn from WORDS by
+a random generator seeded with `seed`, and their images are small distinct
+files stored in the pool as uploads are.
+
+Usage: python -m benchmarks.seed DB_FILE IMAGE_POOL [--users N] [--notes N] [--images N] [--seed N]
+"""
+
+import argparse
+import datetime
+import hashlib
+import os
+import random
+
+import database
+import image_store
+import passwords
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua cafe gare pain lundi").split()
+
+IMAGE_SIZE = 2048
+
+# Items are timestamped one microsecond apart from START, in creation order.
+START = datetime.datetime(2025, 1, 1)
+
+
+def _timestamp(index):
+    # strftime keeps the microseconds when they are 0, unlike str(): every
+    # timestamp has the same width and they sort as text in time order
+    return (START + datetime.timedelta(microseconds=index)).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def seed(db_file, image_pool, users=100, notes=50, images=5, seed=0):
+    """
+Create the schema in db_file and fill it; returns the number of users,
+notes and images written. db_file must not exist yet.
+    """
+    rng = random.Random(seed)
+    _conn = database._connect(db_file)
+    # hashing is the slow part of add_user(): every user shares one hash
+    user_pw, admin_pw = passwords.make("pw"), passwords.make("admin")
+    _conn.execute("INSERT INTO users (id, pw) VALUES ('ADMIN', ?);", (admin_pw,))
+    _conn.executemany("INSERT INTO users (id, pw) VALUES (?, ?);", (("USER%d" % u, user_pw) for u in range(users)))
+
+    def note_rows():
+        for u in range(users):
+            for n in range(notes):
+                text = " ".join(rng.choices(WORDS, k=rng.randint(5, 30)))
+                yield "USER%d" % u, _timestamp(u * notes + n), text, u * notes + n + 1
+
+    _conn.executemany("INSERT INTO notes (user, timestamp, note, note_id) VALUES (?, ?, ?, ?);", note_rows())
+    _conn.execute("UPDATE note_ids SET next = ?;", (users * notes + 1,))
+
+    os.makedirs(image_pool, exist_ok=True)
+    image_rows = []
+    for u in range(users):
+        for i in range(images):
+            content = rng.randbytes(IMAGE_SIZE)
+            digest = hashlib.sha256(content).hexdigest()
+            key = image_store.content_key(digest, "image.png")
+            path = image_store.path_for(image_pool, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as stored:
+                stored.write(content)
+            image_rows.append((
+                hashlib.sha256(("USER%d:image:%d" % (u, i)).encode()).hexdigest(), "USER%d" % u,
+                "image%d.png" % i, _timestamp(u * images + i), key, digest, IMAGE_SIZE
+            ))
+    _conn.executemany(
+        "INSERT INTO images (uid, owner, name, timestamp, path, hash, size) VALUES (?, ?, ?, ?, ?, ?, ?);",
+        image_rows
+    )
+    _conn.commit()
+    return users + 1, users * notes, len(image_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("db_file")
+    parser.add_argument("image_pool")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--notes", type=int, default=50, help="notes per user")
+    parser.add_argument("--images", type=int, default=5, help="images per user")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db_file):
+        parser.error("%s already exists" % args.db_file)
+    print("%d users, %d notes, %d images" % seed(
+        args.db_file, args.image_pool, args.users, args.notes, args.images, args.seed
+    ))
+    database.close_connections()
+
+
+if __name__ == "__main__":
+    main()
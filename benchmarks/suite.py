@@ -0,0 +1,509 @@
+"""
+Reproducible benchmarks of every function of database.py and every route.
+
+A database and an image pool of --users users, with --notes notes and
+--images images each, are seeded by benchmarks.seed into a temporary
+directory. Every function of database.py, then every route, is called
+--repeat times after a few warm-up calls; the calls changing data work on
+items created beforehand, outside of the timings. Latencies are printed and
+written as JSON to --output, with the commit, the parameters and the
+environment they were measured with.
+
+Routes are requested through the Flask test client, or with --server over
+HTTP from a serve.py process started on the seeded data. /metrics and
+/profiling/ answer only while metrics and profiling are enabled: the test
+client enables them for their own benchmarks only, while the serve.py
+process runs with both enabled (the profiler sampling no request), which
+adds their cost to every route. Assets are built into the temporary
+directory.
+
+Every route of the application and every function of database.py querying
+the database must have a benchmark; those missing are listed under
+"not_benchmarked".
+
+--compare PREVIOUS.json prints the ratio of every median latency to the one
+recorded in PREVIOUS.json, and exits with status 1 when one of them grew by
+more than --threshold.
+
+Usage: python -m benchmarks.suite [--users N] [--notes N] [--images N] [--repeat N] [--server]
+                                  [--only PREFIX] [--output FILE] [--compare FILE] [--threshold R]
+"""
+
+import argparse
+import datetime
+import http.client
+import inspect
+import io
+import json
+import os
+import platform
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import archive
+import assets
+import database
+import metrics
+from benchmarks.seed import seed
+
+PORT = 8766
+
+WARMUP = 3
+
+# Functions of database.py that do not query the database
+UNTIMED = {"ensure_schema", "close_connections", "open_connections"}
+
+# Endpoints without a benchmark: static is the handler of Flask for static/,
+# whose files deployments serve from the front server.
+UNBENCHMARKED_ENDPOINTS = {"static"}
+
+SERVER = (
+    "import sys, database, metrics; database.DB_FILE_LOCATION = sys.argv[1]; "
+    "from app import app, profiler; app.config['UPLOAD_FOLDER'] = sys.argv[2]; "
+    "app.config['ASSETS_FOLDER'] = sys.argv[3]; metrics.configure(True); profiler.enabled = True; "
+    "import serve; serve.main(sys.argv[4:])"
+)
+
+
+class Context:
+    """The seeded data the benchmarks work on, and helpers to create more."""
+
+    def __init__(self, image_pool, rng):
+        self.image_pool = image_pool
+        # a fingerprinted name of the assets built for the run
+        self.asset = None
+        self.rng = rng
+        self.user = "USER0"
+        self.note_ids = [row[0] for row in database.read_note_from_db(self.user)]
+        self.image_uids = [row[0] for row in database.list_images_for_user(self.user)]
+        self._serial = 0
+
+    def unique(self, prefix):
+        self._serial += 1
+        return "%s%d" % (prefix, self._serial)
+
+    def notes(self, count, user=None):
+        """Commit count new notes of user and return their ids."""
+        rows = [database.new_note(user or self.user, "bench note %d" % i) for i in range(count)]
+        database.write_notes_into_db(rows)
+        return [row[3] for row in rows]
+
+    def images(self, count, user=None):
+        """Record count new images of user, without files, and return their uids."""
+        uids = [self.unique("bench-image-") for _ in range(count)]
+        database.create_items((), [
+            (uid, user or self.user, "bench.png", "2025-06-01", None, None, lambda existing: None) for uid in uids
+        ])
+        return uids
+
+    def users(self, count, notes=0):
+        """Create count users, with a few notes each, without hashing a password."""
+        users = [self.unique("BENCHUSER") for _ in range(count)]
+        _conn = database._connect(database.DB_FILE_LOCATION)
+        _conn.executemany("INSERT INTO users (id, pw) VALUES (?, 'x');", ((user,) for user in users))
+        _conn.commit()
+        for user in users:
+            self.notes(notes, user)
+        return users
+
+    def content(self):
+        return self.rng.randbytes(2048)
+
+
+def _database_benchmarks(ctx):
+    """
+(name, most calls, prepare) triples: prepare(n) does the untimed set-up of
+n calls and returns the function making the i-th one.
+    """
+    user, note_id, image_uid = ctx.user, ctx.note_ids[0], ctx.image_uids[0]
+    now = int(time.time())
+
+    def each(func):
+        return lambda n: lambda i: func()
+
+    def over(make_items, func):
+        def prepare(n):
+            items = make_items(n)
+            return lambda i: func(items[i])
+        return prepare
+
+    yield "list_users", None, each(database.list_users)
+    yield "list_users_page", None, each(lambda: database.list_users_page(50, user, user[:-1]))
+    yield "user_exists", None, each(lambda: database.user_exists(user))
+    yield "verify", None, each(lambda: database.verify(user, "pw"))
+    yield "add_user", 20, lambda n: lambda i: database.add_user(ctx.unique("BENCHADD"), "pw")
+    yield "delete_user_from_db", None, over(lambda n: ctx.users(n, notes=10), database.delete_user_from_db)
+    yield "request_user_deletion", None, over(lambda n: ctx.users(n), database.request_user_deletion)
+    yield "claim_user_deletion", None, over(
+        lambda n: [u for u in ctx.users(n) if database.request_user_deletion(u)],
+        lambda u: database.claim_user_deletion(u, now, now + 60)
+    )
+    yield "delete_user_batch", None, over(
+        lambda n: [u for u in ctx.users(n, notes=10) if database.request_user_deletion(u)],
+        lambda u: database.delete_user_batch(u, 500, now + 60)
+    )
+    yield "user_deletions", None, each(database.user_deletions)
+    yield "read_note_from_db", None, each(lambda: database.read_note_from_db(user))
+    yield "read_notes_page", None, each(lambda: database.read_notes_page(user, 20))
+    yield "search_notes", None, each(lambda: database.search_notes(user, ["lorem"], 20))
+    yield "rebuild_search_index", 3, each(database.rebuild_search_index)
+    yield "match_user_id_with_note_id", None, each(lambda: database.match_user_id_with_note_id(note_id))
+    yield "new_note", None, lambda n: lambda i: database.new_note(user, "note")
+    yield "write_note_into_db", None, each(lambda: database.write_note_into_db(user, "bench note"))
+    yield "write_notes_into_db", None, lambda n: lambda i: database.write_notes_into_db(
+        [database.new_note(user, "bench note") for _ in range(10)]
+    )
+    yield "delete_note_from_db", None, over(ctx.notes, database.delete_note_from_db)
+    yield "image_upload_record", None, lambda n: lambda i: database.image_upload_record(
+        ctx.unique("bench-upload-"), user, "bench.png", "2025-06-01"
+    )
+    yield "list_images_for_user", None, each(lambda: database.list_images_for_user(user))
+    yield "list_images_page", None, each(lambda: database.list_images_page(user, 20))
+    yield "list_image_files_page", None, each(lambda: database.list_image_files_page(user, 20))
+    yield "match_user_id_with_image_uid", None, each(lambda: database.match_user_id_with_image_uid(image_uid))
+    yield "image_file_from_db", None, each(lambda: database.image_file_from_db(image_uid))
+    yield "delete_image_from_db", None, over(ctx.images, database.delete_image_from_db)
+    yield "owned_items", None, each(lambda: database.owned_items(user, ctx.note_ids[:10], ctx.image_uids))
+    yield "create_items", None, lambda n: lambda i: database.create_items(
+        [database.new_note(user, "bench note") for _ in range(10)]
+    )
+    yield "delete_items", None, over(
+        lambda n: [ctx.notes(10) for _ in range(n)], lambda ids: database.delete_items(user, ids)
+    )
+    yield "export_items", None, each(lambda: database.export_items(user))
+    yield "write_session", None, lambda n: lambda i: database.write_session("bench%d" % i, user, b"{}", now + 3600)
+    yield "read_session", None, each(lambda: database.read_session("bench0", now))
+    yield "touch_sessions", None, lambda n: lambda i: database.touch_sessions([(now + 7200, "bench%d" % i)])
+    yield "delete_sessions", None, lambda n: lambda i: database.delete_sessions(session_id="bench%d" % i)
+
+
+def _route_benchmarks(ctx, client, admin, anonymous):
+    """
+    (name, most calls, prepare) triples, as for _database_benchmarks(). Names
+    are the method and the rule of the route, followed by what is requested
+    when a route has several benchmarks.
+    """
+    image_uid = ctx.image_uids[0]
+    deleting = ctx.users(1, notes=10)[0]
+    database.request_user_deletion(deleting)
+    importing = ctx.users(1, notes=10)[0]
+    tar = b"".join(archive.export_user(importing, ctx.image_pool))
+
+    def each(client, method, path, **kwargs):
+        return lambda n: lambda i: client.request(method, path, **kwargs)
+
+    def over(make_items, func):
+        def prepare(n):
+            items = make_items(n)
+            return lambda i: func(items[i])
+        return prepare
+
+    yield "GET /", None, each(anonymous, "GET", "/")
+    yield "GET /public/", None, each(anonymous, "GET", "/public/")
+    yield "GET /private/", None, each(client, "GET", "/private/")
+    yield "GET /search", None, each(client, "GET", "/search?q=lorem")
+    yield "GET /admin/", None, each(admin, "GET", "/admin/")
+    yield "GET /admin/?q=", None, each(admin, "GET", "/admin/?q=USER1&users_after=USER1")
+    yield "POST /login", None, each(anonymous, "POST", "/login", data={"id": "USER1", "pw": "pw"})
+    yield "GET /logout/", None, each(anonymous, "GET", "/logout/")
+    yield "POST /write_note", None, each(client, "POST", "/write_note", data={"text_note_to_take": "bench note"})
+    yield "GET /delete_note/<int:note_id>", None, over(ctx.notes, lambda note_id: client.request("GET", "/delete_note/%d" % note_id))
+    yield "POST /upload_image", None, lambda n: lambda i: client.request(
+        "POST", "/upload_image", files={"file": ("bench.png", ctx.content())}
+    )
+    yield "GET /image/<image_uid>", None, each(client, "GET", "/image/" + image_uid)
+    yield "GET /delete_image/<image_uid>", None, over(ctx.images, lambda uid: client.request("GET", "/delete_image/" + uid))
+    yield "POST /bulk/create", None, lambda n: lambda i: client.request(
+        "POST", "/bulk/create", data={"note": ["bench note %d" % k for k in range(10)]}
+    )
+    yield "POST /bulk/delete", None, over(
+        lambda n: [ctx.notes(10) for _ in range(n)],
+        lambda ids: client.request("POST", "/bulk/delete", data={"note_id": ids})
+    )
+    yield "GET /bulk/export", None, each(client, "GET", "/bulk/export")
+    yield "POST /bulk/export", None, each(
+        client, "POST", "/bulk/export", data={"note_id": ctx.note_ids[:10], "image_uid": ctx.image_uids[:10]}
+    )
+    yield "GET /archive", None, each(client, "GET", "/archive")
+    yield "POST /archive", 50, each(
+        admin, "POST", "/archive?user=" + importing, body=tar, headers={"Content-Type": archive.CONTENT_TYPE}
+    )
+    if ctx.asset is not None:
+        yield "GET /assets/<path:filename>", None, each(
+            anonymous, "GET", "/assets/" + ctx.asset, headers={"Accept-Encoding": "gzip"}
+        )
+    yield "POST /add_user", 20, lambda n: lambda i: admin.request(
+        "POST", "/add_user", data={"id": ctx.unique("BENCHROUTE"), "pw": "pw"}
+    )
+    yield "GET /delete_user/<user_id>/", None, over(
+        lambda n: ctx.users(n, notes=10), lambda u: admin.request("GET", "/delete_user/%s/" % u)
+    )
+    yield "GET /delete_user/<user_id>/status", None, each(admin, "GET", "/delete_user/%s/status" % deleting)
+
+    # answered only while enabled, which the serve.py process always is
+    from app import profiler
+    enabled = metrics.enabled, profiler.enabled
+    metrics.configure(True)
+    profiler.enabled = True
+    try:
+        yield "GET /metrics", None, each(admin, "GET", "/metrics")
+        yield "GET /profiling/", None, each(admin, "GET", "/profiling/")
+        yield "POST /profiling/", None, each(admin, "POST", "/profiling/", data={"sample_rate": "0"})
+        yield "GET /profiling/stacks", None, each(admin, "GET", "/profiling/stacks")
+    finally:
+        metrics.configure(enabled[0])
+        profiler.enabled = enabled[1]
+
+
+class TestClient:
+    """Requests made through the Flask test client of the application."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None, files=None, body=None, headers=None):
+        if body is None:
+            body = dict(data or {})
+            for name, (filename, content) in (files or {}).items():
+                body[name] = (io.BytesIO(content), filename)
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+
+class HTTPClient:
+    """Requests made over HTTP, one connection each, keeping the session cookie."""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+
+    def request(self, method, path, data=None, files=None, body=None, headers=None):
+        headers = dict(headers or {})
+        if files:
+            boundary = "bench%016x" % random.getrandbits(64)
+            body = _multipart(boundary, data or {}, files)
+            headers["Content-Type"] = "multipart/form-data; boundary=" + boundary
+        elif data is not None:
+            body = urllib.parse.urlencode(data, doseq=True)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return response.status
+
+
+def _multipart(boundary, fields, files):
+    parts = []
+    for name, value in fields.items():
+        parts.append(('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+                      % (boundary, name, value)).encode())
+    for name, (filename, content) in files.items():
+        parts.append(('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                      'Content-Type: application/octet-stream\r\n\r\n' % (boundary, name, filename)).encode()
+                     + content + b"\r\n")
+    return b"".join(parts) + ("--%s--\r\n" % boundary).encode()
+
+
+def _measure(prepare, calls):
+    """
+    Latency statistics, in microseconds, of calls calls after WARMUP untimed
+    ones, and the number of calls answered with an HTTP error.
+    """
+    call = prepare(WARMUP + calls)
+    for i in range(WARMUP):
+        call(i)
+    latencies = []
+    errors = 0
+    for i in range(WARMUP, WARMUP + calls):
+        start = time.perf_counter()
+        status = call(i)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        # routes return their HTTP status
+        if isinstance(status, int) and not isinstance(status, bool) and status >= 400:
+            errors += 1
+    latencies.sort()
+
+    def quantile(q):
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+
+    return {
+        "calls": calls, "mean_us": sum(latencies) / calls, "min_us": latencies[0],
+        "p50_us": quantile(0.5), "p95_us": quantile(0.95), "p99_us": quantile(0.99), "errors": errors,
+    }
+
+
+def _run_benchmarks(prefix, benchmarks, repeat, only, results):
+    for name, most, prepare in benchmarks:
+        name = prefix + name
+        if only and not name.startswith(only):
+            continue
+        results[name] = stats = _measure(prepare, min(repeat, most or repeat))
+        print("%-40s %7d %10.1f us %10.1f us %10.1f us %7d" % (
+            name, stats["calls"], stats["p50_us"], stats["p95_us"], stats["p99_us"], stats["errors"]
+        ))
+
+
+def _wait_until_up(process, client):
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError("server exited with status %d" % process.returncode)
+        try:
+            client.request("GET", "/public/")
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(users=100, notes=50, images=5, repeat=200, server=False, only=None, seed_value=0):
+    """Seed a temporary database, run the benchmarks and return the results document."""
+    results = {}
+    previous_location = database.DB_FILE_LOCATION
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file, image_pool = os.path.join(tmp, "app.db"), os.path.join(tmp, "image_pool")
+        assets_folder = os.path.join(tmp, "assets")
+        database.close_connections()
+        database.DB_FILE_LOCATION = db_file
+        # imported once the database is moved, since app starts background threads using it
+        from app import app
+        previous_folders = app.config['UPLOAD_FOLDER'], app.config['ASSETS_FOLDER']
+        process = None
+        try:
+            seed(db_file, image_pool, users, notes, images, seed_value)
+            ctx = Context(image_pool, random.Random(seed_value))
+            ctx.asset = next(iter(assets.build("static", "templates", assets_folder).values()), None)
+            print("%-40s %7s %13s %13s %13s %7s" % ("benchmark", "calls", "p50", "p95", "p99", "errors"))
+            _run_benchmarks("database.", _database_benchmarks(ctx), repeat, only, results)
+
+            app.config['UPLOAD_FOLDER'], app.config['ASSETS_FOLDER'] = image_pool, assets_folder
+            if server:
+                process = subprocess.Popen(
+                    [sys.executable, "-c", SERVER, db_file, image_pool, assets_folder,
+                     "--port", str(PORT), "--workers", "1"],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+                clients = [HTTPClient(PORT) for _ in range(3)]
+                _wait_until_up(process, clients[0])
+            else:
+                clients = [TestClient(app) for _ in range(3)]
+            client, admin, anonymous = clients
+            client.request("POST", "/login", data={"id": ctx.user, "pw": "pw"})
+            admin.request("POST", "/login", data={"id": "ADMIN", "pw": "admin"})
+            _run_benchmarks("route ", _route_benchmarks(ctx, client, admin, anonymous), repeat, only, results)
+            missing = [] if only else unbenchmarked(results, app)
+            if missing:
+                print("\nno benchmark for %s" % ", ".join(missing))
+        finally:
+            if process is not None:
+                process.send_signal(signal.SIGTERM)
+                process.wait()
+            app.config['UPLOAD_FOLDER'], app.config['ASSETS_FOLDER'] = previous_folders
+            database.close_connections()
+            database.DB_FILE_LOCATION = previous_location
+
+    return {
+        "commit": _commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "parameters": {"users": users, "notes": notes, "images": images, "repeat": repeat,
+                       "server": "serve.py" if server else "test client", "seed": seed_value},
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                        "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+        "not_benchmarked": missing,
+    }
+
+
+def unbenchmarked(results, app):
+    """
+    Names of the benchmarks missing from results: one per function of
+    database.py querying the database, and one per method of every route of
+    app outside UNBENCHMARKED_ENDPOINTS.
+    """
+    functions = [
+        "database." + name for name, function in vars(database).items()
+        if inspect.isfunction(function) and function.__module__ == "database" and not name.startswith("_")
+        and name not in UNTIMED
+    ]
+    routes = [
+        "route %s %s" % (method, rule.rule) for rule in app.url_map.iter_rules()
+        if rule.endpoint not in UNBENCHMARKED_ENDPOINTS for method in rule.methods - {"HEAD", "OPTIONS"}
+    ]
+    return sorted(name for name in functions + routes if name not in results)
+
+
+def compare(current, previous, threshold):
+    """Print the ratio of the medians of two results documents; returns the names that regressed."""
+    regressions = []
+    print("\n%-40s %13s %13s %7s" % ("compared to %s" % (previous.get("commit") or "previous"), "before", "after", "ratio"))
+    for name, stats in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        ratio = stats["p50_us"] / before["p50_us"] if before["p50_us"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  slower"
+        print("%-40s %10.1f us %10.1f us %6.2fx%s" % (name, before["p50_us"], stats["p50_us"], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--notes", type=int, default=50, help="notes per user")
+    parser.add_argument("--images", type=int, default=5, help="images per user")
+    parser.add_argument("--repeat", type=int, default=200, help="timed calls per benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server", action="store_true", help="request the routes from a serve.py process")
+    parser.add_argument("--only", help="only run the benchmarks whose name starts with ONLY")
+    parser.add_argument("--output", help="JSON file to write (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    document = run(args.users, args.notes, args.images, args.repeat, args.server, args.only, args.seed)
+    output = args.output or os.path.join(
+        os.path.dirname(__file__), "results", "%s.json" % (document["commit"] or "results")
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as out:
+        json.dump(document, out, indent=2, sort_keys=True)
+    print("\nresults written to %s" % output)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            if compare(document, json.load(previous), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
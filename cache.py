@@ -0,0 +1,206 @@
+"""
+Per-user read-through cache for the data shown on the private page.
+
+Entries are keyed by user and by a generation number. Invalidating a user
+bumps their generation, which makes every entry cached for them unreachable
+at once. A page loaded while a write was being committed is stored under the
+previous generation, so it can never be served after that write.
+
+Two backends are available: LocalBackend, an in-process LRU cache, and
+RedisBackend, shared by every worker process (it needs the redis package).
+LocalBackend can also be used by worker processes forked from a common
+parent, as long as share_generations() is called before forking.
+"""
+
+import multiprocessing
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LocalBackend:
+    """In-process LRU cache whose entries also expire after a TTL."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = Generations(max_entries, self._names)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires, value, _ = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl, name=None):
+        """Cache value under key; name is the one whose generation is part of key."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value, name)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _names(self):
+        with self._lock:
+            return {name for _, _, name in self._entries.values() if name is not None}
+
+    def generation(self, name):
+        # generations are kept apart from the LRU entries: evicting one would
+        # bring back the entries cached under an earlier generation
+        return self._generations.get(name)
+
+    def bump(self, name):
+        self._generations.bump(name)
+
+    def share_generations(self, slots=4096):
+        """
+        Keep generations in memory shared with the processes forked afterwards,
+        so that invalidating a name in one worker invalidates it in all of them.
+        """
+        self._generations = SharedGenerations(slots)
+
+
+class Generations:
+    """
+    Generation counters of the names cached by one process.
+
+    Once more than limit names have been bumped, the names that live_names()
+    no longer reports, having nothing cached, are forgotten. Every bump takes
+    the next value of a counter common to all names, and a forgotten name is
+    read as the highest value handed out so far, so it can never get back an
+    earlier generation under which a stale entry may still be stored.
+    """
+
+    def __init__(self, limit=1024, live_names=set):
+        self.limit = limit
+        self._live_names = live_names
+        # (counters by name, floor): replaced as a whole by _prune(), so that
+        # get() never pairs the counters of one state with the floor of another
+        self._state = ({}, 0)
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def get(self, name):
+        counters, floor = self._state
+        return counters.get(name, floor)
+
+    def bump(self, name):
+        with self._lock:
+            self._last += 1
+            counters = self._state[0]
+            counters[name] = self._last
+            if len(counters) > 2 * self.limit:
+                self._prune()
+
+    def _prune(self):
+        counters, floor = self._state
+        live = self._live_names()
+        # names cached under the current floor keep it
+        self._state = ({name: counters.get(name, floor) for name in live}, self._last)
+
+
+class SharedGenerations:
+    """
+    Generation counters in memory shared by forked processes. Names are hashed
+    into a fixed number of slots: names sharing a slot invalidate each other,
+    which costs a few cache misses but never serves stale entries.
+    """
+
+    def __init__(self, slots):
+        self._counters = multiprocessing.RawArray("Q", slots)
+        self._lock = multiprocessing.Lock()
+
+    def _slot(self, name):
+        return zlib.crc32(name.encode()) % len(self._counters)
+
+    def get(self, name):
+        return self._counters[self._slot(name)]
+
+    def bump(self, name):
+        with self._lock:
+            self._counters[self._slot(name)] += 1
+
+
+class RedisBackend:
+    """Cache shared by every worker process through a Redis server."""
+
+    def __init__(self, url, prefix="flask-example:"):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self._redis.get(self.prefix + key)
+        return MISSING if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl, name=None):
+        self._redis.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def generation(self, name):
+        return int(self._redis.get(self.prefix + "generation:" + name) or 0)
+
+    def bump(self, name):
+        self._redis.incr(self.prefix + "generation:" + name)
+
+
+class UserCache:
+    """Read-through cache of per-user data with precise invalidation."""
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, user, key, loader):
+        """Return the value cached for user under key, calling loader() on a miss."""
+        cache_key = "%s:%d:%s" % (user, self.backend.generation(user), key)
+        value = self.backend.get(cache_key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = loader()
+        self.backend.set(cache_key, value, self.ttl, user)
+        return value
+
+    def invalidate(self, user):
+        """Forget everything cached for user."""
+        self.backend.bump(user)
+
+    def stats(self):
+        """Hit and miss counters since the cache was created."""
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def from_config(config):
+    """Build the UserCache described by the USER_CACHE_* settings."""
+    if config['USER_CACHE_BACKEND'] == "redis":
+        backend = RedisBackend(config['USER_CACHE_REDIS_URL'])
+    else:
+        backend = LocalBackend(config['USER_CACHE_SIZE'])
+    return UserCache(backend, config['USER_CACHE_TTL'])
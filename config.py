@@ -1,3 +1,87 @@
 SECRET_KEY = "fdsafasd"
 UPLOAD_FOLDER = "image_pool"
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024
\ No newline at end of file
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Browser cache lifetime of images served by /image/<uid>
+IMAGE_MAX_AGE = 365 * 24 * 3600
+# Internal location under which the front-end server (e.g. nginx) serves
+# UPLOAD_FOLDER. When set, /image/<uid> only checks ownership and lets the
+# front-end server send the file through X-Accel-Redirect.
+IMAGE_ACCEL_REDIRECT_PREFIX = None
+# Cache of the notes and images pages shown on /private/: "local" keeps an
+# LRU cache in each process, "redis" shares one between worker processes
+USER_CACHE_BACKEND = "local"
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 300
+USER_CACHE_REDIS_URL = "redis://localhost:6379/0"
+# Pre-rendered static pages and error pages, per logged-in user
+PAGE_CACHE_SIZE = 256
+PAGE_CACHE_TTL = 3600
+# Output of the asset build step (python assets.py)
+ASSETS_FOLDER = "static/dist"
+# Commit new notes in batches from a background thread instead of once per
+# request. Notes wait at most NOTE_WRITE_INTERVAL seconds for a batch, which
+# holds at most NOTE_WRITE_BATCH_SIZE notes; queued notes are lost if the
+# process dies. Only the process that queued a note shows it before it is
+# committed: other serve.py workers show it once committed.
+NOTE_WRITE_BEHIND = False
+NOTE_WRITE_BATCH_SIZE = 100
+NOTE_WRITE_INTERVAL = 0.05
+# Hasher of new passwords ("scrypt" or "pbkdf2_sha256") and threads running
+# the key derivation; older hashes are upgraded when their user logs in.
+PASSWORD_HASHER = "scrypt"
+PASSWORD_WORKERS = 4
+# Where sessions are kept: "sqlite" (the sessions table, shared by every
+# process) or "memory" (an LRU of SESSION_CACHE_SIZE sessions per process).
+# Sessions expire after PERMANENT_SESSION_LIFETIME without use; their expiry
+# is pushed back at most every SESSION_REFRESH_INTERVAL seconds, and written
+# in batches every SESSION_TOUCH_INTERVAL seconds.
+SESSION_BACKEND = "sqlite"
+SESSION_CACHE_SIZE = 10000
+SESSION_REFRESH_INTERVAL = 60
+SESSION_TOUCH_INTERVAL = 5
+PERMANENT_SESSION_LIFETIME = 7 * 24 * 3600
+# python serve.py: worker processes (None: one per core), request threads per
+# worker, and seconds given to the requests in progress when stopping
+SERVE_WORKERS = None
+SERVE_THREADS = 8
+SERVE_SHUTDOWN_TIMEOUT = 30
+# asgi.py: threads running the requests whose body has been received, and
+# size above which request bodies are spooled to disk while being received
+ASGI_THREADS = 16
+ASGI_SPOOL_SIZE = 1024 * 1024
+# /bulk/* routes: most notes and images per request, and threads removing
+# the files of deleted images
+BULK_MAX_ITEMS = 1000
+BULK_REMOVE_WORKERS = 8
+# Background deletion of users: notes and images deleted per transaction,
+# users deleted at once, and seconds a process owns a job before another one
+# may resume it
+USER_DELETE_BATCH_SIZE = 500
+USER_DELETE_WORKERS = 2
+USER_DELETE_LEASE = 60
+# /archive imports: largest archive accepted (the ASGI adapter still stops
+# bodies at MAX_CONTENT_LENGTH: import bigger ones through serve.py without
+# --asgi, or with archive.py), and notes or images committed per transaction
+ARCHIVE_IMPORT_MAX_LENGTH = 64 * 1024 ** 3
+ARCHIVE_IMPORT_BATCH_SIZE = 500
+# /search: most words per query, and furthest result offset a page may start at
+SEARCH_MAX_TERMS = 8
+SEARCH_MAX_OFFSET = 1000
+# Request, database, template and file timings served in the Prometheus
+# format on /metrics, which also requires "Authorization: Bearer
+# <METRICS_TOKEN>" when a token is set
+METRICS_ENABLED = False
+METRICS_TOKEN = None
+# Sampled stacks of requests, added up per route and exported as collapsed
+# stacks (flamegraph.pl, speedscope) by the /profiling/ routes. A request is
+# profiled with probability PROFILING_SAMPLE_RATE (changed at run time by
+# POST /profiling/), or when its X-Profile header holds PROFILING_TOKEN;
+# stacks are sampled every PROFILING_INTERVAL seconds. With a token, the
+# /profiling/ routes require "Authorization: Bearer <PROFILING_TOKEN>";
+# without one, any X-Profile header starts a profile.
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_INTERVAL = 0.005
+PROFILING_TOKEN = None
@@ -3,94 +3,594 @@ Database module for handling user, note, and image data.
 """
 
 import sqlite3
-import hashlib
 import datetime
+import json
 import os
+import threading
+import weakref
+
+import metrics
+import passwords
 
 # Utilisez une base de données différente pour les tests
 if 'PYTEST_CURRENT_TEST' in os.environ:
-    USER_DB_FILE_LOCATION = "database_file/test_users.db"
-    NOTE_DB_FILE_LOCATION = "database_file/test_notes.db"
-    IMAGE_DB_FILE_LOCATION = "database_file/test_images.db"
+    DB_FILE_LOCATION = "database_file/test_app.db"
 else:
-    USER_DB_FILE_LOCATION = "database_file/users.db"
-    NOTE_DB_FILE_LOCATION = "database_file/notes.db"
-    IMAGE_DB_FILE_LOCATION = "database_file/images.db"
+    DB_FILE_LOCATION = "database_file/app.db"
+
+# Schema changes, applied in order. The number of scripts already applied to a
+# database file is stored in its user_version pragma.
+SCHEMA_MIGRATIONS = (
+    # 1: users, notes and images share one file; notes and images are owned
+    # by a user and go away with it.
+    """
+    CREATE TABLE users (
+        id TEXT PRIMARY KEY,
+        pw TEXT NOT NULL
+    );
+    CREATE TABLE notes (
+        note_id TEXT PRIMARY KEY,
+        user TEXT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        timestamp TEXT NOT NULL,
+        note TEXT
+    );
+    CREATE INDEX notes_user_timestamp ON notes (user, timestamp);
+    CREATE TABLE images (
+        uid TEXT PRIMARY KEY,
+        owner TEXT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        name TEXT,
+        timestamp TEXT NOT NULL
+    );
+    CREATE INDEX images_owner_timestamp ON images (owner, timestamp);
+    """,
+    # 2: the timestamp indexes also cover the row key, so that keyset pages
+    # ordered by (timestamp, key) are read straight from the index.
+    """
+    DROP INDEX notes_user_timestamp;
+    CREATE INDEX notes_user_timestamp ON notes (user, timestamp, note_id);
+    DROP INDEX images_owner_timestamp;
+    CREATE INDEX images_owner_timestamp ON images (owner, timestamp, uid);
+    """,
+    # 3: location of the image file inside the image store.
+    """
+    ALTER TABLE images ADD COLUMN path TEXT;
+    """,
+    # 4: content hash and size of the image file. Uploads of the same content
+    # share one file, which is referenced by every row with that hash.
+    """
+    ALTER TABLE images ADD COLUMN hash TEXT;
+    ALTER TABLE images ADD COLUMN size INTEGER;
+    CREATE INDEX images_hash ON images (hash);
+    """,
+    # 5: server-side sessions, keyed by their opaque id. user is the logged-in
+    # user, if any, so that their sessions can be dropped with them.
+    """
+    CREATE TABLE sessions (
+        id TEXT PRIMARY KEY,
+        user TEXT,
+        data BLOB NOT NULL,
+        expires INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX sessions_user ON sessions (user);
+    CREATE INDEX sessions_expires ON sessions (expires);
+    """,
+    # 6: full-text index of the notes, kept in sync by triggers. The owner is
+    # indexed too, so that a search only visits the notes of one user.
+    """
+    CREATE VIRTUAL TABLE notes_fts USING fts5 (
+        note, user, content = 'notes', tokenize = 'unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts (rowid, note, user) VALUES (new.rowid, new.note, new.user);
+    END;
+    CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, note, user) VALUES ('delete', old.rowid, old.note, old.user);
+    END;
+    CREATE TRIGGER notes_fts_update AFTER UPDATE OF note, user ON notes BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, note, user) VALUES ('delete', old.rowid, old.note, old.user);
+        INSERT INTO notes_fts (rowid, note, user) VALUES (new.rowid, new.note, new.user);
+    END;
+    INSERT INTO notes_fts (notes_fts) VALUES ('rebuild');
+    """,
+    # 7: users being deleted in the background. The row is the tombstone of
+    # the user and records the progress of the job; it goes away with the
+    # user once the job is done. lease is the time until which a process
+    # owns the job, so that a job whose process died is taken over.
+    """
+    CREATE TABLE user_deletions (
+        user TEXT PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+        requested TEXT NOT NULL,
+        notes_total INTEGER NOT NULL,
+        images_total INTEGER NOT NULL,
+        notes_deleted INTEGER NOT NULL DEFAULT 0,
+        images_deleted INTEGER NOT NULL DEFAULT 0,
+        files_removed INTEGER NOT NULL DEFAULT 0,
+        lease INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """,
+    # 8: notes are keyed by an integer, the rowid of the table, instead of a
+    # SHA-256 of their author and timestamp: lookups by id read the table
+    # itself, and the id is no longer repeated in an index. Existing notes
+    # keep their rowid as id, so that the full-text index stays valid.
+    # note_ids holds the next id not handed out; processes reserve blocks of
+    # ids from it (see new_note).
+    """
+    DROP TRIGGER notes_fts_insert;
+    DROP TRIGGER notes_fts_delete;
+    DROP TRIGGER notes_fts_update;
+    CREATE TABLE notes_by_number (
+        note_id INTEGER PRIMARY KEY,
+        user TEXT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        timestamp TEXT NOT NULL,
+        note TEXT
+    );
+    INSERT INTO notes_by_number (note_id, user, timestamp, note)
+        SELECT rowid, user, timestamp, note FROM notes;
+    DROP TABLE notes;
+    ALTER TABLE notes_by_number RENAME TO notes;
+    CREATE INDEX notes_user_timestamp ON notes (user, timestamp);
+    CREATE TABLE note_ids (next INTEGER NOT NULL);
+    INSERT INTO note_ids SELECT COALESCE(MAX(note_id), 0) + 1 FROM notes;
+    CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts (rowid, note, user) VALUES (new.rowid, new.note, new.user);
+    END;
+    CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, note, user) VALUES ('delete', old.rowid, old.note, old.user);
+    END;
+    CREATE TRIGGER notes_fts_update AFTER UPDATE OF note, user ON notes BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, note, user) VALUES ('delete', old.rowid, old.note, old.user);
+        INSERT INTO notes_fts (rowid, note, user) VALUES (new.rowid, new.note, new.user);
+    END;
+    """,
+    # 9: number of notes and images of every user, and the bytes taken by
+    # their text and image files, kept up to date by triggers so that the
+    # admin page reads them instead of counting. An image file shared by
+    # several images counts once per image.
+    """
+    CREATE TABLE user_stats (
+        user TEXT PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+        notes INTEGER NOT NULL DEFAULT 0,
+        images INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    INSERT INTO user_stats (user) SELECT id FROM users;
+    UPDATE user_stats SET
+        notes = (SELECT COUNT(*) FROM notes WHERE user = user_stats.user),
+        images = (SELECT COUNT(*) FROM images WHERE owner = user_stats.user),
+        bytes = (SELECT COALESCE(SUM(LENGTH(CAST(note AS BLOB))), 0) FROM notes WHERE user = user_stats.user)
+              + (SELECT COALESCE(SUM(size), 0) FROM images WHERE owner = user_stats.user);
+    CREATE TRIGGER user_stats_insert AFTER INSERT ON users BEGIN
+        INSERT INTO user_stats (user) VALUES (new.id);
+    END;
+    CREATE TRIGGER user_stats_note_insert AFTER INSERT ON notes BEGIN
+        UPDATE user_stats SET notes = notes + 1, bytes = bytes + COALESCE(LENGTH(CAST(new.note AS BLOB)), 0)
+            WHERE user = new.user;
+    END;
+    CREATE TRIGGER user_stats_note_delete AFTER DELETE ON notes BEGIN
+        UPDATE user_stats SET notes = notes - 1, bytes = bytes - COALESCE(LENGTH(CAST(old.note AS BLOB)), 0)
+            WHERE user = old.user;
+    END;
+    CREATE TRIGGER user_stats_note_update AFTER UPDATE OF note, user ON notes BEGIN
+        UPDATE user_stats SET notes = notes - 1, bytes = bytes - COALESCE(LENGTH(CAST(old.note AS BLOB)), 0)
+            WHERE user = old.user;
+        UPDATE user_stats SET notes = notes + 1, bytes = bytes + COALESCE(LENGTH(CAST(new.note AS BLOB)), 0)
+            WHERE user = new.user;
+    END;
+    CREATE TRIGGER user_stats_image_insert AFTER INSERT ON images BEGIN
+        UPDATE user_stats SET images = images + 1, bytes = bytes + COALESCE(new.size, 0) WHERE user = new.owner;
+    END;
+    CREATE TRIGGER user_stats_image_delete AFTER DELETE ON images BEGIN
+        UPDATE user_stats SET images = images - 1, bytes = bytes - COALESCE(old.size, 0) WHERE user = old.owner;
+    END;
+    CREATE TRIGGER user_stats_image_update AFTER UPDATE OF size, owner ON images BEGIN
+        UPDATE user_stats SET images = images - 1, bytes = bytes - COALESCE(old.size, 0) WHERE user = old.owner;
+        UPDATE user_stats SET images = images + 1, bytes = bytes + COALESCE(new.size, 0) WHERE user = new.owner;
+    END;
+    """,
+)
+
+# Pragmas applied once to every connection opened by the connection manager.
+# WAL lets readers proceed while a writer commits, and synchronous=NORMAL is
+# durable across application crashes under WAL while avoiding an fsync per commit.
+CONNECTION_PRAGMAS = (
+    # first, so that switching a new file to WAL waits for its other users
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -8000;",
+)
+
+# Markers around the matches in the snippets returned by search_notes().
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+# Oldest SQLite library supported: note ids are reserved with UPDATE ...
+# RETURNING (3.35). The FTS5 and JSON1 extensions must be compiled in too.
+SQLITE_MIN_VERSION = (3, 35, 0)
+
+# Number of compiled statements kept per connection by the sqlite3 module.
+STATEMENT_CACHE_SIZE = 128
+
+# Ids of new notes reserved at once by a thread, with one write to note_ids.
+NOTE_ID_BLOCK = 100
+
+_local = threading.local()
+
+
+class _Connections(dict):
+    """Connections of one thread, by database file, compared by identity."""
+
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+
+# per-thread connection dicts, which go away with their thread
+_all_connections = weakref.WeakSet()
+
+def _connect(db_file):
+    """
+Return the long-lived connection to db_file owned by the calling thread.
+
+Connections are opened lazily, configured with CONNECTION_PRAGMAS and then
+reused by every later call from the same thread, so the parsed statements
+cached by sqlite3 survive from one request to the next.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = _Connections()
+        _all_connections.add(connections)
+
+    _conn = connections.get(db_file)
+    if _conn is None:
+        _conn = sqlite3.connect(db_file, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in CONNECTION_PRAGMAS:
+            _conn.execute(pragma)
+        ensure_schema(_conn)
+        connections[db_file] = _conn
+
+    return _conn
+
+def ensure_schema(_conn):
+    """
+Apply the SCHEMA_MIGRATIONS that the database behind _conn has not seen yet.
+
+The version is read again under the write lock, so connections racing to
+set up a new file apply each migration exactly once.
+    """
+    _check_sqlite(_conn)
+    version = _conn.execute("PRAGMA user_version;").fetchone()[0]
+    if not SCHEMA_MIGRATIONS[version:]:
+        return
+    _conn.execute("BEGIN IMMEDIATE;")
+    try:
+        version = _conn.execute("PRAGMA user_version;").fetchone()[0]
+        for script in SCHEMA_MIGRATIONS[version:]:
+            for statement in _statements(script):
+                _conn.execute(statement)
+        _conn.execute("PRAGMA user_version = %d;" % len(SCHEMA_MIGRATIONS))
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
+
+def _check_sqlite(_conn):
+    """
+Raise RuntimeError unless the SQLite library behind _conn is recent enough
+and has the FTS5 and JSON1 extensions, rather than failing on a later query.
+    """
+    if sqlite3.sqlite_version_info < SQLITE_MIN_VERSION:
+        raise RuntimeError("SQLite %s is too old: %s or later is needed" % (
+            sqlite3.sqlite_version, ".".join(map(str, SQLITE_MIN_VERSION))
+        ))
+    try:
+        fts5 = _conn.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5'), json_valid('1');").fetchone()[0]
+    except sqlite3.OperationalError:
+        raise RuntimeError("SQLite %s lacks the JSON1 extension" % sqlite3.sqlite_version) from None
+    if not fts5:
+        raise RuntimeError("SQLite %s lacks the FTS5 extension" % sqlite3.sqlite_version)
+
+def _statements(script):
+    """
+Split script into its SQL statements; executescript would commit the caller's transaction.
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+    if statement.strip():
+        yield statement
+
+def close_connections():
+    """
+Close every connection held by the calling thread.
+    """
+    connections = getattr(_local, "connections", None) or {}
+    while connections:
+        _, _conn = connections.popitem()
+        _conn.close()
+
+def open_connections():
+    """
+Number of connections currently held by all threads.
+    """
+    return sum(len(connections) for connections in list(_all_connections))
 
 def list_users():
     """
 List all users in the database.
     """
-    _conn = sqlite3.connect(USER_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
-    _c.execute("SELECT id FROM users;")
+    _c.execute("SELECT id FROM users WHERE id NOT IN (SELECT user FROM user_deletions);")
     result = [x[0] for x in _c.fetchall()]
 
-    _conn.close()
+    return result
+
+def list_users_page(limit, after=None, prefix=""):
+    """
+List one page of users in id order, with their numbers of notes and images
+and the bytes they use, as (id, notes, images, bytes) rows. Users being
+deleted are left out.
+
+Only ids starting with prefix are listed, read as a range of the users
+primary key. after is the id of the last user of the previous page.
+Returns the rows and the id to pass as after for the next page, or None
+when this is the last page.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    # one lower bound, which SQLite then seeks to in the index
+    if after is not None and after >= prefix:
+        conditions, params = ["users.id > ?"], [after]
+    else:
+        conditions, params = ["users.id >= ?"], [prefix]
+    if prefix and _prefix_end(prefix) is not None:
+        conditions.append("users.id < ?")
+        params.append(_prefix_end(prefix))
+    command = ("SELECT users.id, notes, images, bytes FROM users JOIN user_stats ON user_stats.user = users.id "
+               "WHERE %s AND NOT EXISTS (SELECT 1 FROM user_deletions WHERE user = users.id) "
+               "ORDER BY users.id LIMIT ?;" % " AND ".join(conditions))
+    _c.execute(command, params + [limit + 1])
+    rows = _c.fetchall()
+
+    if len(rows) <= limit:
+        return rows, None
+    del rows[limit:]
+    return rows, rows[-1][0]
+
+def _prefix_end(prefix):
+    """
+The smallest string greater than every string starting with prefix. Text is
+compared as UTF-8 bytes, which sort in the order of the code points. None
+when there is no such string.
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code < 0xE000:
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+def user_exists(user_id):
+    """
+Check whether a user exists, using the users primary key.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    _c.execute("SELECT 1 FROM users WHERE id = ?;", (user_id,))
+    result = _c.fetchone() is not None
 
     return result
 
 def verify(user_id, pw):
     """
-Verify user credentials.
+Verify user credentials. Users being deleted cannot log in.
+
+Passwords stored with a legacy or outdated hash are re-hashed with the
+current hasher once verified.
     """
-    _conn = sqlite3.connect(USER_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
-    _c.execute("SELECT pw FROM users WHERE id = ?;", (user_id,))
-    result = _c.fetchone()[0] == hashlib.sha256(pw.encode()).hexdigest()
+    _c.execute(
+        "SELECT pw FROM users WHERE id = ? AND id NOT IN (SELECT user FROM user_deletions);",
+        (user_id,)
+    )
+    row = _c.fetchone()
+    if row is None:
+        return False
+    result, needs_update = passwords.check(pw, row[0])
 
-    _conn.close()
+    if needs_update:
+        # only replace the hash that was verified, in case the password changed meanwhile
+        _c.execute("UPDATE users SET pw = ? WHERE id = ? AND pw = ?;", (passwords.make(pw), user_id, row[0]))
+        _conn.commit()
 
     return result
 
-def delete_user_from_db(user_id):
+def delete_user_from_db(user_id, remove_file=None):
     """
 Delete a user and all associated data from the database.
+
+remove_file(path) is called, once the deletion is committed, for every
+image file that no other user references any more.
     """
-    _conn = sqlite3.connect(USER_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
-    _c.execute("DELETE FROM users WHERE id = ?;", (user_id,))
-    _conn.commit()
-    _conn.close()
 
-    # when we delete a user FROM database USERS, we also need to delete all his or her notes data FROM database NOTES
-    _conn = sqlite3.connect(NOTE_DB_FILE_LOCATION)
+    _c.execute("BEGIN IMMEDIATE;")
+    try:
+        _c.execute(
+            "SELECT DISTINCT path FROM images AS mine WHERE owner = ? AND path IS NOT NULL "
+            "AND (hash IS NULL OR NOT EXISTS ("
+            "SELECT 1 FROM images AS other WHERE other.hash = mine.hash AND other.owner != mine.owner));",
+            (user_id,)
+        )
+        released = [x[0] for x in _c.fetchall()]
+
+        # notes and images records go with the user through ON DELETE CASCADE
+        _c.execute("DELETE FROM users WHERE id = ?;", (user_id,))
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
+
+    if remove_file is not None:
+        _remove_released(_conn, released, lambda paths: [remove_file(path) for path in paths])
+
+def request_user_deletion(user_id, lease=0):
+    """
+Tombstone a user: it can no longer log in and is left out of list_users(),
+while delete_user_batch() removes its data. The sessions of the user are
+deleted at once.
+
+lease is the time until which the caller owns the job. Returns False when
+the user does not exist; requesting the deletion twice keeps the first job.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
-    _c.execute("DELETE FROM notes WHERE user = ?;", (user_id,))
-    _conn.commit()
-    _conn.close()
 
-    # when we delete a user FROM database USERS, we also need to
-    # [1] delete all his or her images FROM image pool (done in app.py)
-    # [2] delete all his or her images records FROM database IMAGES
-    _conn = sqlite3.connect(IMAGE_DB_FILE_LOCATION)
+    _c.execute("BEGIN IMMEDIATE;")
+    try:
+        _c.execute(
+            "INSERT OR IGNORE INTO user_deletions (user, requested, notes_total, images_total, lease) "
+            "SELECT id, ?, (SELECT COUNT(*) FROM notes WHERE user = id), "
+            "(SELECT COUNT(*) FROM images WHERE owner = id), ? FROM users WHERE id = ?;",
+            (str(datetime.datetime.now()), lease, user_id)
+        )
+        _c.execute("SELECT 1 FROM user_deletions WHERE user = ?;", (user_id,))
+        result = _c.fetchone() is not None
+        _c.execute("DELETE FROM sessions WHERE user = ?;", (user_id,))
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
+
+    return result
+
+def claim_user_deletion(user_id, now, lease):
+    """
+Take over the deletion job of a user unless another process owns it, i.e.
+its lease has not expired at now. Returns whether the job is now owned until lease.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
-    _c.execute("DELETE FROM images WHERE owner = ?;", (user_id,))
+
+    _c.execute("UPDATE user_deletions SET lease = ? WHERE user = ? AND lease <= ?;", (lease, user_id, now))
+    result = _c.rowcount == 1
+
     _conn.commit()
-    _conn.close()
+
+    return result
+
+def delete_user_batch(user_id, batch_size, lease, remove_files=None):
+    """
+Delete up to batch_size notes and batch_size images of a user being deleted,
+in one transaction, and extend the lease of its job. Once nothing is left,
+the user itself is deleted, which ends the job.
+
+remove_files(paths) is called once the batch is committed, with the image
+files that no image references any more. Returns the numbers of notes,
+images and files deleted and whether the job is done, or None when no
+deletion of the user is pending.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    _c.execute("BEGIN IMMEDIATE;")
+    try:
+        _c.execute("UPDATE user_deletions SET lease = MAX(lease, ?) WHERE user = ?;", (lease, user_id))
+        if _c.rowcount == 0:
+            _conn.rollback()
+            return None
+
+        _c.execute(
+            "DELETE FROM notes WHERE rowid IN (SELECT rowid FROM notes WHERE user = ? LIMIT ?);",
+            (user_id, batch_size)
+        )
+        notes = _c.rowcount
+
+        _c.execute("SELECT uid, path, hash FROM images WHERE owner = ? LIMIT ?;", (user_id, batch_size))
+        images = _c.fetchall()
+        _c.execute(
+            "DELETE FROM images WHERE uid IN (SELECT value FROM json_each(?));",
+            (json.dumps([uid for uid, _, _ in images]),)
+        )
+        released = {(path, content_hash) for _, path, content_hash in images if path is not None}
+        files = []
+        if released:
+            _c.execute(
+                "SELECT DISTINCT hash FROM images WHERE hash IN (SELECT value FROM json_each(?));",
+                (json.dumps([content_hash for _, content_hash in released]),)
+            )
+            shared = {x[0] for x in _c.fetchall()}
+            files = sorted({path for path, content_hash in released if content_hash is None or content_hash not in shared})
+
+        _c.execute(
+            "UPDATE user_deletions SET notes_deleted = notes_deleted + ?, images_deleted = images_deleted + ?, "
+            "files_removed = files_removed + ? WHERE user = ?;",
+            (notes, len(images), len(files), user_id)
+        )
+        done = notes < batch_size and len(images) < batch_size
+        if done:
+            # the job row goes with the user through ON DELETE CASCADE; rows
+            # committed meanwhile, e.g. by the write-behind queue, go too
+            _c.execute("DELETE FROM users WHERE id = ?;", (user_id,))
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
+
+    if remove_files is not None:
+        _remove_released(_conn, files, remove_files)
+    return notes, len(images), len(files), done
+
+def user_deletions(user_id=None):
+    """
+Return the pending deletion jobs, or the one of user_id, as (user,
+requested, notes_total, images_total, notes_deleted, images_deleted,
+files_removed, lease) rows, oldest first.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    command = ("SELECT user, requested, notes_total, images_total, notes_deleted, images_deleted, "
+               "files_removed, lease FROM user_deletions")
+    if user_id is None:
+        _c.execute(command + " ORDER BY requested;")
+    else:
+        _c.execute(command + " WHERE user = ?;", (user_id,))
+    result = _c.fetchall()
+
+    return result
 
 def add_user(user_id, pw):
     """
 Add a new user to the database.
     """
-    _conn = sqlite3.connect(USER_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
     _c.execute(
-        "INSERT INTO users values(?, ?)",
-        (user_id.upper(), hashlib.sha256(pw.encode()).hexdigest())
+        "INSERT INTO users (id, pw) VALUES (?, ?)",
+        (user_id.upper(), passwords.make(pw))
     )
 
     _conn.commit()
-    _conn.close()
 
 def read_note_from_db(user_id):
     """
 Read all notes for a specific user from the database.
     """
-    _conn = sqlite3.connect(NOTE_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
     command = "SELECT note_id, timestamp, note FROM notes WHERE user = ?;"
@@ -98,15 +598,79 @@ Read all notes for a specific user from the database.
     result = _c.fetchall()
 
     _conn.commit()
-    _conn.close()
 
     return result
 
+def read_notes_page(user_id, limit, before=None):
+    """
+Read one page of notes for a specific user, newest first.
+
+before is the (timestamp, note_id) key of the last note of the previous page.
+Returns the rows and the key to pass as before for the next page, or None
+when this is the last page.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    if before is None:
+        command = ("SELECT note_id, timestamp, note FROM notes WHERE user = ? "
+                   "ORDER BY timestamp DESC, note_id DESC LIMIT ?;")
+        _c.execute(command, (user_id.upper(), limit + 1))
+    else:
+        command = ("SELECT note_id, timestamp, note FROM notes WHERE user = ? "
+                   "AND (timestamp, note_id) < (?, ?) "
+                   "ORDER BY timestamp DESC, note_id DESC LIMIT ?;")
+        _c.execute(command, (user_id.upper(), before[0], before[1], limit + 1))
+
+    return _split_page(_c.fetchall(), limit)
+
+def search_notes(user_id, terms, limit, offset=0):
+    """
+Search the notes of a user for every one of terms, each also matching as a
+word prefix, best matches first.
+
+Returns (note_id, timestamp, note, snippet) rows, where snippet is an
+excerpt of the note with the matches between SNIPPET_START and SNIPPET_END,
+and whether more results follow.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    # terms are quoted, so that no user input is read as query syntax; the
+    # user column only narrows the search, ids made of several tokens could
+    # match other users
+    query = 'user : "%s" AND %s' % (
+        user_id.upper().replace('"', '""'),
+        " ".join('"%s"*' % term.replace('"', '""') for term in terms)
+    )
+    _c.execute(
+        "SELECT notes.note_id, notes.timestamp, notes.note, "
+        "snippet(notes_fts, 0, ?, ?, '…', 16) "
+        "FROM notes_fts JOIN notes ON notes.rowid = notes_fts.rowid "
+        "WHERE notes_fts MATCH ? AND notes.user = ? "
+        "ORDER BY bm25(notes_fts, 1.0, 0.0), notes.rowid LIMIT ? OFFSET ?;",
+        (SNIPPET_START, SNIPPET_END, query, user_id.upper(), limit + 1, offset)
+    )
+    rows = _c.fetchall()
+
+    return rows[:limit], len(rows) > limit
+
+def rebuild_search_index(db_file=None):
+    """
+Rebuild the full-text index of the notes from scratch and merge its segments.
+    """
+    _conn = _connect(db_file or DB_FILE_LOCATION)
+
+    with _conn:
+        _conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild');")
+        _conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('optimize');")
+    return _conn.execute("SELECT COUNT(*) FROM notes;").fetchone()[0]
+
 def match_user_id_with_note_id(note_id):
     """
 Given the note id, confirm if the current user is the owner of the note which is being operated.
     """
-    _conn = sqlite3.connect(NOTE_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
     command = "SELECT user FROM notes WHERE note_id = ?;"
@@ -114,62 +678,167 @@ Given the note id, confirm if the current user is the owner of the note which is
     result = _c.fetchone()[0]
 
     _conn.commit()
-    _conn.close()
 
     return result
 
+def new_note(user_id, note_to_write, timestamp=None):
+    """
+Build the (user, timestamp, note, note_id) row of a new note, written now
+unless a timestamp is given.
+
+note_id is known before the row is inserted, e.g. while it waits in the
+write-behind queue: it is taken from a block of NOTE_ID_BLOCK ids that the
+calling thread reserved in note_ids, so that no two rows get the same id.
+    """
+    return (user_id.upper(), timestamp or str(datetime.datetime.now()), note_to_write, _next_note_id())
+
+def _next_note_id():
+    _conn = _connect(DB_FILE_LOCATION)
+    blocks = getattr(_local, "note_ids", None)
+    if blocks is None:
+        blocks = _local.note_ids = {}
+
+    # blocks belong to a connection: a reopened or replaced file gets a new one
+    block = blocks.get(DB_FILE_LOCATION)
+    if block is None or block[0] is not _conn or block[1] == block[2]:
+        next_id = _conn.execute(
+            "UPDATE note_ids SET next = next + ? RETURNING next - ?;", (NOTE_ID_BLOCK, NOTE_ID_BLOCK)
+        ).fetchone()[0]
+        _conn.commit()
+        block = blocks[DB_FILE_LOCATION] = [_conn, next_id, next_id + NOTE_ID_BLOCK]
+
+    block[1] += 1
+    return block[1] - 1
+
+def _forget_note_ids():
+    # a forked process must not hand out the ids reserved by its parent
+    _local.__dict__.pop("note_ids", None)
+
+os.register_at_fork(after_in_child=_forget_note_ids)
+
 def write_note_into_db(user_id, note_to_write):
     """
 Write a new note into the database.
     """
-    _conn = sqlite3.connect(NOTE_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
-    current_timestamp = str(datetime.datetime.now())
     _c.execute(
-        "INSERT INTO notes values(?, ?, ?, ?)",
-        (
-            user_id.upper(),
-            current_timestamp,
-            note_to_write,
-            hashlib.sha256((user_id.upper() + current_timestamp).encode()).hexdigest() # corrected here
-        )
+        "INSERT INTO notes (user, timestamp, note, note_id) VALUES (?, ?, ?, ?)",
+        new_note(user_id, note_to_write)
     )
 
     _conn.commit()
-    _conn.close()
+
+def write_notes_into_db(rows):
+    """
+Write many rows built by new_note() in a single transaction.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    try:
+        _c.executemany("INSERT INTO notes (user, timestamp, note, note_id) VALUES (?, ?, ?, ?)", rows)
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
 
 def delete_note_from_db(note_id):
     """
 Delete a note from the database.
     """
-    _conn = sqlite3.connect(NOTE_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
     _c.execute("DELETE FROM notes WHERE note_id = ?;", (note_id,))
     _conn.commit()
-    _conn.close()
 
-def image_upload_record(uid, owner, image_name, timestamp):
+def image_upload_record(uid, owner, image_name, timestamp, content_hash=None, size=None, place_file=None,
+                        remove_file=None):
     """
 Record an image upload into the database.
+
+place_file(existing_path) stores the uploaded content and returns its path in
+the image store; existing_path is the file already holding the same content,
+or None. It is called while the write lock is held, so that a concurrent
+delete of the last reference to that file cannot interleave. When the
+transaction rolls back, remove_file(path) is called with the file placed by
+place_file if no image references it.
     """
-    _conn = sqlite3.connect(IMAGE_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
-    _c.execute(
-        "INSERT INTO images VALUES (?, ?, ?, ?)",
-        (uid, owner, image_name, timestamp)
-    )
+    placed = []
+    _c.execute("BEGIN IMMEDIATE;")
+    try:
+        path = None
+        if place_file is not None:
+            _c.execute("SELECT path FROM images WHERE hash = ? LIMIT 1;", (content_hash,))
+            row = _c.fetchone()
+            path = place_file(row[0] if row else None)
+            if row is None:
+                placed.append(path)
 
-    _conn.commit()
-    _conn.close()
+        _c.execute(
+            "INSERT INTO images (uid, owner, name, timestamp, path, hash, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (uid, owner, image_name, timestamp, path, content_hash, size)
+        )
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        if remove_file is not None:
+            _release_placed(_conn, placed, lambda paths: [remove_file(path) for path in paths])
+        raise
+
+def _release_placed(_conn, paths, remove_files):
+    """
+Call remove_files() with the paths, placed in the image store by a
+transaction that rolled back, that no image references. The write lock is
+taken again, so that an upload of the same content placing the same path
+meanwhile has committed its image or has not started yet.
+    """
+    if not paths:
+        return
+    _c = _conn.cursor()
+
+    _c.execute("BEGIN IMMEDIATE;")
+    try:
+        _c.execute(
+            "SELECT DISTINCT path FROM images WHERE path IN (SELECT value FROM json_each(?));",
+            (json.dumps(paths),)
+        )
+        referenced = {row[0] for row in _c.fetchall()}
+        orphans = [path for path in dict.fromkeys(paths) if path not in referenced]
+        if orphans:
+            remove_files(orphans)
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
+
+def _remove_released(_conn, paths, remove_files):
+    """
+Call remove_files() with the paths, released by a committed transaction,
+that no image references again. The write lock is not held: a failed commit
+leaves every file in place, and removing files does not block writers. An
+upload of the same content committed since then keeps its file.
+    """
+    if not paths:
+        return
+    referenced = {row[0] for row in _conn.execute(
+        "SELECT DISTINCT path FROM images WHERE path IN (SELECT value FROM json_each(?));",
+        (json.dumps(paths),)
+    )}
+    orphans = [path for path in dict.fromkeys(paths) if path not in referenced]
+    if orphans:
+        remove_files(orphans)
 
 def list_images_for_user(owner):
     """
 List all images for a specific user from the database.
     """
-    _conn = sqlite3.connect(IMAGE_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
     command = "SELECT uid, timestamp, name FROM images WHERE owner = ?"
@@ -177,15 +846,67 @@ List all images for a specific user from the database.
     result = _c.fetchall()
 
     _conn.commit()
-    _conn.close()
 
     return result
 
+def list_images_page(owner, limit, before=None):
+    """
+List one page of images for a specific user, newest first.
+
+before is the (timestamp, uid) key of the last image of the previous page.
+Returns the rows and the key to pass as before for the next page, or None
+when this is the last page.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    if before is None:
+        command = ("SELECT uid, timestamp, name FROM images WHERE owner = ? "
+                   "ORDER BY timestamp DESC, uid DESC LIMIT ?;")
+        _c.execute(command, (owner, limit + 1))
+    else:
+        command = ("SELECT uid, timestamp, name FROM images WHERE owner = ? "
+                   "AND (timestamp, uid) < (?, ?) "
+                   "ORDER BY timestamp DESC, uid DESC LIMIT ?;")
+        _c.execute(command, (owner, before[0], before[1], limit + 1))
+
+    return _split_page(_c.fetchall(), limit)
+
+def list_image_files_page(owner, limit, before=None):
+    """
+List one page of images for a specific user, newest first, as (uid,
+timestamp, name, size, hash, path) rows; paged as by list_images_page().
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    if before is None:
+        command = ("SELECT uid, timestamp, name, size, hash, path FROM images WHERE owner = ? "
+                   "ORDER BY timestamp DESC, uid DESC LIMIT ?;")
+        _c.execute(command, (owner, limit + 1))
+    else:
+        command = ("SELECT uid, timestamp, name, size, hash, path FROM images WHERE owner = ? "
+                   "AND (timestamp, uid) < (?, ?) "
+                   "ORDER BY timestamp DESC, uid DESC LIMIT ?;")
+        _c.execute(command, (owner, before[0], before[1], limit + 1))
+
+    return _split_page(_c.fetchall(), limit)
+
+def _split_page(rows, limit):
+    """
+Split the limit + 1 rows read for a page into the page and the next page key.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    del rows[limit:]
+    last = rows[-1]
+    return rows, (last[1], last[0])
+
 def match_user_id_with_image_uid(image_uid):
     """
 Given the image id, confirm if the current user is the owner of the image which is being operated.
     """
-    _conn = sqlite3.connect(IMAGE_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
     command = "SELECT owner FROM images WHERE uid = ?;"
@@ -193,17 +914,255 @@ Given the image id, confirm if the current user is the owner of the image which
     result = _c.fetchone()[0]
 
     _conn.commit()
-    _conn.close()
 
     return result
 
-def delete_image_from_db(image_uid):
+def image_file_from_db(image_uid):
+    """
+Return (owner, path, hash) of an image, or None if it is unknown.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    _c.execute("SELECT owner, path, hash FROM images WHERE uid = ?;", (image_uid,))
+    result = _c.fetchone()
+
+    return result
+
+def delete_image_from_db(image_uid, remove_file=None):
     """
 Delete an image from the database.
+
+When no other image references the same file, remove_file(path) is called
+once the deletion is committed.
     """
-    _conn = sqlite3.connect(IMAGE_DB_FILE_LOCATION)
+    _conn = _connect(DB_FILE_LOCATION)
     _c = _conn.cursor()
 
-    _c.execute("DELETE FROM images WHERE uid = ?;", (image_uid,))
+    _c.execute("BEGIN IMMEDIATE;")
+    try:
+        _c.execute("SELECT path, hash FROM images WHERE uid = ?;", (image_uid,))
+        row = _c.fetchone()
+        _c.execute("DELETE FROM images WHERE uid = ?;", (image_uid,))
+
+        released = []
+        if row and row[0] and remove_file is not None:
+            path, content_hash = row
+            shared = False
+            if content_hash is not None:
+                _c.execute("SELECT 1 FROM images WHERE hash = ? LIMIT 1;", (content_hash,))
+                shared = _c.fetchone() is not None
+            if not shared:
+                released.append(path)
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
+
+    if released:
+        _remove_released(_conn, released, lambda paths: [remove_file(path) for path in paths])
+
+def owned_items(user_id, note_ids=(), image_uids=()):
+    """
+Return the sets of note_ids and image_uids that belong to user_id, checked
+with a single query whatever the number of ids.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    return _owned_items(_c, user_id, note_ids, image_uids)
+
+def _owned_items(_c, user_id, note_ids, image_uids):
+    # the ids are passed as JSON arrays, which also avoids the limit on the
+    # number of bound parameters
+    _c.execute(
+        "SELECT 'note', note_id FROM notes WHERE user = ? AND note_id IN (SELECT value FROM json_each(?)) "
+        "UNION ALL "
+        "SELECT 'image', uid FROM images WHERE owner = ? AND uid IN (SELECT value FROM json_each(?));",
+        (user_id, json.dumps(list(note_ids)), user_id, json.dumps(list(image_uids)))
+    )
+    notes, images = set(), set()
+    for kind, item_id in _c.fetchall():
+        (notes if kind == 'note' else images).add(item_id)
+    return notes, images
+
+def create_items(note_rows=(), image_rows=(), remove_files=None):
+    """
+Record many notes and images in a single transaction.
+
+note_rows are built by new_note(). image_rows are (uid, owner, name,
+timestamp, hash, size, place_file) tuples, where place_file is called as by
+image_upload_record() while the write lock is held. When the transaction
+rolls back, remove_files(paths) is called with the files placed by these
+calls that no image references.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    placed = []
+    _c.execute("BEGIN IMMEDIATE;")
+    try:
+        _c.executemany("INSERT INTO notes (user, timestamp, note, note_id) VALUES (?, ?, ?, ?)", note_rows)
+
+        hashes = [row[4] for row in image_rows]
+        _c.execute(
+            "SELECT hash, MIN(path) FROM images WHERE hash IN (SELECT value FROM json_each(?)) GROUP BY hash;",
+            (json.dumps(hashes),)
+        )
+        stored = dict(_c.fetchall())
+        records = []
+        for uid, owner, image_name, timestamp, content_hash, size, place_file in image_rows:
+            existing = stored.get(content_hash)
+            path = stored[content_hash] = place_file(existing)
+            if existing is None:
+                placed.append(path)
+            records.append((uid, owner, image_name, timestamp, path, content_hash, size))
+        _c.executemany(
+            "INSERT INTO images (uid, owner, name, timestamp, path, hash, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            records
+        )
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        if remove_files is not None:
+            _release_placed(_conn, placed, remove_files)
+        raise
+
+def delete_items(user_id, note_ids=(), image_uids=(), remove_files=None):
+    """
+Delete many notes and images of a user in a single transaction.
+
+Nothing is deleted, and None is returned, unless every id belongs to user_id;
+otherwise the numbers of notes and images deleted are returned.
+remove_files(paths) is called once the deletion is committed, with the
+image files that no image references any more.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    note_ids, image_uids = set(note_ids), set(image_uids)
+    _c.execute("BEGIN IMMEDIATE;")
+    try:
+        if _owned_items(_c, user_id, note_ids, image_uids) != (note_ids, image_uids):
+            _conn.rollback()
+            return None
+
+        images = json.dumps(list(image_uids))
+        _c.execute(
+            "SELECT DISTINCT path, hash FROM images WHERE uid IN (SELECT value FROM json_each(?)) AND path IS NOT NULL;",
+            (images,)
+        )
+        released = _c.fetchall()
+        _c.execute("DELETE FROM notes WHERE note_id IN (SELECT value FROM json_each(?));", (json.dumps(list(note_ids)),))
+        _c.execute("DELETE FROM images WHERE uid IN (SELECT value FROM json_each(?));", (images,))
+
+        files = []
+        if released and remove_files is not None:
+            _c.execute(
+                "SELECT DISTINCT hash FROM images WHERE hash IN (SELECT value FROM json_each(?));",
+                (json.dumps([content_hash for _, content_hash in released]),)
+            )
+            shared = {x[0] for x in _c.fetchall()}
+            files = sorted({path for path, content_hash in released if content_hash is None or content_hash not in shared})
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
+
+    if files:
+        _remove_released(_conn, files, remove_files)
+
+    return len(note_ids), len(image_uids)
+
+def export_items(user_id, note_ids=None, image_uids=None):
+    """
+Return the notes, as (note_id, timestamp, note) rows, and the images, as
+(uid, timestamp, name, size, hash) rows, of a user, oldest first. None selects
+every note or image of the user; ids the user does not own are left out.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    if note_ids is None:
+        _c.execute("SELECT note_id, timestamp, note FROM notes WHERE user = ? ORDER BY timestamp, note_id;", (user_id,))
+    else:
+        _c.execute(
+            "SELECT note_id, timestamp, note FROM notes WHERE user = ? "
+            "AND note_id IN (SELECT value FROM json_each(?)) ORDER BY timestamp, note_id;",
+            (user_id, json.dumps(list(note_ids)))
+        )
+    notes = _c.fetchall()
+
+    if image_uids is None:
+        _c.execute("SELECT uid, timestamp, name, size, hash FROM images WHERE owner = ? ORDER BY timestamp, uid;", (user_id,))
+    else:
+        _c.execute(
+            "SELECT uid, timestamp, name, size, hash FROM images WHERE owner = ? "
+            "AND uid IN (SELECT value FROM json_each(?)) ORDER BY timestamp, uid;",
+            (user_id, json.dumps(list(image_uids)))
+        )
+    images = _c.fetchall()
+
+    return notes, images
+
+def read_session(session_id, now):
+    """
+Return the (data, expires) of a session that has not expired yet, or None.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    _c.execute("SELECT data, expires FROM sessions WHERE id = ? AND expires > ?;", (session_id, now))
+    return _c.fetchone()
+
+def write_session(session_id, user_id, data, expires):
+    """
+Create or replace a session.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    _c.execute(
+        "INSERT OR REPLACE INTO sessions (id, user, data, expires) VALUES (?, ?, ?, ?);",
+        (session_id, user_id, data, expires)
+    )
+
     _conn.commit()
-    _conn.close()
\ No newline at end of file
+
+def touch_sessions(rows):
+    """
+Move the expiry of many sessions, given as (expires, id) rows, in one transaction.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    try:
+        _c.executemany("UPDATE sessions SET expires = MAX(expires, ?) WHERE id = ?;", rows)
+        _conn.commit()
+    except BaseException:
+        _conn.rollback()
+        raise
+
+def delete_sessions(session_id=None, user_id=None, expired_before=None):
+    """
+Delete one session, every session of a user, or every session that expired
+before a given time.
+    """
+    _conn = _connect(DB_FILE_LOCATION)
+    _c = _conn.cursor()
+
+    if session_id is not None:
+        _c.execute("DELETE FROM sessions WHERE id = ?;", (session_id,))
+    if user_id is not None:
+        _c.execute("DELETE FROM sessions WHERE user = ?;", (user_id,))
+    if expired_before is not None:
+        _c.execute("DELETE FROM sessions WHERE expires <= ?;", (expired_before,))
+
+    _conn.commit()
+
+# Every call to a function of this module reading or writing the database is
+# timed into metrics.DB_SECONDS, by function name.
+for _name, _function in list(globals().items()):
+    if (callable(_function) and getattr(_function, "__module__", None) == __name__ and not _name.startswith("_")
+            and _name not in ("ensure_schema", "close_connections", "open_connections", "new_note")):
+        globals()[_name] = metrics.timed(metrics.DB_SECONDS, _name)(_function)
@@ -0,0 +1,206 @@
+"""
+Sharded, content-addressed on-disk storage for uploaded images.
+
+Every image is stored under a key, its path relative to the image pool, which
+is recorded in the images table. Uploads are named after the SHA-256 of their
+content, so identical uploads share a single file. Keys spread files over two
+levels of directories named after the leading hex characters of the hash, so
+that no directory holds more than a fraction of the pool and an image is found
+or removed without listing any directory.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import metrics
+
+# Number of directory levels and hex characters per level, giving
+# 16 ** (SHARD_LEVELS * SHARD_WIDTH) leaf directories.
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+# Size of the blocks in which uploads are copied to disk and hashed.
+CHUNK_SIZE = 64 * 1024
+
+# Extensions of the images accepted from uploads and archives. Images are
+# served with the type guessed from their name, so any other one could be
+# served as, say, HTML.
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+
+def _shards(name):
+    shards = [name[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    return [shard for shard in shards if shard]
+
+
+def allowed_file(filename):
+    """Checks if file is allowed."""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def content_key(digest, filename):
+    """Storage key of content with the given SHA-256, e.g. 'ab/cd/abcd....png'."""
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    return "/".join(_shards(digest) + [digest + ('.' + extension if extension else '')])
+
+
+def image_key(image_uid, filename):
+    """Storage key of an image stored by uid, e.g. 'ab/cd/abcd...-name.png'."""
+    return "/".join(_shards(image_uid) + [f"{image_uid}-{filename}"])
+
+
+def path_for(root, key):
+    """Absolute location of key inside the pool rooted at root."""
+    return os.path.join(root, *key.split("/"))
+
+
+class Upload:
+    """
+    Temporary file inside the pool that hashes what is written to it, given to
+    the form parser so that an uploaded file is written to disk once, straight
+    where place() moves it from. Reading, seeking and the rest go to the file.
+    Closing it removes the file, unless receive() took it.
+    """
+
+    def __init__(self, root):
+        os.makedirs(root, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=root, prefix=".upload-")
+        self.root = root
+        self.file = os.fdopen(fd, "w+b")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.received = False
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def close(self):
+        self.file.close()
+        if not self.received:
+            discard(self.path)
+
+
+@metrics.timed(metrics.FILE_IO_SECONDS, 'receive')
+def receive(root, stream, chunk_size=CHUNK_SIZE):
+    """
+    Copy stream to a temporary file inside the pool, hashing it in the same pass.
+
+    Returns (digest, size, temporary path). The temporary file lives next to
+    the store so that place() can move it into the store with a rename. An
+    Upload of the same pool is already such a file, and is only closed.
+    """
+    if isinstance(stream, Upload) and stream.root == root and not stream.received:
+        stream.received = True
+        stream.close()
+        metrics.UPLOAD_BYTES.inc(amount=stream.size)
+        return stream.digest.hexdigest(), stream.size, stream.path
+
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    metrics.UPLOAD_BYTES.inc(amount=size)
+    return digest.hexdigest(), size, tmp_path
+
+
+@metrics.timed(metrics.FILE_IO_SECONDS, 'place')
+def place(root, tmp_path, key, existing_key=None):
+    """
+    Move a file returned by receive() to key and return the key it is stored
+    under. When the same content is already stored under existing_key, the
+    temporary file is dropped and existing_key is returned instead.
+    """
+    if existing_key:
+        os.remove(tmp_path)
+        return existing_key
+    target = path_for(root, key)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(tmp_path, target)
+    return key
+
+
+def discard(tmp_path):
+    """Remove a file returned by receive() that was not placed in the store."""
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """SHA-256 and size of a stored file."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as stored:
+        for chunk in iter(lambda: stored.read(chunk_size), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+@metrics.timed(metrics.FILE_IO_SECONDS, 'link')
+def link(root, source_key, key):
+    """
+    Make the file stored under source_key also available under key, with a
+    hard link when the filesystem allows it and a copy otherwise.
+    """
+    target = path_for(root, key)
+    if os.path.exists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(path_for(root, source_key), target)
+    except OSError:
+        shutil.copyfile(path_for(root, source_key), target)
+
+
+@metrics.timed(metrics.FILE_IO_SECONDS, 'remove')
+def remove(root, key):
+    """Remove the file stored under key, if it is still there."""
+    try:
+        os.remove(path_for(root, key))
+    except FileNotFoundError:
+        pass
+
+
+def shard_pool(root, images):
+    """
+    Move the files of a flat, legacy pool into their sharded location.
+
+    images is an iterable of (uid, filename) rows; the legacy file of each is
+    root/<uid>-<filename>. Returns the (uid, key) pairs whose file is now at
+    its key, including files moved by an earlier, interrupted run, so that the
+    keys can be recorded in a single batch.
+    """
+    located = []
+    for image_uid, filename in images:
+        key = image_key(image_uid, filename)
+        target = path_for(root, key)
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(root, f"{image_uid}-{filename}"), target)
+        except FileNotFoundError:
+            if not os.path.exists(target):
+                continue
+        located.append((image_uid, key))
+
+    return located
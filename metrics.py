@@ -0,0 +1,219 @@
+"""
+Performance instrumentation, exposed in the Prometheus text format on /metrics.
+
+Histograms and counters are only updated while the module is enabled
+(METRICS_ENABLED in config.py): disabled, an instrumented call costs one
+check of a module global. Collected metrics, such as the cache counters the
+application keeps anyway, are read when /metrics is requested.
+
+Values are kept per process. With several serve.py workers, each scrape of
+/metrics reports the worker that answered it.
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+# seconds; from a cached page read to a slow upload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+enabled = False
+
+_registry = []
+
+
+def configure(enable):
+    """Start or stop updating the histograms and counters."""
+    global enabled
+    enabled = bool(enable)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """(suffix, [(label name, label value)], value) of every sample."""
+        with self._lock:
+            return [("", list(zip(self.labels, labels)), value) for labels, value in self._values.items()]
+
+
+class Counter(_Metric):
+    """Monotonic counter, by label values."""
+
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        if not enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value going up and down, by label values."""
+
+    type = "gauge"
+
+    def inc(self, *labels, amount=1):
+        if not enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values into cumulative buckets, by label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # one count per bucket, then +Inf, the count and the sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2) + [0.0]
+            counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        result = []
+        for labels, counts in values:
+            labels = list(zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                result.append(("_bucket", labels + [("le", _format_value(bound))], cumulative))
+            result.append(("_count", labels, counts[-2]))
+            result.append(("_sum", labels, counts[-1]))
+        return result
+
+    def time(self, *labels):
+        """Context manager observing the time spent in its block."""
+        return _Timer(self, labels)
+
+
+class Collected(_Metric):
+    """Metric whose values are returned by collect() when /metrics is read."""
+
+    def __init__(self, name, documentation, type, labels, collect):
+        super().__init__(name, documentation, labels)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        return [("", list(zip(self.labels, labels)), value) for labels, value in self.collect().items()]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter() if enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def timed(histogram, *labels):
+    """Decorator observing the duration of every call into histogram."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorate
+
+
+def timed_template_class(base):
+    """Subclass of the jinja2 Template class base timing every rendering into TEMPLATE_SECONDS."""
+    class TimedTemplate(base):
+        def render(self, *args, **kwargs):
+            if not enabled:
+                return super().render(*args, **kwargs)
+            with TEMPLATE_SECONDS.time(self.name or "<string>"):
+                return super().render(*args, **kwargs)
+
+        def generate(self, *args, **kwargs):
+            # streamed pages: includes the time spent sending the chunks
+            if not enabled:
+                yield from super().generate(*args, **kwargs)
+                return
+            with TEMPLATE_SECONDS.time(self.name or "<string>"):
+                yield from super().generate(*args, **kwargs)
+    return TimedTemplate
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        samples = metric.samples()
+        lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+        lines.append("# TYPE %s %s" % (metric.name, metric.type))
+        for suffix, labels, value in samples:
+            labels = ",".join('%s="%s"' % (name, _escape(str(label))) for name, label in labels)
+            lines.append("%s%s%s %s" % (metric.name, suffix, "{%s}" % labels if labels else "", _format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+HTTP_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request, by endpoint, method and status.",
+    ("endpoint", "method", "status")
+)
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being handled.")
+DB_SECONDS = Histogram("db_call_duration_seconds", "Time spent in a function of database.py.", ("function",))
+TEMPLATE_SECONDS = Histogram("template_render_duration_seconds", "Time spent rendering a template.", ("template",))
+FILE_IO_SECONDS = Histogram(
+    "file_io_duration_seconds", "Time spent reading or writing image files, by operation.", ("operation",)
+)
+UPLOAD_BYTES = Counter("upload_bytes_total", "Bytes of uploaded image files received.")
@@ -0,0 +1,263 @@
+"""
+Command line tool for migrating existing deployments to the current database layout.
+
+Usage: python migrate.py <command> [options]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import database
+import image_store
+import thumbnails
+
+
+def consolidate(users_db, notes_db, images_db, target_db):
+    """
+    Copy the legacy users.db, notes.db and images.db files into the single
+    database file used by database.py.
+
+    Every table is copied with one INSERT ... SELECT inside a single
+    transaction, so the migration either fully succeeds or leaves the target
+    untouched. Rows already present in the target are kept, which makes the
+    command safe to re-run. Notes get integer ids from note_ids, oldest
+    first; a note is already present when a note of the same user has the
+    same timestamp and text. Notes and images whose owner does not exist are
+    skipped since the new schema enforces ownership with foreign keys.
+
+    Returns a dict mapping each table to (copied, skipped) row counts.
+    """
+    _conn = sqlite3.connect(target_db, isolation_level=None)
+    _conn.execute("PRAGMA foreign_keys = ON;")
+    database.ensure_schema(_conn)
+
+    _conn.execute("ATTACH DATABASE ? AS legacy_users;", (users_db,))
+    _conn.execute("ATTACH DATABASE ? AS legacy_notes;", (notes_db,))
+    _conn.execute("ATTACH DATABASE ? AS legacy_images;", (images_db,))
+
+    copies = (
+        ("users", "legacy_users.users",
+         "INSERT OR IGNORE INTO users (id, pw) "
+         "SELECT id, pw FROM legacy_users.users WHERE id IS NOT NULL AND pw IS NOT NULL;"),
+        ("notes", "legacy_notes.notes",
+         "INSERT INTO notes (note_id, user, timestamp, note) "
+         "SELECT (SELECT next FROM note_ids) + ROW_NUMBER() OVER (ORDER BY timestamp, note_id) - 1, "
+         "user, timestamp, note FROM legacy_notes.notes AS legacy "
+         "WHERE note_id IS NOT NULL AND user IN (SELECT id FROM users) AND NOT EXISTS ("
+         "SELECT 1 FROM notes WHERE notes.user = legacy.user AND notes.timestamp = legacy.timestamp "
+         "AND notes.note IS legacy.note);"),
+        ("images", "legacy_images.images",
+         "INSERT OR IGNORE INTO images (uid, owner, name, timestamp) "
+         "SELECT uid, owner, name, timestamp FROM legacy_images.images "
+         "WHERE uid IS NOT NULL AND owner IN (SELECT id FROM users);"),
+    )
+
+    report = {}
+    try:
+        _conn.execute("BEGIN IMMEDIATE;")
+        for table, source, command in copies:
+            total = _conn.execute("SELECT COUNT(*) FROM %s;" % source).fetchone()[0]
+            copied = _conn.execute(command).rowcount
+            report[table] = (copied, total - copied)
+        _conn.execute("UPDATE note_ids SET next = MAX(next, (SELECT COALESCE(MAX(note_id), 0) + 1 FROM notes));")
+        _conn.execute("COMMIT;")
+    except sqlite3.Error:
+        _conn.execute("ROLLBACK;")
+        raise
+    finally:
+        _conn.close()
+
+    return report
+
+
+def shard_images(pool, target_db):
+    """
+    Move the files of a flat image pool into the sharded image store and
+    record their keys in the images table.
+
+    Only images without a recorded path are considered, so the command can be
+    re-run after an interruption. All keys are written in one transaction.
+
+    Returns (recorded, missing): the number of images now in the store and
+    the number whose file could not be found.
+    """
+    _conn = sqlite3.connect(target_db)
+    database.ensure_schema(_conn)
+    try:
+        pending = _conn.execute("SELECT uid, name FROM images WHERE path IS NULL;").fetchall()
+        located = image_store.shard_pool(pool, pending)
+        with _conn:
+            _conn.executemany(
+                "UPDATE images SET path = ? WHERE uid = ?;",
+                ((key, image_uid) for image_uid, key in located)
+            )
+    finally:
+        _conn.close()
+
+    return len(located), len(pending) - len(located)
+
+
+def hash_images(pool, target_db):
+    """
+    Move the images of the store to content-addressed keys, so that identical
+    files are stored once.
+
+    Every image without a recorded hash is hashed and linked to its content
+    key, or to the key of an identical file already in the store. The new
+    keys are recorded in one transaction and the former files are removed
+    once it is committed, so an interrupted run leaves the database pointing
+    at files that exist and can simply be re-run.
+
+    Returns (hashed, deduplicated, missing) image counts.
+    """
+    _conn = sqlite3.connect(target_db)
+    database.ensure_schema(_conn)
+    try:
+        pending = _conn.execute(
+            "SELECT uid, name, path FROM images WHERE hash IS NULL AND path IS NOT NULL;"
+        ).fetchall()
+
+        stored, updates, released = {}, [], set()
+        deduplicated = missing = 0
+        for image_uid, name, path in pending:
+            try:
+                digest, size = image_store.hash_file(image_store.path_for(pool, path))
+            except FileNotFoundError:
+                missing += 1
+                continue
+
+            if digest not in stored:
+                row = _conn.execute("SELECT path FROM images WHERE hash = ? LIMIT 1;", (digest,)).fetchone()
+                if row:
+                    stored[digest] = row[0]
+            key = stored.get(digest)
+            if key is None:
+                key = stored[digest] = image_store.content_key(digest, name)
+                image_store.link(pool, path, key)
+            else:
+                deduplicated += 1
+
+            updates.append((key, digest, size, image_uid))
+            if path != key:
+                released.add(path)
+
+        with _conn:
+            _conn.executemany("UPDATE images SET path = ?, hash = ?, size = ? WHERE uid = ?;", updates)
+    finally:
+        _conn.close()
+
+    for path in released:
+        image_store.remove(pool, path)
+
+    return len(updates), deduplicated, missing
+
+
+def backfill_thumbnails(pool, target_db, workers=None):
+    """
+    Generate the missing resized variants of every stored image, spreading
+    the work over one process per core by default.
+
+    Returns the number of stored files processed.
+    """
+    _conn = sqlite3.connect(target_db)
+    database.ensure_schema(_conn)
+    try:
+        keys = [row[0] for row in _conn.execute("SELECT DISTINCT path FROM images WHERE path IS NOT NULL;")]
+    finally:
+        _conn.close()
+
+    return thumbnails.backfill(pool, keys, workers)
+
+
+def rebuild_search(target_db):
+    """
+    Rebuild the full-text index of the notes from the notes table, e.g. after
+    copying notes into a database with the triggers disabled.
+
+    Returns the number of notes indexed.
+    """
+    try:
+        return database.rebuild_search_index(target_db)
+    finally:
+        database.close_connections()
+
+
+def _consolidate_command(args):
+    for path in (args.users, args.notes, args.images):
+        if not os.path.exists(path):
+            sys.exit("migrate.py: %s does not exist" % path)
+
+    report = consolidate(args.users, args.notes, args.images, args.target)
+    for table, (copied, skipped) in report.items():
+        print("%-7s %6d copied, %6d skipped" % (table, copied, skipped))
+
+
+def _shard_images_command(args):
+    recorded, missing = shard_images(args.pool, args.target)
+    print("images  %6d moved into the store, %6d files missing" % (recorded, missing))
+
+
+def _hash_images_command(args):
+    hashed, deduplicated, missing = hash_images(args.pool, args.target)
+    print("images  %6d hashed, %6d duplicates merged, %6d files missing" % (hashed, deduplicated, missing))
+
+
+def _backfill_thumbnails_command(args):
+    done = backfill_thumbnails(args.pool, args.target, args.workers)
+    print("images  %6d processed" % done)
+
+
+def _rebuild_search_command(args):
+    indexed = rebuild_search(args.target)
+    print("notes   %6d indexed" % indexed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate existing deployments.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser(
+        "consolidate", help="merge users.db, notes.db and images.db into one database file"
+    )
+    command.add_argument("--users", default="database_file/users.db")
+    command.add_argument("--notes", default="database_file/notes.db")
+    command.add_argument("--images", default="database_file/images.db")
+    command.add_argument("--target", default=database.DB_FILE_LOCATION)
+    command.set_defaults(func=_consolidate_command)
+
+    command = commands.add_parser(
+        "shard-images", help="move a flat image pool into the sharded image store"
+    )
+    command.add_argument("--pool", default="image_pool")
+    command.add_argument("--target", default=database.DB_FILE_LOCATION)
+    command.set_defaults(func=_shard_images_command)
+
+    command = commands.add_parser(
+        "hash-images", help="store images by content hash, merging identical files"
+    )
+    command.add_argument("--pool", default="image_pool")
+    command.add_argument("--target", default=database.DB_FILE_LOCATION)
+    command.set_defaults(func=_hash_images_command)
+
+    command = commands.add_parser(
+        "backfill-thumbnails", help="generate the missing resized variants of stored images"
+    )
+    command.add_argument("--pool", default="image_pool")
+    command.add_argument("--target", default=database.DB_FILE_LOCATION)
+    command.add_argument("--workers", type=int, default=None, help="processes (default: one per core)")
+    command.set_defaults(func=_backfill_thumbnails_command)
+
+    command = commands.add_parser(
+        "rebuild-search", help="rebuild the full-text index of the notes"
+    )
+    command.add_argument("--target", default=database.DB_FILE_LOCATION)
+    command.set_defaults(func=_rebuild_search_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
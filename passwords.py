@@ -0,0 +1,166 @@
+"""
+Password hashing for the users table.
+
+Passwords are stored as '<algorithm>$<parameters>$<salt>$<hash>' strings
+produced by one of HASHERS, with a random salt per user. Hashes written
+before this format (unsalted SHA-256 hex digests) are still accepted, and
+check() reports them, like hashes made with another algorithm or weaker
+parameters than the configured hasher, as needing an upgrade, so that they
+are re-hashed on the next successful login.
+
+Key derivation is deliberately slow, so it runs on a bounded pool of WORKERS
+threads (hashlib releases the GIL while deriving): a burst of logins queues
+there instead of saturating every core. Successful verifications are
+remembered by an in-process cache, keyed by the stored hash, so that a user
+logging in again does not pay for the derivation a second time.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+
+SALT_SIZE = 16
+
+# Threads deriving keys; logins beyond that wait for a free one.
+WORKERS = 4
+
+# Successful verifications remembered, and for how long (seconds).
+VERIFY_CACHE_SIZE = 1024
+VERIFY_CACHE_TTL = 3600
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _forget_executor():
+    # the threads of the pool do not survive a fork
+    global _executor, _executor_lock
+    _executor, _executor_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_executor)
+_verified = cache.LocalBackend(VERIFY_CACHE_SIZE)
+_cache_key = os.urandom(32)
+
+
+class ScryptHasher:
+    """scrypt, memory-hard; about 16 MiB and 50 ms per hash with the defaults."""
+
+    algorithm = "scrypt"
+
+    def __init__(self, n=2 ** 14, r=8, p=1):
+        self.n, self.r, self.p = n, r, p
+
+    def encode(self, pw, salt):
+        key = hashlib.scrypt(pw.encode(), salt=salt, n=self.n, r=self.r, p=self.p,
+                             maxmem=256 * self.n * self.r)
+        return "%s$%d$%d$%d$%s$%s" % (self.algorithm, self.n, self.r, self.p, salt.hex(), key.hex())
+
+    def verify(self, pw, encoded):
+        _, n, r, p, salt, _ = encoded.split("$")
+        hasher = ScryptHasher(int(n), int(r), int(p))
+        return hmac.compare_digest(hasher.encode(pw, bytes.fromhex(salt)), encoded)
+
+    def needs_update(self, encoded):
+        _, n, r, p, _, _ = encoded.split("$")
+        return (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+
+class PBKDF2Hasher:
+    """PBKDF2-HMAC-SHA256, for platforms whose OpenSSL lacks scrypt."""
+
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations=600000):
+        self.iterations = iterations
+
+    def encode(self, pw, salt):
+        key = hashlib.pbkdf2_hmac("sha256", pw.encode(), salt, self.iterations)
+        return "%s$%d$%s$%s" % (self.algorithm, self.iterations, salt.hex(), key.hex())
+
+    def verify(self, pw, encoded):
+        _, iterations, salt, _ = encoded.split("$")
+        hasher = PBKDF2Hasher(int(iterations))
+        return hmac.compare_digest(hasher.encode(pw, bytes.fromhex(salt)), encoded)
+
+    def needs_update(self, encoded):
+        return int(encoded.split("$")[1]) != self.iterations
+
+
+class LegacySHA256Hasher:
+    """Unsalted SHA-256 hex digests written by earlier versions; verify only."""
+
+    algorithm = "sha256"
+
+    def verify(self, pw, encoded):
+        return hmac.compare_digest(hashlib.sha256(pw.encode()).hexdigest(), encoded)
+
+    def needs_update(self, encoded):
+        return True
+
+
+HASHERS = {hasher.algorithm: hasher for hasher in (ScryptHasher(), PBKDF2Hasher(), LegacySHA256Hasher())}
+
+# Hasher used for new and upgraded passwords.
+hasher = HASHERS["scrypt"]
+
+
+def configure(algorithm=None, workers=None):
+    """Select the hasher of new passwords and the size of the worker pool."""
+    global hasher, WORKERS, _executor
+    if algorithm is not None:
+        hasher = HASHERS[algorithm]
+    if workers is not None and workers != WORKERS:
+        with _executor_lock:
+            WORKERS = workers
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+                _executor = None
+
+
+def _algorithm(encoded):
+    return encoded.split("$", 1)[0] if "$" in encoded else LegacySHA256Hasher.algorithm
+
+
+def _run(func, *args):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="passwords")
+    return _executor.submit(func, *args).result()
+
+
+def make(pw):
+    """Stored form of a new password."""
+    return _run(hasher.encode, pw, os.urandom(SALT_SIZE))
+
+
+def check(pw, encoded):
+    """
+    Whether pw matches the stored hash, as a (valid, needs_update) pair;
+    needs_update is only true for valid passwords whose stored hash should
+    be replaced by make(pw).
+    """
+    stored_hasher = HASHERS.get(_algorithm(encoded))
+    if stored_hasher is None:
+        return False, False
+    needs_update = stored_hasher is not hasher or hasher.needs_update(encoded)
+
+    fingerprint = hmac.new(_cache_key, encoded.encode() + b"\0" + pw.encode(), "sha256").digest()
+    remembered = _verified.get(encoded)
+    if remembered is not cache.MISSING and hmac.compare_digest(remembered, fingerprint):
+        return True, needs_update
+
+    valid = _run(stored_hasher.verify, pw, encoded)
+    if valid and not needs_update:
+        _verified.set(encoded, fingerprint, VERIFY_CACHE_TTL)
+    return valid, valid and needs_update
+
+
+def cache_stats():
+    """Hits and misses of the cache of verified passwords."""
+    return {"hits": _verified.hits, "misses": _verified.misses}
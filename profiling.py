@@ -0,0 +1,224 @@
+"""
+Sampling profiler of requests, aggregated per route and exported as collapsed
+stacks.
+
+While a request is profiled, a background thread records the stack of the
+thread handling it every `interval` seconds, from the WSGI call down to the
+innermost Python frame, streamed bodies included. Time spent in SQLite or in
+file I/O shows up under the Python call that waits for it. Stacks are added
+up per endpoint, and the last RECENT_PROFILES requests are also kept on
+their own; both are exported in the collapsed format read by flamegraph.pl
+and speedscope: one "outer;...;inner count" line per stack.
+
+A request is profiled with probability `sample_rate`, or when its X-Profile
+header holds the token (any value when no token is set). While disabled
+(PROFILING_ENABLED in config.py), a request costs one attribute check; an
+unprofiled request of an enabled profiler costs one random number. Like
+metrics.py, profiles are kept per process.
+"""
+
+import collections
+import hmac
+import random
+import secrets
+import sys
+import threading
+import time
+
+RECENT_PROFILES = 100
+
+# key of the profile of the current request in the WSGI environ
+ENVIRON_KEY = "profiling.profile"
+
+
+class _Profile:
+    __slots__ = ("id", "endpoint", "thread", "started", "seconds", "stacks")
+
+    def __init__(self):
+        self.id = secrets.token_hex(8)
+        self.endpoint = None
+        self.thread = threading.get_ident()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.stacks = collections.Counter()
+
+
+class _Route:
+    __slots__ = ("requests", "seconds", "stacks")
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.stacks = collections.Counter()
+
+    def add(self, profile):
+        self.requests += 1
+        self.seconds += profile.seconds
+        self.stacks.update(profile.stacks)
+
+
+class _ProfiledBody:
+    """Response iterable stopping the profile of its request when closed."""
+
+    def __init__(self, result, stop):
+        self._result = result
+        self._iterator = iter(result)
+        self._stop = stop
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        try:
+            if hasattr(self._result, "close"):
+                self._result.close()
+        finally:
+            self._stop()
+
+
+class Profiler:
+    """Profiles of the requests going through middleware(), by endpoint."""
+
+    def __init__(self, enabled=False, sample_rate=0.0, interval=0.005, token=None):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.token = token
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._active = {}
+        self._routes = {}
+        self._recent = collections.OrderedDict()
+        self._names = {}
+        self._roots = {_ProfiledBody.__next__.__code__, _ProfiledBody.close.__code__}
+        self._thread = None
+
+    def middleware(self, wsgi_app):
+        """WSGI application profiling the requests of wsgi_app chosen by wanted()."""
+        def profiled_app(environ, start_response):
+            if not self.enabled or not self.wanted(environ):
+                return wsgi_app(environ, start_response)
+
+            profile = environ[ENVIRON_KEY] = _Profile()
+
+            def profiled_start_response(status, headers, exc_info=None):
+                return start_response(status, headers + [("X-Profile-Id", profile.id)], exc_info)
+
+            self._start(profile)
+            try:
+                result = wsgi_app(environ, profiled_start_response)
+            except BaseException:
+                self._stop(profile)
+                raise
+            return _ProfiledBody(result, lambda: self._stop(profile))
+
+        self._roots.add(profiled_app.__code__)
+        return profiled_app
+
+    def wanted(self, environ):
+        """Whether the request of environ is to be profiled."""
+        requested = environ.get("HTTP_X_PROFILE")
+        if requested is not None and (self.token is None or hmac.compare_digest(requested, self.token)):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def summary(self):
+        """Profiled requests, time and samples per endpoint, and the recent requests."""
+        with self._lock:
+            routes = [
+                {"endpoint": endpoint, "requests": route.requests, "seconds": route.seconds,
+                 "samples": sum(route.stacks.values())}
+                for endpoint, route in self._routes.items()
+            ]
+            recent = [
+                {"id": profile.id, "endpoint": profile.endpoint, "seconds": profile.seconds,
+                 "samples": sum(profile.stacks.values())}
+                for profile in reversed(self._recent.values())
+            ]
+        routes.sort(key=lambda route: route["seconds"], reverse=True)
+        return {"enabled": self.enabled, "sample_rate": self.sample_rate, "interval": self.interval,
+                "routes": routes, "requests": recent}
+
+    def collapsed(self, endpoint=None):
+        """Collapsed stacks of endpoint, or of every endpoint; None if it has no profile."""
+        with self._lock:
+            if endpoint is None:
+                stacks = collections.Counter()
+                for route in self._routes.values():
+                    stacks.update(route.stacks)
+            elif endpoint in self._routes:
+                stacks = collections.Counter(self._routes[endpoint].stacks)
+            else:
+                return None
+        return _collapsed(stacks)
+
+    def request_collapsed(self, profile_id):
+        """Collapsed stacks of one recent request; None if it is not kept."""
+        with self._lock:
+            profile = self._recent.get(profile_id)
+            if profile is None:
+                return None
+            stacks = collections.Counter(profile.stacks)
+        return _collapsed(stacks)
+
+    def reset(self):
+        """Forget every finished profile."""
+        with self._lock:
+            self._routes.clear()
+            self._recent.clear()
+
+    def _start(self, profile):
+        with self._lock:
+            self._active[profile.thread] = profile
+            # not running yet, or lost by a fork of serve.py
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+
+    def _stop(self, profile):
+        profile.seconds = time.perf_counter() - profile.started
+        with self._lock:
+            self._active.pop(profile.thread, None)
+            endpoint = profile.endpoint = profile.endpoint or "none"
+            route = self._routes.get(endpoint)
+            if route is None:
+                route = self._routes[endpoint] = _Route()
+            route.add(profile)
+            self._recent[profile.id] = profile
+            if len(self._recent) > RECENT_PROFILES:
+                self._recent.popitem(last=False)
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._active:
+                    self._wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread, profile in self._active.items():
+                    frame = frames.get(thread)
+                    if frame is not None:
+                        profile.stacks[self._stack(frame)] += 1
+            frames = frame = None
+
+    def _stack(self, frame):
+        names = []
+        while frame is not None and frame.f_code not in self._roots:
+            code = frame.f_code
+            name = self._names.get(code)
+            if name is None:
+                filename = "/".join(code.co_filename.replace("\\", "/").rsplit("/", 2)[-2:])
+                name = self._names[code] = "%s (%s:%d)" % (code.co_name, filename, code.co_firstlineno)
+            names.append(name)
+            frame = frame.f_back
+        names.reverse()
+        return ";".join(names)
+
+
+def _collapsed(stacks):
+    return "".join("%s %d\n" % (stack, count) for stack, count in sorted(stacks.items()) if stack)
@@ -0,0 +1,244 @@
+"""
+Production server for the application.
+
+The application is imported and its templates compiled once, then
+SERVE_WORKERS processes are forked; they share the listening socket and each
+handles requests on a pool of SERVE_THREADS threads. A worker that dies is
+replaced, with a growing delay when it dies on start-up. SIGTERM or SIGINT stops accepting connections, lets the requests
+in progress finish for up to SERVE_SHUTDOWN_TIMEOUT seconds and flushes the
+notes queued for writing before exiting.
+
+Workers share the database file, whose connections are only opened after the
+fork, and the generations of the local user cache, so that a change made
+through one worker invalidates the pages cached by all of them.
+
+With --asgi, the application is served through asgi.py by uvicorn (which
+must be installed). uvicorn starts its workers itself, so several of them
+need the redis user cache.
+
+Usage: python serve.py [--host 127.0.0.1] [--port 8000] [--workers N] [--threads N] [--asgi]
+"""
+
+import argparse
+import atexit
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from werkzeug.serving import LISTEN_QUEUE, BaseWSGIServer
+
+import cache
+import database
+from app import app, user_cache
+
+logger = logging.getLogger("serve")
+
+# A worker exiting less than WORKER_MIN_UPTIME seconds after it was forked
+# failed to start: it is replaced after WORKER_RESTART_DELAY seconds, doubled
+# for each such failure in a row, and the server gives up after
+# WORKER_MAX_FAILURES of them instead of forking in a tight loop.
+WORKER_MIN_UPTIME = 5
+WORKER_RESTART_DELAY = 0.5
+WORKER_MAX_FAILURES = 5
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug WSGI server handling requests on a fixed pool of threads."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None, multiprocess=False, shutdown_timeout=None):
+        super().__init__(host, port, app, fd=fd)
+        self.multiprocess = multiprocess
+        self.shutdown_timeout = shutdown_timeout
+        # requests still running once server_close() gave up waiting for them
+        self.unfinished = 0
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="request")
+        self._requests = set()
+
+    def process_request(self, request, client_address):
+        future = self._pool.submit(self._process_request_thread, request, client_address)
+        self._requests.add(future)
+        future.add_done_callback(self._requests.discard)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # requests already accepted are answered before the worker exits, for
+        # up to shutdown_timeout seconds
+        self._pool.shutdown(wait=False)
+        self.unfinished = len(wait(list(self._requests), timeout=self.shutdown_timeout).not_done)
+
+
+def preload(application):
+    """Do the work every worker would otherwise repeat before the fork."""
+    for name in application.jinja_env.list_templates():
+        application.jinja_env.get_template(name)
+    if isinstance(user_cache.backend, cache.LocalBackend):
+        user_cache.backend.share_generations()
+    # connections must not be shared with the forked processes
+    database.close_connections()
+
+
+def _bind(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(LISTEN_QUEUE)
+    return sock
+
+
+def _run_worker(sock, host, threads, multiprocess, shutdown_timeout):
+    """Serve until SIGTERM or SIGINT; returns whether every request was answered."""
+    server = PooledWSGIServer(
+        host, 0, app, threads, fd=sock.fileno(), multiprocess=multiprocess, shutdown_timeout=shutdown_timeout
+    )
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return: it cannot run in it
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    if server.unfinished:
+        logger.warning("%d requests still running after %ss, exiting", server.unfinished, shutdown_timeout)
+    return not server.unfinished
+
+
+def _spawn(sock, host, threads, shutdown_timeout):
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            _run_worker(sock, host, threads, True, shutdown_timeout)
+        except BaseException:
+            logger.exception("worker %d failed", os.getpid())
+            status = 1
+        finally:
+            # flush the write-behind queue and close what was opened at exit,
+            # without returning into the parent's code
+            atexit._run_exitfuncs()
+            os._exit(status)
+    return pid
+
+
+def serve(host, port, workers, threads, shutdown_timeout):
+    """Serve the application until SIGTERM or SIGINT."""
+    sock = _bind(host, port)
+    preload(app)
+    logger.info("serving on http://%s:%d with %d workers of %d threads", host, port, workers, threads)
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        if not _run_worker(sock, host, threads, False, shutdown_timeout):
+            # the request threads left would keep the interpreter from exiting
+            atexit._run_exitfuncs()
+            os._exit(1)
+        return
+
+    # start time of every worker, by pid
+    children = {}
+
+    def spawn():
+        children[_spawn(sock, host, threads, shutdown_timeout)] = time.monotonic()
+
+    for _ in range(workers):
+        spawn()
+    stopping = []
+    # times at which to replace the workers that exited, and failed starts in a row
+    restarts, failures = [], 0
+
+    def stop(signum, frame):
+        if not stopping:
+            stopping.append(time.monotonic() + shutdown_timeout)
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children or (restarts and not stopping):
+        if restarts and not stopping and time.monotonic() >= restarts[0]:
+            restarts.pop(0)
+            spawn()
+            continue
+        pid, status = os.waitpid(-1, os.WNOHANG) if children else (0, 0)
+        if pid == 0:
+            if stopping and time.monotonic() > stopping[0]:
+                logger.warning("killing %d workers still busy", len(children))
+                for child in children:
+                    os.kill(child, signal.SIGKILL)
+                stopping[0] = float("inf")
+            time.sleep(0.1)
+            continue
+
+        started = children.pop(pid)
+        if stopping:
+            continue
+        delay = 0
+        if time.monotonic() - started < WORKER_MIN_UPTIME:
+            failures += 1
+            if failures >= WORKER_MAX_FAILURES:
+                logger.error("%d workers in a row exited on start-up, stopping", failures)
+                stop(None, None)
+                continue
+            delay = WORKER_RESTART_DELAY * 2 ** (failures - 1)
+        else:
+            failures = 0
+        logger.warning("worker %d exited with status %d, starting another one in %gs", pid, status, delay)
+        restarts.append(time.monotonic() + delay)
+        restarts.sort()
+
+    sock.close()
+    if failures >= WORKER_MAX_FAILURES:
+        sys.exit("serve.py: workers keep exiting on start-up")
+
+
+def serve_asgi(host, port, workers, shutdown_timeout):
+    """Serve asgi.py with uvicorn until SIGTERM or SIGINT."""
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("serve.py: --asgi needs uvicorn (pip install uvicorn)")
+    uvicorn.run(
+        "asgi:application", host=host, port=port, workers=workers,
+        timeout_graceful_shutdown=int(shutdown_timeout), lifespan="on",
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=app.config['SERVE_WORKERS'] or os.cpu_count())
+    parser.add_argument("--threads", type=int, default=app.config['SERVE_THREADS'])
+    parser.add_argument("--shutdown-timeout", type=float, default=app.config['SERVE_SHUTDOWN_TIMEOUT'])
+    parser.add_argument("--asgi", action="store_true", help="serve asgi.py with uvicorn")
+    args = parser.parse_args(argv)
+
+    if args.workers > 1 and app.config['SESSION_BACKEND'] == "memory":
+        sys.exit("serve.py: in-memory sessions are not shared between workers, use SESSION_BACKEND = 'sqlite'")
+    if args.asgi and args.workers > 1 and app.config['USER_CACHE_BACKEND'] != "redis":
+        sys.exit("serve.py: uvicorn workers do not share the local user cache, use USER_CACHE_BACKEND = 'redis'")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    if args.asgi:
+        serve_asgi(args.host, args.port, args.workers, args.shutdown_timeout)
+    else:
+        serve(args.host, args.port, args.workers, args.threads, args.shutdown_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Server-side sessions.
+
+The session cookie only holds an opaque, random session id; the session
+content is kept on the server by a backend: MemoryBackend, an in-process LRU
+store, or SQLiteBackend, the sessions table of the application database,
+shared by every worker process.
+
+Sessions expire PERMANENT_SESSION_LIFETIME after they were last used. A
+request does not write its session back unless it changed it: using a
+session only records its new expiry, and only once it is more than
+SESSION_REFRESH_INTERVAL old. Those expiries are written to the backend in
+batches, at most every SESSION_TOUCH_INTERVAL seconds.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import database
+
+# Bytes of randomness in a session id (22 URL-safe characters).
+SESSION_ID_BYTES = 16
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session whose content lives on the server under sid."""
+
+    def __init__(self, initial=None, sid=None, expires=0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+        self.renew = False
+
+    def regenerate(self):
+        """Move the session to a new id when it is saved, e.g. after a login."""
+        self.renew = True
+        self.modified = True
+
+
+class MemoryBackend:
+    """Sessions of this process only, the least recently used evicted first."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid, now):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry[2] <= now:
+                return None
+            self._sessions.move_to_end(sid)
+            return entry[1], entry[2]
+
+    def save(self, sid, user, data, expires):
+        with self._lock:
+            self._sessions[sid] = (user, data, expires)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def touch(self, expiries):
+        with self._lock:
+            for sid, expires in expiries.items():
+                entry = self._sessions.get(sid)
+                if entry is not None and entry[2] < expires:
+                    self._sessions[sid] = (entry[0], entry[1], expires)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def forget_user(self, user):
+        with self._lock:
+            for sid in [sid for sid, entry in self._sessions.items() if entry[0] == user]:
+                del self._sessions[sid]
+
+    def purge(self, now):
+        with self._lock:
+            for sid in [sid for sid, entry in self._sessions.items() if entry[2] <= now]:
+                del self._sessions[sid]
+
+
+class SQLiteBackend:
+    """Sessions stored in the sessions table of the application database."""
+
+    def load(self, sid, now):
+        return database.read_session(sid, now)
+
+    def save(self, sid, user, data, expires):
+        database.write_session(sid, user, data, expires)
+
+    def touch(self, expiries):
+        database.touch_sessions([(expires, sid) for sid, expires in expiries.items()])
+
+    def delete(self, sid):
+        database.delete_sessions(session_id=sid)
+
+    def forget_user(self, user):
+        database.delete_sessions(user_id=user)
+
+    def purge(self, now):
+        database.delete_sessions(expired_before=now)
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface storing sessions in a backend."""
+
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSession
+
+    def __init__(self, backend, refresh_interval=60, touch_interval=5):
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self.touch_interval = touch_interval
+        self._touched = {}
+        self._last_touch = time.monotonic()
+        self._lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            stored = self.backend.load(sid, int(time.time()))
+            if stored is not None:
+                data, expires = stored
+                return self.session_class(self.serializer.loads(data), sid, expires)
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        now = int(time.time())
+
+        if not session:
+            if session.sid is not None:
+                self.backend.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            if session.sid is None or session.renew:
+                if session.sid is not None:
+                    self.backend.delete(session.sid)
+                session.sid = secrets.token_urlsafe(SESSION_ID_BYTES)
+            session.expires = now + lifetime
+            self.backend.save(
+                session.sid, session.get("current_user"), self.serializer.dumps(dict(session)), session.expires
+            )
+        elif session.expires - now < lifetime - self.refresh_interval:
+            session.expires = now + lifetime
+            self._touch(session.sid, session.expires)
+            if not session.permanent:
+                # the cookie of a browser session never changes
+                return
+        else:
+            return
+
+        response.set_cookie(
+            app.session_cookie_name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app),
+        )
+
+    def forget_user(self, user):
+        """Log user out of every session, e.g. once the account is deleted."""
+        self.backend.forget_user(user)
+
+    def _touch(self, sid, expires):
+        with self._lock:
+            self._touched[sid] = expires
+            if time.monotonic() - self._last_touch < self.touch_interval:
+                return
+            touched, self._touched = self._touched, {}
+            self._last_touch = time.monotonic()
+        self.backend.touch(touched)
+        self.backend.purge(int(time.time()))
+
+
+def from_config(config):
+    """Build the session interface described by the SESSION_* settings."""
+    if config['SESSION_BACKEND'] == "memory":
+        backend = MemoryBackend(config['SESSION_CACHE_SIZE'])
+    else:
+        backend = SQLiteBackend()
+    return ServerSessionInterface(backend, config['SESSION_REFRESH_INTERVAL'], config['SESSION_TOUCH_INTERVAL'])
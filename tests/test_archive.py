@@ -0,0 +1,117 @@
+"""
+Unit tests for the export and import of archives.
+"""
+
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+import archive
+import database
+import image_store
+from tests.test_fonctionnel import TemporaryDatabaseTestCase
+
+
+class TestArchive(TemporaryDatabaseTestCase):
+    """Test cases for archive.py against a temporary database and image pool."""
+
+    def setUp(self):
+        """Give ALICE three notes and three images, two of them with the same content."""
+        super().setUp()
+        self.pool = tempfile.mkdtemp(dir=self.tmp.name)
+        database.add_user("alice", "pw")
+        database.add_user("bob", "pw")
+        images = []
+        for i, content in enumerate((b"same", b"same", b"other")):
+            digest, size, tmp_path = image_store.receive(self.pool, io.BytesIO(content))
+            key = image_store.content_key(digest, "a.png")
+            images.append((
+                "a%d" % i, "ALICE", "a%d.png" % i, "2025-01-0%d" % (i + 1), digest, size,
+                lambda existing, tmp_path=tmp_path, key=key: image_store.place(self.pool, tmp_path, key, existing)
+            ))
+        database.create_items(
+            [database.new_note("alice", "note %d" % i, "2025-01-0%d" % (i + 1)) for i in range(3)], images
+        )
+        archive.PAGE_SIZE = 2
+        self.addCleanup(setattr, archive, "PAGE_SIZE", 1000)
+
+    def export(self, user):
+        return b"".join(archive.export_user(user, self.pool))
+
+    def test_layout(self):
+        """Test that pages of records are followed by the files they list, each file once."""
+        names = [member.name for member in tarfile.open(fileobj=io.BytesIO(self.export("ALICE")))]
+        self.assertEqual(names[:3], ["notes/000001.jsonl", "notes/000002.jsonl", "images/000001.jsonl"])
+        # newest first: the second page holds a0, whose content a1 already brought
+        self.assertTrue(names[3].startswith("files/") and names[4].startswith("files/"))
+        self.assertEqual(names[5:], ["images/000002.jsonl"])
+
+    def test_round_trip(self):
+        """Test that an import recreates the notes and images, sharing the stored files."""
+        files = len(os.listdir(self.pool))
+        result = archive.import_user("BOB", self.pool, io.BytesIO(self.export("ALICE")), batch_size=2)
+        self.assertEqual(result, (3, 3, 0))
+
+        notes, images = database.export_items("BOB")
+        self.assertEqual([(timestamp, note) for _, timestamp, note in notes],
+                         [("2025-01-0%d" % (i + 1), "note %d" % i) for i in range(3)])
+        self.assertEqual([(name, size) for _, _, name, size, _ in images], [("a0.png", 4), ("a1.png", 4), ("a2.png", 5)])
+        self.assertEqual(len(os.listdir(self.pool)), files)
+        with open(image_store.path_for(self.pool, database.image_file_from_db(images[2][0])[1]), "rb") as stored:
+            self.assertEqual(stored.read(), b"other")
+
+    def tar_of(self, *members):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w") as tar:
+            for name, content in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        data.seek(0)
+        return data
+
+    def test_missing_file(self):
+        """Test that images whose file is not in the archive, or is null, are left out and counted."""
+        data = self.tar_of(("images/000001.jsonl", b'{"id": "x", "timestamp": "t", "name": "x.png", '
+                             b'"size": 1, "sha256": "h", "file": "files/h"}\n'
+                             b'{"id": "y", "timestamp": "t", "name": "y.png", '
+                             b'"size": 1, "sha256": "h", "file": null}\n'))
+        self.assertEqual(archive.import_user("BOB", self.pool, data), (0, 0, 2))
+
+    def test_unsafe_name(self):
+        """Test that image names are made safe before they reach the storage key."""
+        data = self.tar_of(
+            ("images/000001.jsonl", b'{"id": "x", "timestamp": "t", "name": "a/../../b.png", '
+             b'"size": 4, "sha256": "h", "file": "files/h"}\n'),
+            ("files/h", b"evil"),
+        )
+        self.assertEqual(archive.import_user("BOB", self.pool, data), (0, 1, 0))
+        _, images = database.export_items("BOB")
+        self.assertEqual(images[0][2], "a_.._.._b.png")
+        path = image_store.path_for(self.pool, database.image_file_from_db(images[0][0])[1])
+        self.assertTrue(os.path.realpath(path).startswith(os.path.realpath(self.pool) + os.sep))
+
+    def test_disallowed_extension(self):
+        """Test that images without an allowed extension are left out, as uploads are refused."""
+        data = self.tar_of(
+            ("images/000001.jsonl", b'{"id": "x", "timestamp": "t", "name": "evil.html", '
+             b'"size": 25, "sha256": "h", "file": "files/h"}\n'),
+            ("files/h", b"<script>alert(1)</script>"),
+        )
+        files = len(os.listdir(self.pool))
+        self.assertEqual(archive.import_user("BOB", self.pool, data), (0, 0, 1))
+        self.assertEqual(database.export_items("BOB"), ([], []))
+        self.assertEqual(len(os.listdir(self.pool)), files)
+
+    def test_fields_must_be_strings(self):
+        """Test that a record field of another type is refused with ValueError."""
+        for member in (("notes/000001.jsonl", b'{"timestamp": "t", "note": {"a": 1}}\n'),
+                       ("images/000001.jsonl", b'{"timestamp": 1, "name": "x.png", "file": null}\n')):
+            with self.assertRaises(ValueError):
+                archive.import_user("BOB", self.pool, self.tar_of(member))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Unit tests for the ASGI adapter.
+"""
+
+import asyncio
+import time
+import unittest
+
+import asgi
+
+
+def _echo_app(environ, start_response):
+    """WSGI application answering with the length and head of the request body."""
+    body = environ["wsgi.input"].read()
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"%d:" % len(body), body[:8]]
+
+
+async def _request(application, method, path, chunks=(), headers=(), delay=0):
+    """Send a request through an ASGI application; returns (status, headers, body, finished at)."""
+    pending = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    pending.append({"type": "http.request", "body": b"", "more_body": False})
+    sent = []
+
+    async def receive():
+        if delay:
+            await asyncio.sleep(delay)
+        return pending.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "query_string": b"", "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers],
+        "server": ("testserver", 80), "client": ("127.0.0.1", 1234),
+    }
+    await application(scope, receive, send)
+    start = sent[0]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return start["status"], dict(start["headers"]), body, time.monotonic()
+
+
+class TestASGIAdapter(unittest.TestCase):
+    """Test cases for the adapter around small WSGI applications."""
+
+    def test_slow_uploads_do_not_hold_threads(self):
+        """Test that one thread serves other requests while many slow uploads are received."""
+        application = asgi.ASGIAdapter(_echo_app, threads=1)
+
+        async def scenario():
+            uploads = [
+                _request(application, "POST", "/", [b"x" * 1000] * 5, delay=0.05)
+                for _ in range(20)
+            ]
+            quick = _request(application, "GET", "/")
+            return await asyncio.gather(quick, *uploads)
+
+        quick, *uploads = asyncio.run(scenario())
+        self.assertEqual(quick[2], b"0:")
+        self.assertTrue(all(upload[2] == b"5000:xxxxxxxx" for upload in uploads))
+        self.assertLess(quick[3], min(upload[3] for upload in uploads))
+
+    def test_large_body_is_spooled(self):
+        """Test that bodies larger than the spool size reach the application intact."""
+        application = asgi.ASGIAdapter(_echo_app, threads=2, spool_size=10)
+        status, _, body, _ = asyncio.run(_request(application, "POST", "/", [b"abcd"] * 10))
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"40:abcdabcd")
+
+
+class TestApplication(unittest.TestCase):
+    """Test cases for the application served through asgi.application."""
+
+    def test_get_page(self):
+        """Test that pages are served with their headers."""
+        status, headers, body, _ = asyncio.run(_request(asgi.application, "GET", "/public/"))
+        self.assertEqual(status, 200)
+        self.assertIn(b"etag", headers)
+        self.assertIn(b"<html", body.lower())
+
+    def test_413_without_content_length(self):
+        """Test that a body growing past MAX_CONTENT_LENGTH is refused without being read further."""
+        limit = asgi.application.max_content_length
+        chunks = [b"x" * (1024 * 1024)] * (limit // (1024 * 1024) + 2)
+        status, _, _, _ = asyncio.run(_request(
+            asgi.application, "POST", "/upload_image", chunks,
+            headers=[("Content-Type", "multipart/form-data; boundary=xyz")],
+        ))
+        self.assertEqual(status, 413)
+
+    def test_413_declared_length(self):
+        """Test that a declared oversized body is refused before being received."""
+        status, _, _, _ = asyncio.run(_request(
+            asgi.application, "POST", "/upload_image",
+            headers=[("Content-Length", str(asgi.application.max_content_length + 1)),
+                     ("Content-Type", "multipart/form-data; boundary=xyz")],
+        ))
+        self.assertEqual(status, 413)
+
+
+if __name__ == "__main__":
+    unittest.main()
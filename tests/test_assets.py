@@ -0,0 +1,107 @@
+"""
+Unit tests for the static asset build step and the /assets/ route.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+import assets
+from app import app, page_cache
+
+
+class TestPurgeCss(unittest.TestCase):
+    """Test cases for the removal of unused CSS."""
+
+    def test_drops_unused_selectors(self):
+        """Test that selectors using unknown classes are dropped, rules without selectors too."""
+        css = "/*! license */a{color:red}.used,.unused{margin:0}.unused .used{padding:0}"
+        self.assertEqual(
+            assets.purge_css(css, {"used"}),
+            "/*! license */\na{color:red}.used{margin:0}"
+        )
+
+    def test_media_queries_and_statements(self):
+        """Test that @media blocks are purged recursively and statements kept."""
+        css = '@import url("x.css");@media (min-width:1px){.a{x:1}.b{x:2}}@media print{.b{x:3}}'
+        self.assertEqual(
+            assets.purge_css(css, {"a"}),
+            '@import url("x.css");@media (min-width:1px){.a{x:1}}'
+        )
+
+
+class TestBuild(unittest.TestCase):
+    """Test cases for building and serving fingerprinted assets."""
+
+    def setUp(self):
+        """Build the real assets into a temporary folder."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manifest = assets.build("static", "templates", self.tmp.name)
+        self.previous_folder = app.config['ASSETS_FOLDER']
+        app.config['ASSETS_FOLDER'] = self.tmp.name
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Remove the build."""
+        app.config['ASSETS_FOLDER'] = self.previous_folder
+        self.tmp.cleanup()
+
+    def test_manifest(self):
+        """Test that every asset is fingerprinted and precompressed."""
+        self.assertEqual(set(self.manifest), set(assets.ASSETS))
+        for fingerprinted in self.manifest.values():
+            path = os.path.join(self.tmp.name, fingerprinted)
+            with open(path, "rb") as original, gzip.open(path + ".gz") as compressed:
+                self.assertEqual(original.read(), compressed.read())
+
+    def test_serves_precompressed(self):
+        """Test that the gzip copy is served when accepted, with immutable caching."""
+        url = "/assets/" + self.manifest["js/jquery.min.js"]
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_encoding, "gzip")
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        response.close()
+
+        response = self.client.get(url)
+        self.assertIsNone(response.content_encoding)
+        response.close()
+        self.assertEqual(self.client.get("/assets/../config.py").status_code, 404)
+
+    def test_manifest_is_revalidated(self):
+        """Test that manifest.json is not cached as immutable and changes with the build."""
+        response = self.client.get("/assets/manifest.json")
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        etag = response.headers["ETag"]
+        response.close()
+
+        path = os.path.join(self.tmp.name, assets.MANIFEST)
+        with open(path, "w") as manifest:
+            json.dump({"js/jquery.min.js": "js/jquery.min.0123456789ab.js"}, manifest)
+        os.utime(path, ns=(0, 0))
+        response = self.client.get("/assets/manifest.json", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_rebuild_is_picked_up(self):
+        """Test that the manifest is read again once a new build replaces it."""
+        self.assertEqual(assets.load_manifest(self.tmp.name), self.manifest)
+        path = os.path.join(self.tmp.name, assets.MANIFEST)
+        rebuilt = dict(self.manifest, **{"js/jquery.min.js": "js/jquery.min.0123456789ab.js"})
+        with open(path, "w") as manifest:
+            json.dump(rebuilt, manifest)
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(assets.load_manifest(self.tmp.name), rebuilt)
+
+    def test_layout_links_fingerprinted_assets(self):
+        """Test that pages link to the fingerprinted names."""
+        page_cache.clear()
+        page = self.client.get("/public/").get_data(as_text=True)
+        self.assertIn("/assets/" + self.manifest["css/bootstrap.min.united.css"], page)
+
+
+if __name__ == "__main__":
+    unittest.main()
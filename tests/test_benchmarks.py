@@ -0,0 +1,37 @@
+"""
+Smoke test of the benchmark suite, so that it keeps running as the code changes.
+"""
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from benchmarks import suite
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    """Test cases for benchmarks.suite on a tiny database."""
+
+    def test_suite(self):
+        """Test that every benchmark runs without HTTP errors and that a run compares with itself."""
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "results.json")
+            arguments = ["--users", "3", "--notes", "5", "--images", "1", "--repeat", "2", "--output", output]
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(suite.main(arguments), 0)
+                with open(output) as results:
+                    document = json.load(results)
+                self.assertEqual(suite.main(arguments + ["--compare", output, "--threshold", "1000"]), 0)
+
+        self.assertEqual(document["not_benchmarked"], [])
+        self.assertIn("database.search_notes", document["results"])
+        self.assertIn("route POST /upload_image", document["results"])
+        self.assertEqual({name: 0 for name in document["results"]},
+                         {name: stats["errors"] for name, stats in document["results"].items()})
+
+
+if __name__ == "__main__":
+    unittest.main()
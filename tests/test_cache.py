@@ -0,0 +1,99 @@
+"""
+Unit tests for the per-user read-through cache.
+"""
+
+import os
+import unittest
+from unittest.mock import patch
+
+import cache
+
+
+class TestLocalBackend(unittest.TestCase):
+    """Test cases for the in-process LRU backend."""
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first."""
+        backend = cache.LocalBackend(max_entries=2)
+        backend.set("a", 1, 60)
+        backend.set("b", 2, 60)
+        backend.get("a")
+        backend.set("c", 3, 60)
+        self.assertEqual(backend.get("a"), 1)
+        self.assertIs(backend.get("b"), cache.MISSING)
+
+    @patch('cache.time.monotonic')
+    def test_ttl(self, mock_monotonic):
+        """Test that entries expire after their TTL."""
+        backend = cache.LocalBackend()
+        mock_monotonic.return_value = 100
+        backend.set("a", 1, 10)
+        mock_monotonic.return_value = 109
+        self.assertEqual(backend.get("a"), 1)
+        mock_monotonic.return_value = 111
+        self.assertIs(backend.get("a"), cache.MISSING)
+
+
+class TestUserCache(unittest.TestCase):
+    """Test cases for the read-through cache."""
+
+    def setUp(self):
+        """Create a cache with a local backend."""
+        self.cache = cache.UserCache(cache.LocalBackend(), ttl=60)
+        self.loads = 0
+
+    def _load(self):
+        self.loads += 1
+        return self.loads
+
+    def test_read_through(self):
+        """Test that the loader only runs on a miss and the counters follow."""
+        self.assertEqual(self.cache.get_or_load("ALICE", "notes", self._load), 1)
+        self.assertEqual(self.cache.get_or_load("ALICE", "notes", self._load), 1)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_invalidate_is_per_user(self):
+        """Test that invalidating a user only drops that user's entries."""
+        self.cache.get_or_load("ALICE", "notes", self._load)
+        self.cache.get_or_load("BOB", "notes", self._load)
+        self.cache.invalidate("ALICE")
+        self.assertEqual(self.cache.get_or_load("ALICE", "notes", self._load), 3)
+        self.assertEqual(self.cache.get_or_load("BOB", "notes", self._load), 2)
+
+    def test_generations_are_bounded(self):
+        """Test that generations of users with nothing cached are forgotten, without serving stale entries."""
+        backend = cache.LocalBackend(max_entries=2)
+        bounded = cache.UserCache(backend, ttl=60)
+        bounded.get_or_load("ALICE", "notes", self._load)
+        bounded.invalidate("BOB")
+        # a load started before BOB's next write is stored after it
+        stale_key = "BOB:%d:notes" % backend.generation("BOB")
+        bounded.invalidate("BOB")
+        backend.set(stale_key, "stale", 60, "BOB")
+
+        for i in range(100):
+            bounded.invalidate("USER%d" % i)
+        self.assertLessEqual(len(backend._generations), 4)
+        self.assertEqual(bounded.get_or_load("ALICE", "notes", self._load), 1)
+        self.assertEqual(bounded.get_or_load("BOB", "notes", self._load), 2)
+        for _ in range(3):
+            bounded.invalidate("BOB")
+            self.assertNotEqual(bounded.get_or_load("BOB", "notes", self._load), "stale")
+
+    def test_shared_generations_across_fork(self):
+        """Test that an invalidation made by a forked worker reaches the parent."""
+        backend = cache.LocalBackend()
+        backend.share_generations()
+        shared = cache.UserCache(backend, ttl=60)
+        shared.get_or_load("ALICE", "notes", self._load)
+
+        pid = os.fork()
+        if pid == 0:
+            shared.invalidate("ALICE")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(shared.get_or_load("ALICE", "notes", self._load), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,9 @@ Unit tests for the Database functions using unittest and unittest.mock.
 """
 
 import hashlib
+import os
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
 import database
@@ -10,6 +13,46 @@ import database
 class TestDatabaseFunctions(unittest.TestCase):
     """Test cases for Database functions."""
 
+    def setUp(self):
+        """Start each test without any pooled connection."""
+        database.close_connections()
+
+    def tearDown(self):
+        """Do not leak mocked connections into the following tests."""
+        database.close_connections()
+
+    @patch('database.sqlite3.connect')
+    def test_connection_is_reused(self, mock_connect):
+        """Test that a thread reuses its connection across calls."""
+        mock_connect.return_value = MagicMock()
+
+        database.list_users()
+        database.list_users()
+        self.assertEqual(mock_connect.call_count, 1)
+
+    @patch('database.sqlite3.connect')
+    def test_connection_per_thread(self, mock_connect):
+        """Test that every thread gets its own connection."""
+        mock_connect.side_effect = lambda *args, **kwargs: MagicMock()
+
+        database.list_users()
+        worker = threading.Thread(target=database.list_users)
+        worker.start()
+        worker.join()
+        self.assertEqual(mock_connect.call_count, 2)
+
+    @patch('database.sqlite3.connect')
+    def test_close_connections(self, mock_connect):
+        """Test that closing the pool closes the connection and reopens on demand."""
+        mock_conn = MagicMock()
+        mock_connect.return_value = mock_conn
+
+        database.list_users()
+        database.close_connections()
+        self.assertTrue(mock_conn.close.called)
+        database.list_users()
+        self.assertEqual(mock_connect.call_count, 2)
+
     @patch('database.sqlite3.connect')
     def test_list_users(self, mock_connect):
         """Test listing users from the database."""
@@ -22,6 +65,21 @@ class TestDatabaseFunctions(unittest.TestCase):
         result = database.list_users()
         self.assertEqual(result, [1, 2])
 
+    @patch('database.sqlite3.connect')
+    def test_user_exists(self, mock_connect):
+        """Test checking a user with a keyed lookup."""
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value = mock_cursor
+
+        mock_cursor.fetchone.return_value = (1,)
+        self.assertTrue(database.user_exists("user_id"))
+        mock_cursor.execute.assert_called_with("SELECT 1 FROM users WHERE id = ?;", ("user_id",))
+
+        mock_cursor.fetchone.return_value = None
+        self.assertFalse(database.user_exists("user_id"))
+
     @patch('database.sqlite3.connect')
     def test_verify(self, mock_connect):
         """Test verifying user credentials."""
@@ -132,6 +190,347 @@ class TestDatabaseFunctions(unittest.TestCase):
         database.delete_image_from_db("image_uid")
         self.assertTrue(mock_cursor.execute.called)
 
+class TemporaryDatabaseTestCase(unittest.TestCase):
+    """Base class for tests running against a fresh temporary database file."""
+
+    def setUp(self):
+        """Point the database module at a fresh temporary database."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.previous_location = database.DB_FILE_LOCATION
+        database.close_connections()
+        database.DB_FILE_LOCATION = os.path.join(self.tmp.name, "app.db")
+
+    def tearDown(self):
+        """Restore the database location."""
+        database.close_connections()
+        database.DB_FILE_LOCATION = self.previous_location
+        self.tmp.cleanup()
+
+
+class TestPasswordUpgrade(TemporaryDatabaseTestCase):
+    """Test cases for re-hashing legacy passwords on login."""
+
+    def test_legacy_password_is_upgraded(self):
+        """Test that a verified SHA-256 password is replaced by a salted hash."""
+        _conn = database._connect(database.DB_FILE_LOCATION)
+        _conn.execute("INSERT INTO users (id, pw) VALUES ('OLD', ?);", (hashlib.sha256(b"pw").hexdigest(),))
+        _conn.commit()
+
+        self.assertFalse(database.verify("OLD", "wrong"))
+        self.assertTrue(database.verify("OLD", "pw"))
+        stored = _conn.execute("SELECT pw FROM users WHERE id = 'OLD';").fetchone()[0]
+        self.assertTrue(stored.startswith("scrypt$"))
+        self.assertTrue(database.verify("OLD", "pw"))
+        self.assertFalse(database.verify("MISSING", "pw"))
+
+
+class TestDatabasePagination(TemporaryDatabaseTestCase):
+    """Test cases for keyset pagination against a real database file."""
+
+    def setUp(self):
+        """Create a user holding ten notes."""
+        super().setUp()
+        database.add_user("reader", "pw")
+        _conn = database._connect(database.DB_FILE_LOCATION)
+        # two notes share a timestamp so that the note_id tie-breaker is exercised
+        _conn.executemany(
+            "INSERT INTO notes (note_id, user, timestamp, note) VALUES (?, 'READER', ?, ?);",
+            [(i, "2025-01-01 00:00:%02d" % min(i, 8), "note %d" % i) for i in range(10)]
+        )
+        _conn.commit()
+
+    def test_pages_cover_every_note_once(self):
+        """Test that following the keyset cursor visits every note exactly once, newest first."""
+        seen, before = [], None
+        while True:
+            rows, before = database.read_notes_page("reader", 3, before)
+            seen.extend(row[0] for row in rows)
+            if before is None:
+                break
+        self.assertEqual(seen, list(reversed(range(10))))
+
+    def test_last_page_has_no_cursor(self):
+        """Test that a page holding the remaining rows does not return a cursor."""
+        rows, before = database.read_notes_page("reader", 10)
+        self.assertEqual(len(rows), 10)
+        self.assertIsNone(before)
+
+    def test_images_page(self):
+        """Test paginating images."""
+        database.image_upload_record("a", "READER", "a.png", "2025-01-01")
+        database.image_upload_record("b", "READER", "b.png", "2025-01-02")
+        rows, before = database.list_images_page("READER", 1)
+        self.assertEqual(rows, [("b", "2025-01-02", "b.png")])
+        rows, before = database.list_images_page("READER", 1, before)
+        self.assertEqual(rows, [("a", "2025-01-01", "a.png")])
+        self.assertIsNone(before)
+
+
+class TestNoteIds(TemporaryDatabaseTestCase):
+    """Test cases for the integer ids of notes."""
+
+    def test_ids_are_unique_across_threads(self):
+        """Test that threads reserving blocks of ids never hand out the same id."""
+        database.add_user("writer", "pw")
+        ids = []
+
+        def build():
+            rows = [database.new_note("writer", "note") for _ in range(database.NOTE_ID_BLOCK + 1)]
+            database.write_notes_into_db(rows)
+            ids.extend(row[3] for row in rows)
+            database.close_connections()
+
+        threads = [threading.Thread(target=build) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(database.match_user_id_with_note_id(ids[0]), "WRITER")
+
+    def test_migration_numbers_existing_notes(self):
+        """Test that notes keyed by a SHA-256 get their rowid as id and stay searchable."""
+        _conn = database.sqlite3.connect(database.DB_FILE_LOCATION)
+        for number, script in enumerate(database.SCHEMA_MIGRATIONS[:7], start=1):
+            _conn.executescript("%s\nPRAGMA user_version = %d;" % (script, number))
+        _conn.execute("INSERT INTO users (id, pw) VALUES ('OLD', 'x');")
+        _conn.executemany(
+            "INSERT INTO notes (note_id, user, timestamp, note) VALUES (?, 'OLD', ?, ?);",
+            [("f" * 64, "2025-01-02", "newer"), ("0" * 64, "2025-01-03", "newest"), ("a" * 64, "2025-01-01", "older")]
+        )
+        _conn.commit()
+        _conn.close()
+
+        self.assertEqual(
+            sorted(database.read_note_from_db("old")),
+            [(1, "2025-01-02", "newer"), (2, "2025-01-03", "newest"), (3, "2025-01-01", "older")]
+        )
+        self.assertEqual(database.search_notes("old", ["newest"], 10)[0][0][0], 2)
+        self.assertEqual(database.new_note("old", "note")[3], 4)
+
+    @patch('database.sqlite3.sqlite_version_info', (3, 34, 1))
+    def test_old_sqlite_is_refused(self):
+        """Test that an SQLite library without UPDATE ... RETURNING is refused with a clear error."""
+        with self.assertRaisesRegex(RuntimeError, "3.35.0 or later"):
+            database.add_user("writer", "pw")
+
+
+class TestUserListing(TemporaryDatabaseTestCase):
+    """Test cases for the paginated list of users and their maintained counts."""
+
+    def setUp(self):
+        """Create five users; ALICE holds two notes and an image."""
+        super().setUp()
+        for user in ("alice", "albert", "alex", "bob", "carol"):
+            database.add_user(user, "pw")
+        database.create_items([database.new_note("alice", "héllo"), database.new_note("alice", "bye")])
+        database.image_upload_record("a", "ALICE", "a.png", "2025-01-01", size=100)
+
+    def test_pages_cover_every_user_once(self):
+        """Test that following the cursor visits every user once, in id order."""
+        seen, after = [], None
+        while True:
+            rows, after = database.list_users_page(2, after)
+            seen.extend(row[0] for row in rows)
+            if after is None:
+                break
+        self.assertEqual(seen, ["ALBERT", "ALEX", "ALICE", "BOB", "CAROL"])
+
+    def test_prefix(self):
+        """Test that only the ids starting with the prefix are listed, page by page."""
+        rows, after = database.list_users_page(2, prefix="AL")
+        self.assertEqual([row[0] for row in rows], ["ALBERT", "ALEX"])
+        rows, after = database.list_users_page(2, after, "AL")
+        self.assertEqual(([row[0] for row in rows], after), (["ALICE"], None))
+        self.assertEqual(database.list_users_page(2, prefix="Z"), ([], None))
+
+    def test_counts_follow_changes(self):
+        """Test that the counts and bytes follow new and deleted notes and images."""
+        rows = dict((row[0], row[1:]) for row in database.list_users_page(10)[0])
+        self.assertEqual(rows["ALICE"], (2, 1, len("héllo".encode()) + len("bye") + 100))
+        self.assertEqual(rows["BOB"], (0, 0, 0))
+
+        database.delete_image_from_db("a")
+        note_id = database.read_notes_page("alice", 1)[0][0][0]
+        database.delete_note_from_db(note_id)
+        rows = dict((row[0], row[1:]) for row in database.list_users_page(10)[0])
+        self.assertEqual(rows["ALICE"][:2], (1, 0))
+
+    def test_users_being_deleted_are_left_out(self):
+        """Test that tombstoned users are not listed."""
+        database.request_user_deletion("BOB")
+        self.assertNotIn("BOB", [row[0] for row in database.list_users_page(10)[0]])
+
+    def test_migration_counts_existing_items(self):
+        """Test that the counts of existing users are computed when the table is created."""
+        database.close_connections()
+        _conn = database.sqlite3.connect(database.DB_FILE_LOCATION)
+        for (trigger,) in _conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'user_stats_%';").fetchall():
+            _conn.execute("DROP TRIGGER %s;" % trigger)
+        _conn.executescript("DROP TABLE user_stats; PRAGMA user_version = 8;")
+        _conn.close()
+        rows = dict((row[0], row[1:]) for row in database.list_users_page(10)[0])
+        self.assertEqual(rows["ALICE"], (2, 1, len("héllo".encode()) + len("bye") + 100))
+
+
+class TestImageReferences(TemporaryDatabaseTestCase):
+    """Test cases for image files shared by several uploads of the same content."""
+
+    def setUp(self):
+        """Create two users."""
+        super().setUp()
+        database.add_user("alice", "pw")
+        database.add_user("bob", "pw")
+        self.removed = []
+
+    def _upload(self, uid, owner):
+        placed = []
+        database.image_upload_record(
+            uid, owner, "a.png", uid, "hash", 4,
+            lambda existing: placed.append(existing) or existing or "ha/sh/hash.png"
+        )
+        return placed[0]
+
+    def test_duplicate_upload_reuses_file(self):
+        """Test that the second upload of the same content is given the stored path."""
+        self.assertIsNone(self._upload("u1", "ALICE"))
+        self.assertEqual(self._upload("u2", "ALICE"), "ha/sh/hash.png")
+
+    def test_file_removed_with_last_reference(self):
+        """Test that a shared file is only removed with its last image."""
+        self._upload("u1", "ALICE")
+        self._upload("u2", "BOB")
+        database.delete_image_from_db("u1", self.removed.append)
+        self.assertEqual(self.removed, [])
+        database.delete_image_from_db("u2", self.removed.append)
+        self.assertEqual(self.removed, ["ha/sh/hash.png"])
+
+    def test_delete_user_keeps_shared_files(self):
+        """Test that deleting a user keeps the files other users still reference."""
+        self._upload("u1", "ALICE")
+        self._upload("u2", "BOB")
+        database.delete_user_from_db("ALICE", self.removed.append)
+        self.assertEqual(self.removed, [])
+        database.delete_user_from_db("BOB", self.removed.append)
+        self.assertEqual(self.removed, ["ha/sh/hash.png"])
+
+
+class TestSearchNotes(TemporaryDatabaseTestCase):
+    """Test cases for the full-text search of notes."""
+
+    def setUp(self):
+        """Create two users with a few notes each."""
+        super().setUp()
+        database.add_user("alice", "pw")
+        database.add_user("bob", "pw")
+        for note in ("Le café de la gare", "Acheter du café et du pain", "Réunion lundi", "café café café"):
+            database.write_note_into_db("alice", note)
+        database.write_note_into_db("bob", "café de Bob")
+
+    def _notes(self, terms, limit=10, offset=0):
+        rows, more = database.search_notes("alice", terms, limit, offset)
+        return [row[2] for row in rows], more
+
+    def test_ranked_and_scoped_to_user(self):
+        """Test that the best match comes first and other users' notes are left out."""
+        notes, more = self._notes(["cafe"])
+        self.assertEqual(notes[0], "café café café")
+        self.assertEqual(len(notes), 3)
+        self.assertFalse(more)
+
+    def test_every_term_and_prefixes(self):
+        """Test that every term must match, each also as a word prefix."""
+        self.assertEqual(self._notes(["caf", "pain"])[0], ["Acheter du café et du pain"])
+        self.assertEqual(self._notes(["reunion"])[0], ["Réunion lundi"])
+
+    def test_query_syntax_is_escaped(self):
+        """Test that FTS query operators typed by users are searched as words."""
+        self.assertEqual(self._notes(['"NOT', "OR*"])[0], [])
+
+    def test_pagination(self):
+        """Test that pages follow each other without overlap."""
+        first, more = self._notes(["cafe"], limit=2)
+        self.assertTrue(more)
+        second, more = self._notes(["cafe"], limit=2, offset=2)
+        self.assertFalse(more)
+        self.assertEqual(len(set(first + second)), 3)
+
+    def test_snippet_marks_matches(self):
+        """Test that snippets mark the matching words."""
+        rows, _ = database.search_notes("alice", ["gare"], 10)
+        self.assertIn(database.SNIPPET_START + "gare" + database.SNIPPET_END, rows[0][3])
+
+    def test_index_follows_deletes(self):
+        """Test that deleted notes, including those of deleted users, leave the index."""
+        note_id = database.search_notes("alice", ["gare"], 10)[0][0][0]
+        database.delete_note_from_db(note_id)
+        self.assertEqual(self._notes(["gare"])[0], [])
+        database.delete_user_from_db("BOB")
+        _conn = database._connect(database.DB_FILE_LOCATION)
+        self.assertEqual(_conn.execute("SELECT COUNT(*) FROM notes_fts WHERE notes_fts MATCH 'bob';").fetchone()[0], 0)
+
+
+class TestBulkItems(TemporaryDatabaseTestCase):
+    """Test cases for creating and deleting many notes and images at once."""
+
+    def setUp(self):
+        """Create two users; ALICE gets two notes and two images, one of them shared with BOB."""
+        super().setUp()
+        database.add_user("alice", "pw")
+        database.add_user("bob", "pw")
+        self.notes = [database.new_note("alice", "note %d" % i) for i in range(2)]
+        place = lambda key: lambda existing: existing or key
+        database.create_items(self.notes, [
+            ("a1", "ALICE", "a.png", "t1", "ha", 1, place("ha.png")),
+            ("a2", "ALICE", "b.png", "t2", "hb", 1, place("hb.png")),
+            ("b1", "BOB", "b.png", "t3", "hb", 1, place("hb-copy.png")),
+        ])
+        self.note_ids = [row[3] for row in self.notes]
+        self.removed = []
+
+    def test_create_shares_identical_files(self):
+        """Test that one batch stores identical content once."""
+        notes, images = database.export_items("BOB")
+        self.assertEqual(images, [("b1", "t3", "b.png", 1, "hb")])
+        self.assertEqual(database.image_file_from_db("b1")[1], "hb.png")
+        self.assertEqual(len(database.export_items("ALICE")[0]), 2)
+
+    def test_owned_items(self):
+        """Test the set-based ownership check."""
+        self.assertEqual(
+            database.owned_items("ALICE", self.note_ids + ["other"], ["a1", "b1"]),
+            (set(self.note_ids), {"a1"})
+        )
+
+    def test_delete_items(self):
+        """Test that notes and images go in one call and only unreferenced files are removed."""
+        self.assertEqual(database.delete_items("ALICE", self.note_ids, ["a1", "a2"], self.removed.extend), (2, 2))
+        self.assertEqual(self.removed, ["ha.png"])
+        self.assertEqual(database.export_items("ALICE"), ([], []))
+
+    def test_delete_items_of_another_user(self):
+        """Test that nothing is deleted when one id belongs to someone else."""
+        self.assertIsNone(database.delete_items("ALICE", self.note_ids, ["a1", "b1"], self.removed.extend))
+        self.assertEqual(self.removed, [])
+        self.assertEqual(len(database.export_items("ALICE")[1]), 2)
+
+    def test_rollback_removes_placed_files(self):
+        """Test that the files placed by a transaction that rolls back are removed, shared ones kept."""
+        place = lambda key: lambda existing: existing or key
+        with self.assertRaises(database.sqlite3.IntegrityError):
+            database.create_items((), [
+                ("c1", "ALICE", "c.png", "t4", "hc", 1, place("hc.png")),
+                ("c2", "ALICE", "b.png", "t5", "hb", 1, place("hb-again.png")),
+                ("a1", "ALICE", "dup.png", "t6", "hd", 1, place("hd.png")),
+            ], self.removed.extend)
+        self.assertEqual(self.removed, ["hc.png", "hd.png"])
+        self.assertEqual(len(database.export_items("ALICE")[1]), 2)
+
+        with self.assertRaises(database.sqlite3.IntegrityError):
+            database.image_upload_record("a1", "ALICE", "e.png", "t7", "he", 1, place("he.png"), self.removed.append)
+        self.assertEqual(self.removed, ["hc.png", "hd.png", "he.png"])
+
+
 if __name__ == "__main__":
     unittest.main()
     
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+Unit tests for the sharded image store.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+
+import image_store
+
+
+class TestImageStore(unittest.TestCase):
+    """Test cases for image_store functions."""
+
+    def setUp(self):
+        """Create an empty pool."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        """Remove the pool."""
+        self.tmp.cleanup()
+
+    def test_image_key(self):
+        """Test that keys are sharded on the leading characters of the uid."""
+        self.assertEqual(image_store.image_key("abcdef", "a.png"), "ab/cd/abcdef-a.png")
+
+    def test_content_key(self):
+        """Test that content keys are sharded on the hash and keep the extension."""
+        self.assertEqual(image_store.content_key("abcdef", "A.PNG"), "ab/cd/abcdef.png")
+
+    def test_receive_hashes_while_copying(self):
+        """Test that receive() copies the stream in chunks and hashes it."""
+        data = b"x" * (image_store.CHUNK_SIZE * 2 + 10)
+        digest, size, tmp_path = image_store.receive(self.root, io.BytesIO(data))
+        self.assertEqual(digest, hashlib.sha256(data).hexdigest())
+        self.assertEqual(size, len(data))
+        with open(tmp_path, "rb") as received:
+            self.assertEqual(received.read(), data)
+
+    def test_receive_upload_without_copy(self):
+        """Test that an Upload written by the form parser is hashed as written and received as is."""
+        upload = image_store.Upload(self.root)
+        upload.write(b"part one, ")
+        upload.write(b"part two")
+        upload.seek(0)
+        self.assertEqual(upload.read(), b"part one, part two")
+        digest, size, tmp_path = image_store.receive(self.root, upload)
+        self.assertEqual((digest, size), (hashlib.sha256(b"part one, part two").hexdigest(), 18))
+        self.assertEqual(tmp_path, upload.path)
+        upload.close()
+        self.assertTrue(os.path.exists(tmp_path))
+
+    def test_upload_not_received_is_removed(self):
+        """Test that closing an Upload no route received removes its file."""
+        upload = image_store.Upload(self.root)
+        upload.write(b"data")
+        upload.close()
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_place_and_remove(self):
+        """Test placing an upload under its key and removing it again."""
+        digest, _, tmp_path = image_store.receive(self.root, io.BytesIO(b"data"))
+        key = image_store.content_key(digest, "a.png")
+        self.assertEqual(image_store.place(self.root, tmp_path, key), key)
+        path = image_store.path_for(self.root, key)
+        with open(path, "rb") as stored:
+            self.assertEqual(stored.read(), b"data")
+
+        image_store.remove(self.root, key)
+        self.assertFalse(os.path.exists(path))
+        image_store.remove(self.root, key)
+
+    def test_place_duplicate(self):
+        """Test that a duplicate upload is dropped in favour of the stored file."""
+        _, _, tmp_path = image_store.receive(self.root, io.BytesIO(b"data"))
+        self.assertEqual(image_store.place(self.root, tmp_path, "new", "ab/cd/old.png"), "ab/cd/old.png")
+        self.assertFalse(os.path.exists(tmp_path))
+        self.assertFalse(os.path.exists(image_store.path_for(self.root, "new")))
+
+    def test_shard_pool(self):
+        """Test moving a flat pool, skipping missing files and resuming."""
+        with open(os.path.join(self.root, "abcdef-a.png"), "wb") as legacy:
+            legacy.write(b"data")
+
+        rows = [("abcdef", "a.png"), ("123456", "gone.png")]
+        expected = [("abcdef", "ab/cd/abcdef-a.png")]
+        self.assertEqual(image_store.shard_pool(self.root, rows), expected)
+        self.assertTrue(os.path.exists(os.path.join(self.root, "ab", "cd", "abcdef-a.png")))
+        self.assertEqual(image_store.shard_pool(self.root, rows), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Unit tests for the instrumentation and the /metrics endpoint.
+"""
+
+import unittest
+
+import metrics
+from app import app
+
+
+class TestMetrics(unittest.TestCase):
+    """Test cases for the metric types and their text format."""
+
+    def setUp(self):
+        """Enable the metrics for the test only."""
+        metrics.configure(True)
+        self.addCleanup(metrics.configure, app.config['METRICS_ENABLED'])
+        self.histogram = metrics.Histogram("test_seconds", "Test histogram.", ("kind",), buckets=(0.1, 1.0))
+        self.addCleanup(metrics._registry.remove, self.histogram)
+
+    def test_histogram_format(self):
+        """Test that buckets are cumulative and followed by the count and the sum."""
+        for value in (0.05, 0.5, 0.5, 5):
+            self.histogram.observe(value, "a")
+        text = metrics.render()
+        self.assertIn("# TYPE test_seconds histogram", text)
+        self.assertIn('test_seconds_bucket{kind="a",le="0.1"} 1\n', text)
+        self.assertIn('test_seconds_bucket{kind="a",le="1.0"} 3\n', text)
+        self.assertIn('test_seconds_bucket{kind="a",le="+Inf"} 4\n', text)
+        self.assertIn('test_seconds_count{kind="a"} 4\n', text)
+        self.assertIn('test_seconds_sum{kind="a"} 6.05\n', text)
+
+    def test_disabled(self):
+        """Test that nothing is recorded while the metrics are disabled."""
+        metrics.configure(False)
+        metrics.timed(self.histogram, "b")(lambda: None)()
+        with self.histogram.time("b"):
+            pass
+        self.assertEqual(self.histogram.samples(), [])
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    """Test cases for /metrics."""
+
+    def setUp(self):
+        """Enable the metrics and log in as ADMIN."""
+        metrics.configure(True)
+        self.addCleanup(metrics.configure, app.config['METRICS_ENABLED'])
+        self.client = app.test_client()
+        self.client.post("/login", data={"id": "admin", "pw": "admin"})
+
+    def test_metrics(self):
+        """Test that routes, database calls, templates and caches are reported."""
+        self.client.get("/private/")
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{endpoint="get_private",method="GET",status="200"}', text)
+        self.assertIn('db_call_duration_seconds_count{function="read_notes_page"}', text)
+        self.assertIn('template_render_duration_seconds_count{template="private_page.html"}', text)
+        self.assertIn('cache_requests_total{cache="user",result="miss"}', text)
+        self.assertIn("db_connections_open ", text)
+
+    def test_disabled(self):
+        """Test that /metrics is not found while the metrics are disabled."""
+        metrics.configure(False)
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    def test_token(self):
+        """Test that a configured token is required."""
+        app.config['METRICS_TOKEN'] = "secret"
+        self.addCleanup(app.config.__setitem__, 'METRICS_TOKEN', None)
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+Unit tests for the migration commands of migrate.py.
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import migrate
+
+
+class TestConsolidate(unittest.TestCase):
+    """Test cases for merging the legacy database files."""
+
+    def setUp(self):
+        """Create legacy users.db, notes.db and images.db files."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.paths = {
+            name: os.path.join(self.tmp.name, name + ".db")
+            for name in ("users", "notes", "images", "app")
+        }
+        fixtures = {
+            "users": ("CREATE TABLE users (id text primary key, pw text);",
+                      "INSERT INTO users VALUES ('ADMIN', 'x'), ('BOB', 'y');"),
+            "notes": ("CREATE TABLE notes (user text, timestamp text, note text, note_id text);",
+                      "INSERT INTO notes VALUES ('BOB', 't1', 'hello', 'n1'), "
+                      "('GHOST', 't2', 'orphan', 'n2');"),
+            "images": ("CREATE TABLE images (uid text unique, owner text, name text, timestamp text);",
+                       "INSERT INTO images VALUES ('i1', 'BOB', 'a.png', 't3');"),
+        }
+        for name, commands in fixtures.items():
+            _conn = sqlite3.connect(self.paths[name])
+            for command in commands:
+                _conn.execute(command)
+            _conn.commit()
+            _conn.close()
+
+    def tearDown(self):
+        """Remove the temporary files."""
+        self.tmp.cleanup()
+
+    def _consolidate(self):
+        return migrate.consolidate(
+            self.paths["users"], self.paths["notes"], self.paths["images"], self.paths["app"]
+        )
+
+    def test_copies_rows_and_skips_orphans(self):
+        """Test that every owned row is copied and orphaned notes are skipped."""
+        report = self._consolidate()
+        self.assertEqual(report, {"users": (2, 0), "notes": (1, 1), "images": (1, 0)})
+
+    def test_is_idempotent(self):
+        """Test that running the migration twice does not duplicate rows."""
+        self._consolidate()
+        report = self._consolidate()
+        self.assertEqual(report["notes"], (0, 2))
+
+    def test_notes_get_integer_ids(self):
+        """Test that copied notes are numbered from note_ids, which moves past them."""
+        self._consolidate()
+        _conn = sqlite3.connect(self.paths["app"])
+        self.assertEqual(_conn.execute("SELECT note_id, note FROM notes;").fetchall(), [(1, "hello")])
+        self.assertEqual(_conn.execute("SELECT next FROM note_ids;").fetchone()[0], 2)
+        _conn.close()
+
+    def test_delete_cascades(self):
+        """Test that deleting a user removes their notes and images."""
+        self._consolidate()
+        _conn = sqlite3.connect(self.paths["app"])
+        _conn.execute("PRAGMA foreign_keys = ON;")
+        _conn.execute("DELETE FROM users WHERE id = 'BOB';")
+        self.assertEqual(_conn.execute("SELECT COUNT(*) FROM notes;").fetchone()[0], 0)
+        self.assertEqual(_conn.execute("SELECT COUNT(*) FROM images;").fetchone()[0], 0)
+        _conn.close()
+
+    def test_consolidated_notes_are_searchable(self):
+        """Test that copied notes are indexed, and that the index can be rebuilt."""
+        self._consolidate()
+        _conn = sqlite3.connect(self.paths["app"])
+        _conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('delete-all');")
+        _conn.commit()
+        _conn.close()
+
+        self.assertEqual(migrate.rebuild_search(self.paths["app"]), 1)
+        _conn = sqlite3.connect(self.paths["app"])
+        self.assertEqual(_conn.execute("SELECT rowid FROM notes_fts WHERE notes_fts MATCH 'hello';").fetchall(), [(1,)])
+        _conn.close()
+
+    def test_shard_images(self):
+        """Test that a flat pool is moved into the store and the keys recorded."""
+        self._consolidate()
+        pool = os.path.join(self.tmp.name, "pool")
+        os.mkdir(pool)
+        with open(os.path.join(pool, "i1-a.png"), "wb") as legacy:
+            legacy.write(b"data")
+
+        self.assertEqual(migrate.shard_images(pool, self.paths["app"]), (1, 0))
+        _conn = sqlite3.connect(self.paths["app"])
+        self.assertEqual(_conn.execute("SELECT path FROM images;").fetchone()[0], "i1/i1-a.png")
+        _conn.close()
+        self.assertEqual(migrate.shard_images(pool, self.paths["app"]), (0, 0))
+
+    def test_hash_images(self):
+        """Test that identical images end up sharing one content-addressed file."""
+        self._consolidate()
+        pool = os.path.join(self.tmp.name, "pool")
+        _conn = sqlite3.connect(self.paths["app"])
+        _conn.execute("INSERT INTO images (uid, owner, name, timestamp) VALUES ('i2', 'BOB', 'b.png', 't4');")
+        _conn.commit()
+        for name in ("i1-a.png", "i2-b.png"):
+            os.makedirs(os.path.join(pool, "i1" if name.startswith("i1") else "i2"), exist_ok=True)
+            with open(os.path.join(pool, name[:2], name), "wb") as legacy:
+                legacy.write(b"same content")
+        _conn.execute("UPDATE images SET path = substr(uid, 1, 2) || '/' || uid || '-' || name;")
+        _conn.commit()
+
+        self.assertEqual(migrate.hash_images(pool, self.paths["app"]), (2, 1, 0))
+        paths = {row[0] for row in _conn.execute("SELECT path FROM images;")}
+        _conn.close()
+        self.assertEqual(len(paths), 1)
+        self.assertTrue(os.path.exists(os.path.join(pool, *paths.pop().split("/"))))
+        self.assertFalse(os.path.exists(os.path.join(pool, "i1", "i1-a.png")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Unit tests for password hashing.
+"""
+
+import hashlib
+import unittest
+from unittest.mock import patch
+
+import passwords
+
+
+class TestPasswords(unittest.TestCase):
+    """Test cases for the hashers and the upgrade path."""
+
+    def setUp(self):
+        """Start each test with the default hasher and an empty verification cache."""
+        self.previous_hasher = passwords.hasher
+        passwords.hasher = passwords.HASHERS["scrypt"]
+        passwords._verified.clear()
+
+    def tearDown(self):
+        """Restore the hasher."""
+        passwords.hasher = self.previous_hasher
+
+    def test_salted(self):
+        """Test that the same password gets a different hash every time."""
+        first, second = passwords.make("pw"), passwords.make("pw")
+        self.assertTrue(first.startswith("scrypt$"))
+        self.assertNotEqual(first, second)
+        self.assertEqual(passwords.check("pw", first), (True, False))
+        self.assertEqual(passwords.check("wrong", first), (False, False))
+
+    def test_pbkdf2(self):
+        """Test hashing and verifying with PBKDF2."""
+        encoded = passwords.PBKDF2Hasher(1000).encode("pw", b"salt")
+        self.assertTrue(passwords.PBKDF2Hasher(1000).verify("pw", encoded))
+        self.assertFalse(passwords.PBKDF2Hasher(1000).verify("other", encoded))
+
+    def test_legacy_hash_needs_update(self):
+        """Test that unsalted SHA-256 hashes are accepted and flagged for an upgrade."""
+        legacy = hashlib.sha256(b"pw").hexdigest()
+        self.assertEqual(passwords.check("pw", legacy), (True, True))
+        self.assertEqual(passwords.check("wrong", legacy), (False, False))
+
+    def test_weaker_parameters_need_update(self):
+        """Test that hashes made with other parameters are flagged for an upgrade."""
+        weak = passwords.ScryptHasher(n=2 ** 10).encode("pw", b"salt")
+        self.assertEqual(passwords.check("pw", weak), (True, True))
+
+    def test_unknown_algorithm(self):
+        """Test that hashes of an unknown algorithm never match."""
+        self.assertEqual(passwords.check("pw", "md5$abc$def"), (False, False))
+
+    def test_verification_cache(self):
+        """Test that a second login with the same password skips the key derivation."""
+        encoded = passwords.make("pw")
+        self.assertTrue(passwords.check("pw", encoded)[0])
+        with patch.object(passwords.ScryptHasher, "verify") as mock_verify:
+            self.assertTrue(passwords.check("pw", encoded)[0])
+            self.assertFalse(mock_verify.called)
+            mock_verify.return_value = False
+            self.assertFalse(passwords.check("wrong", encoded)[0])
+            self.assertTrue(mock_verify.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Unit tests for the request profiler and the /profiling/ routes.
+"""
+
+import time
+import unittest
+
+import profiling
+from app import app, profiler
+
+
+def slow_view(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    if profiling.ENVIRON_KEY in environ:
+        environ[profiling.ENVIRON_KEY].endpoint = environ["PATH_INFO"]
+    time.sleep(0.05)
+    return [b"done"]
+
+
+class TestProfiler(unittest.TestCase):
+    """Test cases for the sampling of requests going through the middleware."""
+
+    def setUp(self):
+        """Wrap a slow WSGI application."""
+        self.profiler = profiling.Profiler(True, interval=0.001, token="secret")
+        self.app = self.profiler.middleware(slow_view)
+        self.headers = []
+
+    def request(self, path, **environ):
+        """Run and close one request; returns its body."""
+        environ.update(PATH_INFO=path)
+        result = self.app(environ, lambda status, headers, exc_info=None: self.headers.extend(headers))
+        body = b"".join(result)
+        getattr(result, "close", lambda: None)()
+        return body
+
+    def test_header(self):
+        """Test that a request is profiled when its header holds the token, and kept on its own."""
+        self.assertEqual(self.request("/slow", HTTP_X_PROFILE="wrong"), b"done")
+        self.assertEqual(self.profiler.summary()["routes"], [])
+        self.request("/slow", HTTP_X_PROFILE="secret")
+        profile_id = dict(self.headers)["X-Profile-Id"]
+        stacks = self.profiler.request_collapsed(profile_id)
+        self.assertIn("slow_view (tests/test_profiling.py:", stacks)
+        self.assertNotIn("profiled_app", stacks)
+
+    def test_routes(self):
+        """Test that profiles are added up per endpoint and exported as collapsed stacks."""
+        self.profiler.sample_rate = 1.0
+        for path in ("/a", "/a", "/b"):
+            self.request(path)
+        routes = {route["endpoint"]: route for route in self.profiler.summary()["routes"]}
+        self.assertEqual(routes["/a"]["requests"], 2)
+        self.assertGreater(routes["/a"]["seconds"], 0.1)
+        stack, count = self.profiler.collapsed("/a").splitlines()[0].rsplit(" ", 1)
+        self.assertTrue(stack.endswith("slow_view (tests/test_profiling.py:12)"))
+        self.assertGreater(int(count), 10)
+        self.assertIsNone(self.profiler.collapsed("/c"))
+        self.profiler.reset()
+        self.assertEqual(self.profiler.collapsed(), "")
+
+    def test_disabled(self):
+        """Test that nothing is profiled while disabled."""
+        self.profiler.enabled = False
+        self.request("/slow", HTTP_X_PROFILE="secret")
+        self.assertNotIn("X-Profile-Id", dict(self.headers))
+        self.assertEqual(self.profiler.summary()["requests"], [])
+
+
+class TestProfilingRoutes(unittest.TestCase):
+    """Test cases for /profiling/."""
+
+    def setUp(self):
+        """Enable the profiler of the application for the test only."""
+        self.addCleanup(setattr, profiler, "enabled", profiler.enabled)
+        self.addCleanup(setattr, profiler, "sample_rate", profiler.sample_rate)
+        self.addCleanup(profiler.reset)
+        profiler.enabled = True
+        self.client = app.test_client()
+        self.client.post("/login", data={"id": "admin", "pw": "admin"})
+
+    def test_profiling(self):
+        """Test that a profiled request is listed under its endpoint and its stacks exported."""
+        response = self.client.get("/private/", headers={"X-Profile": "1"})
+        response.get_data()
+        response.close()
+        summary = self.client.get("/profiling/").get_json()
+        self.assertEqual([route["endpoint"] for route in summary["routes"]], ["get_private"])
+        self.assertEqual(summary["requests"][0]["id"], response.headers["X-Profile-Id"])
+        self.assertEqual(self.client.get("/profiling/stacks?endpoint=get_private").status_code, 200)
+        self.assertEqual(self.client.get("/profiling/stacks?endpoint=get_admin").status_code, 404)
+
+    def test_sample_rate(self):
+        """Test that the sample rate is changed without a restart."""
+        summary = self.client.post("/profiling/", data={"sample_rate": "0.25"}).get_json()
+        self.assertEqual(summary["sample_rate"], 0.25)
+        self.assertEqual(profiler.sample_rate, 0.25)
+
+    def test_access(self):
+        """Test that the routes are not found while disabled and require a configured token."""
+        profiler.enabled = False
+        self.assertEqual(self.client.get("/profiling/").status_code, 404)
+        profiler.enabled = True
+        self.addCleanup(setattr, profiler, "token", profiler.token)
+        profiler.token = "secret"
+        self.assertEqual(self.client.get("/profiling/").status_code, 401)
+        response = self.client.get("/profiling/", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Unit tests for the production server.
+"""
+
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import serve
+
+
+def _wsgi_app(environ, start_response):
+    if environ["PATH_INFO"] == "/slow":
+        time.sleep(0.5)
+    elif environ["PATH_INFO"] == "/slower":
+        time.sleep(2)
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"%d" % os.getpid()]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+class TestPooledWSGIServer(unittest.TestCase):
+    """Test cases for the thread-pooled server of a worker."""
+
+    def setUp(self):
+        """Start a server with two threads on a free port."""
+        self.server = serve.PooledWSGIServer("127.0.0.1", 0, _wsgi_app, threads=2)
+        self.server.log = lambda *args: None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        """Stop the server."""
+        self.server.shutdown()
+        self.thread.join()
+
+    def test_requests_run_concurrently(self):
+        """Test that a slow request does not hold the others back."""
+        slow = threading.Thread(target=_get, args=(self.port, "/slow"))
+        slow.start()
+        start = time.monotonic()
+        self.assertEqual(_get(self.port, "/")[0], 200)
+        self.assertLess(time.monotonic() - start, 0.4)
+        slow.join()
+
+    def test_shutdown_timeout(self):
+        """Test that closing the server stops waiting for a slow request after the timeout."""
+        server = serve.PooledWSGIServer("127.0.0.1", 0, _wsgi_app, threads=2, shutdown_timeout=0.1)
+        server.log = lambda *args: None
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        slow = threading.Thread(target=_get, args=(server.server_address[1], "/slower"))
+        slow.start()
+        time.sleep(0.1)
+        server.shutdown()
+        thread.join()
+        # the server was closed while the request was still being answered
+        self.assertTrue(slow.is_alive())
+        self.assertEqual(server.unfinished, 1)
+        slow.join()
+
+
+class TestServe(unittest.TestCase):
+    """Test cases for the pre-forking server, run in a child process."""
+
+    def test_workers_and_graceful_shutdown(self):
+        """Test that workers answer requests and that SIGTERM stops every process cleanly."""
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, "serve.py", "--port", str(port), "--workers", "2", "--threads", "2"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        try:
+            for _ in range(100):
+                try:
+                    status, _ = _get(port, "/public/")
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            self.assertEqual(status, 200)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            self.assertEqual(process.wait(timeout=30), 0)
+
+    @patch('serve.WORKER_RESTART_DELAY', 0.05)
+    @patch('serve.WORKER_MAX_FAILURES', 3)
+    @patch('serve.preload')
+    def test_failing_workers_are_not_restarted_forever(self, preload):
+        """Test that workers dying on start-up are replaced with a growing delay, then given up on."""
+        started = []
+
+        def spawn(*args):
+            started.append(time.monotonic())
+            pid = os.fork()
+            if pid == 0:
+                os._exit(1)
+            return pid
+
+        previous = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+        self.addCleanup(signal.signal, signal.SIGINT, previous[1])
+        self.addCleanup(signal.signal, signal.SIGTERM, previous[0])
+        with patch('serve._spawn', spawn), self.assertRaises(SystemExit):
+            serve.serve("127.0.0.1", _free_port(), 2, 1, 1)
+        # two workers, then one replacement after 0.05s and one after 0.1s
+        self.assertEqual(len(started), 4)
+        self.assertGreaterEqual(started[-1] - started[1], 0.15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+Unit tests for the server-side session store.
+"""
+
+import unittest
+from unittest.mock import patch
+
+from flask import Flask, session
+
+import database
+import sessions
+from tests.test_fonctionnel import TemporaryDatabaseTestCase
+
+
+def _make_app(backend, touch_interval=0):
+    """Small application storing a counter and a user in its session."""
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = sessions.ServerSessionInterface(backend, refresh_interval=60, touch_interval=touch_interval)
+
+    @app.route("/login/<user>")
+    def login(user):
+        session.regenerate()
+        session["current_user"] = user
+        return ""
+
+    @app.route("/count")
+    def count():
+        session["count"] = session.get("count", 0) + 1
+        return str(session["count"])
+
+    @app.route("/read")
+    def read():
+        return str(session.get("current_user"))
+
+    @app.route("/logout")
+    def logout():
+        session.clear()
+        return ""
+
+    return app
+
+
+def _session_cookie(client):
+    cookie = [cookie for cookie in client.cookie_jar if cookie.name == "session"]
+    return cookie[0].value if cookie else None
+
+
+class TestServerSessions(unittest.TestCase):
+    """Test cases for the session interface with the in-memory backend."""
+
+    def setUp(self):
+        """Create an application with an empty in-memory backend."""
+        self.backend = sessions.MemoryBackend(max_entries=10)
+        self.app = _make_app(self.backend)
+        self.client = self.app.test_client()
+
+    def test_cookie_is_opaque(self):
+        """Test that the cookie only holds a random id and the content stays on the server."""
+        self.client.get("/login/ALICE")
+        sid = _session_cookie(self.client)
+        self.assertEqual(len(sid), 22)
+        self.assertNotIn("ALICE", sid)
+        self.assertEqual(self.client.get("/read").data, b"ALICE")
+
+    def test_anonymous_requests_store_nothing(self):
+        """Test that a request leaving the session empty neither stores it nor sets a cookie."""
+        self.client.get("/read")
+        self.assertIsNone(_session_cookie(self.client))
+        self.assertEqual(len(self.backend._sessions), 0)
+
+    def test_login_regenerates_id(self):
+        """Test that logging in moves the session to a new id and drops the former one."""
+        self.client.get("/count")
+        before = _session_cookie(self.client)
+        self.client.get("/login/ALICE")
+        after = _session_cookie(self.client)
+        self.assertNotEqual(before, after)
+        self.assertEqual(list(self.backend._sessions), [after])
+        self.assertEqual(self.client.get("/count").data, b"2")
+
+    def test_logout_deletes_session(self):
+        """Test that clearing the session removes it from the backend and the browser."""
+        self.client.get("/login/ALICE")
+        self.client.get("/logout")
+        self.assertEqual(len(self.backend._sessions), 0)
+        self.assertIsNone(_session_cookie(self.client))
+
+    def test_forget_user(self):
+        """Test that every session of a user can be dropped at once."""
+        other = self.app.test_client()
+        self.client.get("/login/ALICE")
+        other.get("/login/BOB")
+        self.app.session_interface.forget_user("ALICE")
+        self.assertEqual(self.client.get("/read").data, b"None")
+        self.assertEqual(other.get("/read").data, b"BOB")
+
+    def test_unchanged_session_is_not_saved(self):
+        """Test that reading a session does not write it back."""
+        self.client.get("/login/ALICE")
+        with patch.object(self.backend, "save") as mock_save:
+            self.client.get("/read")
+        self.assertFalse(mock_save.called)
+
+    @patch('sessions.time.time')
+    def test_expiry_is_refreshed_in_batches(self, mock_time):
+        """Test that expiries are only written once per touch interval, for every session used meanwhile."""
+        mock_time.return_value = 1000
+        app = _make_app(self.backend, touch_interval=3600)
+        first, second = app.test_client(), app.test_client()
+        first.get("/login/ALICE")
+        second.get("/login/BOB")
+
+        mock_time.return_value = 1000 + 120
+        with patch.object(self.backend, "touch") as mock_touch:
+            first.get("/read")
+            second.get("/read")
+            self.assertFalse(mock_touch.called)
+            app.session_interface._last_touch -= 3600
+            first.get("/read")
+        self.assertEqual(sorted(mock_touch.call_args[0][0].values()), [1120 + 31 * 24 * 3600] * 2)
+
+    @patch('sessions.time.time')
+    def test_expired_session_is_ignored(self, mock_time):
+        """Test that a session unused for its whole lifetime is gone."""
+        mock_time.return_value = 1000
+        self.client.get("/login/ALICE")
+        mock_time.return_value = 1000 + 31 * 24 * 3600
+        self.assertEqual(self.client.get("/read").data, b"None")
+
+    def test_lru_eviction(self):
+        """Test that the in-memory backend keeps its most recently used sessions."""
+        clients = [self.app.test_client() for _ in range(11)]
+        for number, client in enumerate(clients):
+            client.get("/login/USER%d" % number)
+        self.assertEqual(clients[0].get("/read").data, b"None")
+        self.assertEqual(clients[10].get("/read").data, b"USER10")
+
+
+class TestSQLiteSessions(TemporaryDatabaseTestCase):
+    """Test cases for sessions stored in the sessions table."""
+
+    def setUp(self):
+        """Create an application storing its sessions in a temporary database."""
+        super().setUp()
+        self.app = _make_app(sessions.SQLiteBackend())
+        self.client = self.app.test_client()
+
+    def test_round_trip(self):
+        """Test that a session survives across requests and processes sharing the database."""
+        self.client.get("/login/ALICE")
+        self.client.get("/count")
+        other_process = _make_app(sessions.SQLiteBackend()).test_client()
+        other_process.set_cookie("localhost", "session", _session_cookie(self.client))
+        self.assertEqual(other_process.get("/read").data, b"ALICE")
+        self.assertEqual(other_process.get("/count").data, b"2")
+
+    def test_touch_and_purge(self):
+        """Test batched expiry updates and the removal of expired sessions."""
+        database.write_session("a", "ALICE", b"{}", 100)
+        database.write_session("b", "BOB", b"{}", 100)
+        database.touch_sessions([(500, "a")])
+        self.assertEqual(database.read_session("a", 200), (b"{}", 500))
+        self.assertIsNone(database.read_session("b", 200))
+
+        database.delete_sessions(expired_before=200)
+        _conn = database._connect(database.DB_FILE_LOCATION)
+        self.assertEqual(_conn.execute("SELECT id FROM sessions;").fetchall(), [("a",)])
+
+        database.delete_sessions(user_id="ALICE")
+        self.assertIsNone(database.read_session("a", 200))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Unit tests for the generation of resized image variants.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+import image_store
+import thumbnails
+
+
+class TestThumbnails(unittest.TestCase):
+    """Test cases for thumbnails functions."""
+
+    def setUp(self):
+        """Store a 1000x500 PNG in an empty pool."""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.key = "ab/cd/abcd.png"
+        os.makedirs(os.path.join(self.root, "ab", "cd"))
+        Image.new("RGB", (1000, 500), "red").save(image_store.path_for(self.root, self.key))
+
+    def tearDown(self):
+        """Remove the pool."""
+        self.tmp.cleanup()
+
+    def test_variant_key(self):
+        """Test that variants are stored next to the original."""
+        self.assertEqual(thumbnails.variant_key(self.key, "thumb"), "ab/cd/abcd@thumb.png")
+
+    def test_generate_keeps_aspect_ratio(self):
+        """Test that a variant fits its bounding box and keeps the format."""
+        key = thumbnails.generate(self.root, self.key, "thumb")
+        with Image.open(image_store.path_for(self.root, key)) as image:
+            self.assertEqual(image.size, (200, 100))
+            self.assertEqual(image.format, "PNG")
+
+    def test_queue_and_remove(self):
+        """Test background generation of every variant and their removal."""
+        keys = thumbnails.queue(self.root, self.key).result(timeout=10)
+        self.assertEqual(len(keys), len(thumbnails.VARIANTS))
+        thumbnails.remove_variants(self.root, self.key)
+        self.assertFalse(any(os.path.exists(image_store.path_for(self.root, key)) for key in keys))
+
+    def test_image_removed_while_generating(self):
+        """Test that a variant finished after its image was removed is not left behind."""
+        thumbnail = Image.Image.thumbnail
+
+        def remove_original(image, size):
+            thumbnail(image, size)
+            image_store.remove(self.root, self.key)
+            thumbnails.remove_variants(self.root, self.key)
+
+        with patch.object(Image.Image, "thumbnail", remove_original):
+            with self.assertRaises(FileNotFoundError):
+                thumbnails.generate(self.root, self.key, "thumb")
+        self.assertEqual(os.listdir(os.path.join(self.root, "ab", "cd")), [])
+
+    def test_decompression_bomb_is_a_decode_error(self):
+        """Test that images over twice MAX_IMAGE_PIXELS count as undecodable."""
+        with patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            with self.assertRaises(thumbnails.DECODE_ERRORS):
+                thumbnails.generate(self.root, self.key, "thumb")
+
+    def test_backfill_skips_broken_files(self):
+        """Test that the backfill processes images and skips undecodable files."""
+        with open(image_store.path_for(self.root, "ab/cd/broken.png"), "wb") as broken:
+            broken.write(b"not an image")
+        done = thumbnails.backfill(self.root, [self.key, "ab/cd/broken.png"], workers=1)
+        self.assertEqual(done, 1)
+        self.assertTrue(os.path.exists(image_store.path_for(self.root, "ab/cd/abcd@medium.png")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,7 @@ test_get_users : Vérifie que la route /admin/ retourne un statut 200 (OK).
 test_add_user : Vérifie que l'ajout d'un utilisateur retourne un statut 200 (OK).
 test_delete_user : Vérifie que la suppression d'un utilisateur retourne un statut 302 (redirection).
 test_login : Vérifie que la connexion d'un utilisateur retourne un statut 302 (redirection).
+test_login_unknown_user : Vérifie qu'un identifiant inconnu ne connecte personne, avec une seule requête sur l'utilisateur.
 test_logout : Vérifie que la déconnexion retourne un statut 302 (redirection).
 test_write_note : Vérifie que l'écriture d'une note retourne un statut 302 (redirection).
 test_401_error : Vérifie que la route /private/ retourne un statut 401 pour un utilisateur non connecté.
@@ -14,9 +15,29 @@ test_403_error : Vérifie que la suppression de l'utilisateur ADMIN retourne un
 test_404_error : Vérifie qu'une route inexistante retourne un statut 404.
 test_405_error : Vérifie qu'une méthode non autorisée retourne un statut 405.
 test_413_error : Vérifie qu'un fichier trop volumineux retourne un statut 413.
+test_upload_image : Vérifie que le téléversement d'une image retourne un statut 302 (redirection) sans laisser de fichier temporaire.
+test_get_image : Vérifie que /image/<uid> sert l'image avec ETag, 304 et requêtes partielles (206).
+test_get_image_variant : Vérifie que /image/<uid>?variant=thumb génère et sert la miniature, 404 pour une variante inconnue, et l'original pour une image trop grande.
+test_get_image_accel_redirect : Vérifie que /image/<uid> délègue l'envoi au serveur frontal (X-Accel-Redirect).
+test_get_image_not_owner : Vérifie que /image/<uid> retourne 401 hors propriétaire et 404 pour une image inconnue.
+test_fun_root_conditional : Vérifie que la page d'accueil mise en cache porte un ETag et répond 304 si elle n'a pas changé.
+test_fun_admin_lists_new_user : Vérifie que la liste des comptes suit les ajouts et suppressions.
+test_fun_admin_users_pages : Vérifie que la liste des comptes est paginée, filtrée par préfixe et affiche le nombre de notes.
+test_fun_deleted_user_is_logged_out : Vérifie que la suppression d'un compte ferme ses sessions côté serveur.
+test_fun_delete_user_status : Vérifie que la suppression d'un compte se fait en arrière-plan et que son avancement est consultable.
 test_fun_root : Vérifie que la route / retourne un statut 200 (OK).
 test_fun_public : Vérifie que la route /public/ retourne un statut 200 (OK).
 test_fun_private : Vérifie que la route /private/ retourne un statut 200 (OK) pour un utilisateur connecté.
+test_fun_private_pagination : Vérifie que la page privée est paginée et propose un lien vers la page suivante.
+test_fun_private_sees_new_note : Vérifie qu'une nouvelle note invalide le cache de la page privée.
+test_fun_delete_note : Vérifie qu'une note est supprimée par son identifiant entier et qu'un identifiant non numérique retourne 404.
+test_fun_search : Vérifie que la recherche retrouve une note et met en évidence les mots trouvés.
+test_write_note_behind : Vérifie qu'une note confiée à l'écriture différée est visible avant d'être validée en base, et trouvée par la recherche une fois validée.
+test_bulk_notes : Vérifie la création, l'export et la suppression de plusieurs notes en une requête.
+test_bulk_images : Vérifie le téléversement groupé d'images et leur suppression depuis le formulaire de la page privée.
+test_bulk_delete_not_owner : Vérifie qu'une suppression groupée contenant l'élément d'un autre utilisateur retourne 401 sans rien supprimer.
+test_bulk_malformed_note_id : Vérifie qu'un identifiant de note non entier retourne 400 sans rien supprimer.
+test_fun_archive : Vérifie l'export d'une archive, son import dans un autre compte par l'administrateur, et le refus pour un autre utilisateur.
 test_allowed_file : Vérifie que la fonction allowed_file retourne True pour des fichiers autorisés et False pour des fichiers non autorisés.
 test_fun_delete_user : Vérifie que la suppression d'un utilisateur retourne un statut 302 (redirection).
 test_fun_add_user : Vérifie que l'ajout d'un utilisateur retourne un statut 200 (OK).
@@ -24,8 +45,13 @@ test_fun_add_user : Vérifie que l'ajout d'un utilisateur retourne un statut 200
 
 import os
 import unittest
+from unittest.mock import patch
 
-from app import app, allowed_file  # Ensure 'app' module is correctly installed and accessible
+from PIL import Image
+
+import database
+import write_behind
+from app import app, allowed_file, user_cache, user_deleter  # Ensure 'app' module is correctly installed and accessible
 
 
 class TestUserAPI(unittest.TestCase):
@@ -69,6 +95,15 @@ class TestUserAPI(unittest.TestCase):
         response = self.client.post("/login", data={"id": "Alice", "pw": "password"})
         self.assertEqual(response.status_code, 302)
 
+    def test_login_unknown_user(self):
+        """Vérifie qu'un identifiant inconnu ne connecte personne, avec une seule requête sur l'utilisateur."""
+        client = app.test_client()
+        with patch('app.user_exists') as exists:
+            response = client.post("/login", data={"id": "Inconnu", "pw": "password"})
+        self.assertEqual(response.status_code, 302)
+        exists.assert_not_called()
+        self.assertEqual(client.get("/private/").status_code, 401)
+
     def test_logout(self):
         """Vérifie que la déconnexion retourne un statut 302 (redirection)."""
         response = self.client.get("/logout/")
@@ -112,6 +147,132 @@ class TestUserAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 413)
         os.remove("large_test_file.jpg")
 
+    def test_upload_image(self):
+        """Vérifie que le téléversement d'une image retourne un statut 302 (redirection) sans laisser de fichier temporaire."""
+        with open("test_image.jpg", "rb") as img:
+            response = self.client.post("/upload_image", data={"file": img})
+        self.assertEqual(response.status_code, 302)
+        # written once by the form parser, then moved into the store
+        pool = app.config['UPLOAD_FOLDER']
+        self.assertEqual([name for name in os.listdir(pool) if name.startswith(".upload-")], [])
+
+    def test_get_image(self):
+        """Vérifie que l'image est servie avec un ETag fort, des requêtes conditionnelles et partielles."""
+        uid = "cbebc37b8e9ae56d722fc3966bb78da4ce48f9a6"
+        response = self.client.get(f"/image/{uid}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "image/png")
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        etag = response.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        body = response.get_data()
+        response.close()
+
+        response = self.client.get(f"/image/{uid}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(f"/image/{uid}", headers={"Range": "bytes=0-9"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.get_data(), body[:10])
+        response.close()
+
+    def test_get_image_variant(self):
+        """Vérifie que la miniature est générée à la demande puis servie, et l'original pour une image trop grande à décoder."""
+        uid = "cbebc37b8e9ae56d722fc3966bb78da4ce48f9a6"
+        response = self.client.get(f"/image/{uid}?variant=thumb")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["ETag"].endswith('@thumb"'))
+        response.close()
+        self.assertEqual(self.client.get(f"/image/{uid}?variant=huge").status_code, 404)
+        with patch("app.thumbnails.generate", side_effect=Image.DecompressionBombError("too big")):
+            response = self.client.get(f"/image/{uid}?variant=medium")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.headers["ETag"].endswith('@medium"'))
+        response.close()
+
+    def test_get_image_accel_redirect(self):
+        """Vérifie que l'envoi du fichier est délégué au serveur frontal si configuré."""
+        app.config['IMAGE_ACCEL_REDIRECT_PREFIX'] = "/protected/"
+        try:
+            response = self.client.get("/image/cbebc37b8e9ae56d722fc3966bb78da4ce48f9a6")
+        finally:
+            app.config['IMAGE_ACCEL_REDIRECT_PREFIX'] = None
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["X-Accel-Redirect"].startswith("/protected/c6/a7/"))
+        self.assertEqual(response.get_data(), b"")
+
+    def test_get_image_not_owner(self):
+        """Vérifie qu'une image n'est servie qu'à son propriétaire."""
+        self.client.get("/logout/")
+        response = self.client.get("/image/cbebc37b8e9ae56d722fc3966bb78da4ce48f9a6")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get("/image/unknown").status_code, 404)
+
+    def test_fun_root_conditional(self):
+        """Vérifie que la page d'accueil pré-rendue est revalidée avec un statut 304."""
+        response = self.client.get("/")
+        self.assertTrue(response.headers["ETag"])
+        self.assertTrue(response.headers["Last-Modified"])
+        response = self.client.get("/", headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_fun_admin_lists_new_user(self):
+        """Vérifie que la liste des comptes suit les ajouts et suppressions."""
+        self.client.get("/admin/")
+        self.client.post("/add_user", data={"id": "Eve", "pw": "password"})
+        self.assertIn("EVE", self.client.get("/admin/").get_data(as_text=True))
+        self.client.get("/delete_user/EVE/")
+        # the account is listed with the deletions in progress until its job is done
+        user_deleter.wait()
+        self.assertNotIn("EVE", self.client.get("/admin/").get_data(as_text=True))
+
+    def test_fun_admin_users_pages(self):
+        """Vérifie que la liste des comptes est paginée, filtrée par préfixe et affiche le nombre de notes."""
+        self.client.post("/add_user", data={"id": "Alice", "pw": "password"})
+        self.client.post("/add_user", data={"id": "Bob", "pw": "password"})
+        alice = app.test_client()
+        alice.post("/login", data={"id": "Alice", "pw": "password"})
+        alice.post("/write_note", data={"text_note_to_take": "comptée"})
+
+        page = self.client.get("/admin/?q=al").get_data(as_text=True)
+        self.assertIn("<td>ALICE</td>\n                                    <td>1</td>", page)
+        self.assertNotIn("<td>BOB</td>", page)
+        page = self.client.get("/admin/?q=a&users_limit=1").get_data(as_text=True)
+        self.assertIn("users_after=ADMIN", page)
+        page = self.client.get("/admin/?q=a&users_limit=1&users_after=ADMIN").get_data(as_text=True)
+        self.assertIn("<td>ALICE</td>", page)
+        self.assertNotIn("<td>ADMIN</td>", page)
+        # a rejected id shows the first page again
+        page = self.client.post("/add_user", data={"id": "Bob", "pw": "password"}).get_data(as_text=True)
+        self.assertIn("<td>ADMIN</td>", page)
+
+    def test_fun_deleted_user_is_logged_out(self):
+        """Vérifie que la suppression d'un compte ferme ses sessions côté serveur."""
+        self.client.post("/add_user", data={"id": "Eve", "pw": "password"})
+        eve = app.test_client()
+        eve.post("/login", data={"id": "Eve", "pw": "password"})
+        self.assertEqual(eve.get("/private/").status_code, 200)
+        self.client.get("/delete_user/EVE/")
+        self.assertEqual(eve.get("/private/").status_code, 401)
+
+    def test_fun_delete_user_status(self):
+        """Vérifie que la suppression d'un compte se fait en arrière-plan et que son avancement est consultable."""
+        self.client.post("/add_user", data={"id": "Eve", "pw": "password"})
+        eve = app.test_client()
+        eve.post("/login", data={"id": "Eve", "pw": "password"})
+        eve.post("/write_note", data={"text_note_to_take": "bientôt supprimée"})
+        # only the tombstone, the job is queued below
+        with patch.object(user_deleter, "submit", side_effect=database.request_user_deletion):
+            self.client.get("/delete_user/EVE/")
+        status = self.client.get("/delete_user/EVE/status").get_json()
+        self.assertEqual((status["state"], status["notes"]), ("deleting", {"deleted": 0, "total": 1}))
+        self.assertIn("Accounts Being Deleted", self.client.get("/admin/").get_data(as_text=True))
+
+        user_deleter.submit("EVE")
+        user_deleter.wait()
+        self.assertEqual(self.client.get("/delete_user/EVE/status").get_json()["state"], "deleted")
+        self.assertEqual(self.client.get("/delete_user/ADMIN/status").status_code, 404)
+
     def test_fun_root(self):
         """Vérifie que la route '/' retourne un statut 200 (OK)."""
         response = self.client.get("/")
@@ -127,6 +288,121 @@ class TestUserAPI(unittest.TestCase):
         response = self.client.get("/private/")
         self.assertEqual(response.status_code, 200)
 
+    def test_fun_private_pagination(self):
+        """Vérifie que la page privée est paginée et propose la page suivante."""
+        self.client.post("/write_note", data={"text_note_to_take": "first"})
+        self.client.post("/write_note", data={"text_note_to_take": "second"})
+        response = self.client.get("/private/?notes_limit=1")
+        self.assertEqual(response.status_code, 200)
+        page = response.get_data(as_text=True)
+        self.assertIn("second", page)
+        self.assertNotIn("<td>first</td>", page)
+        self.assertIn("notes_before=", page)
+
+    def test_fun_private_sees_new_note(self):
+        """Vérifie qu'une note écrite apparaît malgré le cache de la page privée."""
+        self.client.get("/private/?notes_limit=3")
+        self.client.post("/write_note", data={"text_note_to_take": "fresh note"})
+        response = self.client.get("/private/?notes_limit=3")
+        self.assertIn("fresh note", response.get_data(as_text=True))
+
+    def test_fun_delete_note(self):
+        """Vérifie qu'une note est supprimée par son identifiant entier et qu'un identifiant non numérique retourne 404."""
+        note_id = self.client.post("/bulk/create", json={"note": ["à supprimer"]}).get_json()["notes"][0]
+        self.assertIsInstance(note_id, int)
+        self.assertEqual(self.client.get("/delete_note/%d" % note_id).status_code, 302)
+        self.assertEqual(self.client.post("/bulk/export", json={"note_id": [note_id]}).status_code, 401)
+        self.assertEqual(self.client.get("/delete_note/" + "a" * 64).status_code, 404)
+
+    def test_fun_search(self):
+        """Vérifie que la recherche retrouve une note et met en évidence les mots trouvés."""
+        self.client.post("/write_note", data={"text_note_to_take": "searchable <b>zanzibar</b> note"})
+        response = self.client.get("/search?q=zanzib")
+        self.assertEqual(response.status_code, 200)
+        page = response.get_data(as_text=True)
+        self.assertIn("<mark>zanzibar</mark>", page)
+        self.assertIn("&lt;b&gt;", page)
+        self.assertEqual(app.test_client().get("/search?q=zanzibar").status_code, 401)
+
+    def test_write_note_behind(self):
+        """Vérifie qu'une note en attente d'écriture différée est déjà visible par son auteur, et trouvée par la recherche une fois validée."""
+        writer = write_behind.NoteWriter(batch_size=100, interval=1, on_commit=user_cache.invalidate)
+        try:
+            with patch('app.note_writer', writer):
+                self.client.post("/write_note", data={"text_note_to_take": "queued quetzal note"})
+                self.assertTrue(writer.pending("ADMIN"))
+                response = self.client.get("/private/?notes_limit=1")
+                self.assertIn("queued quetzal note", response.get_data(as_text=True))
+                # searched before the commit, and cached without the note
+                self.assertNotIn("<mark>quetzal</mark>", self.client.get("/search?q=quetzal").get_data(as_text=True))
+                writer.flush()
+                self.assertIn("<mark>quetzal</mark>", self.client.get("/search?q=quetzal").get_data(as_text=True))
+        finally:
+            writer.close()
+
+    def test_bulk_notes(self):
+        """Vérifie la création, l'export et la suppression de plusieurs notes en une requête."""
+        response = self.client.post("/bulk/create", json={"note": ["bulk one", "bulk two"]})
+        self.assertEqual(response.status_code, 201)
+        note_ids = response.get_json()["notes"]
+        self.assertEqual(len(set(note_ids)), 2)
+
+        exported = self.client.post("/bulk/export", json={"note_id": note_ids}).get_json()
+        self.assertEqual(sorted(note["note"] for note in exported["notes"]), ["bulk one", "bulk two"])
+
+        response = self.client.post("/bulk/delete", json={"note_id": note_ids})
+        self.assertEqual(response.get_json(), {"notes": 2, "images": 0})
+        self.assertEqual(self.client.post("/bulk/export", json={"note_id": note_ids}).status_code, 401)
+
+    def test_bulk_images(self):
+        """Vérifie le téléversement groupé d'images et leur suppression depuis la page privée."""
+        with open("test_image.jpg", "rb") as first, open("test_image.jpg", "rb") as second:
+            response = self.client.post(
+                "/bulk/create", data={"file": [first, second]}, headers={"Accept": "application/json"}
+            )
+        image_uids = response.get_json()["images"]
+        self.assertEqual(len(set(image_uids)), 2)
+
+        response = self.client.post("/bulk/delete", data={"image_uid": image_uids})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(image_uids[0], self.client.get("/private/").get_data(as_text=True))
+
+    def test_bulk_delete_not_owner(self):
+        """Vérifie qu'une suppression groupée contenant l'élément d'un autre utilisateur retourne 401."""
+        note_ids = self.client.post("/bulk/create", json={"note": ["mine"]}).get_json()["notes"]
+        # no note has id 0, so it is not one of the notes of the user
+        response = self.client.post("/bulk/delete", json={"note_id": note_ids + [0]})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(len(self.client.post("/bulk/export", json={"note_id": note_ids}).get_json()["notes"]), 1)
+        self.client.post("/bulk/delete", json={"note_id": note_ids})
+
+    def test_bulk_malformed_note_id(self):
+        """Vérifie qu'un identifiant de note non entier retourne 400 sans rien supprimer."""
+        note_ids = self.client.post("/bulk/create", json={"note": ["gardée"]}).get_json()["notes"]
+        self.assertEqual(self.client.post("/bulk/delete", json={"note_id": note_ids + ["abc"]}).status_code, 400)
+        self.assertEqual(self.client.post("/bulk/export", data={"note_id": "1.5"}).status_code, 400)
+        self.assertEqual(len(self.client.post("/bulk/export", json={"note_id": note_ids}).get_json()["notes"]), 1)
+        self.client.post("/bulk/delete", json={"note_id": note_ids})
+
+    def test_fun_archive(self):
+        """Vérifie l'export d'une archive, son import dans un autre compte par l'administrateur, et le refus pour un autre utilisateur."""
+        self.client.post("/bulk/create", json={"note": ["archivée"]})
+        response = self.client.get("/archive")
+        self.assertEqual(response.content_type, "application/x-tar")
+        data = response.get_data()
+        self.client.post("/add_user", data={"id": "Alice", "pw": "password"})
+        response = self.client.post("/archive?user=alice", data=data, content_type="application/x-tar")
+        self.assertEqual(response.status_code, 201)
+        exported = self.client.get("/bulk/export").get_json()
+        self.assertEqual(response.get_json()["notes"], len(exported["notes"]))
+
+        alice = app.test_client()
+        alice.post("/login", data={"id": "Alice", "pw": "password"})
+        self.assertIn("archivée", alice.get("/private/").get_data(as_text=True))
+        self.assertEqual(alice.get("/archive?user=admin").status_code, 401)
+        self.assertEqual(alice.post("/archive", data=b"not a tar", content_type="application/x-tar").status_code, 400)
+        user_deleter.wait()
+
     def test_allowed_file(self):
         """Vérifie que la fonction 'allowed_file' retourne True pour des fichiers autorisés."""
         self.assertTrue(allowed_file("test.png"))
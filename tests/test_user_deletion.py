@@ -0,0 +1,115 @@
+"""
+Unit tests for the background deletion of users.
+"""
+
+import time
+import unittest
+
+import database
+import user_deletion
+from tests.test_fonctionnel import TemporaryDatabaseTestCase
+
+
+class TestUserDeletionBatches(TemporaryDatabaseTestCase):
+    """Test cases for the tombstone and the batches of database.py."""
+
+    def setUp(self):
+        """Create ALICE with five notes and three images, one of them shared with BOB."""
+        super().setUp()
+        database.add_user("alice", "pw")
+        database.add_user("bob", "pw")
+        place = lambda key: lambda existing: existing or key
+        database.create_items(
+            [database.new_note("alice", "note %d" % i) for i in range(5)],
+            [("a%d" % i, "ALICE", "a.png", "t%d" % i, "h%d" % i, 1, place("h%d.png" % i)) for i in range(3)]
+            + [("b0", "BOB", "b.png", "t", "h0", 1, place("copy.png"))]
+        )
+        database.write_session("sid", "ALICE", b"{}", time.time() + 60)
+        self.removed = []
+
+    def test_tombstone(self):
+        """Test that a tombstoned user cannot log in, is not listed and loses its sessions."""
+        self.assertTrue(database.request_user_deletion("ALICE"))
+        self.assertFalse(database.verify("ALICE", "pw"))
+        self.assertEqual(database.list_users(), ["BOB"])
+        self.assertIsNone(database.read_session("sid", time.time()))
+        self.assertTrue(database.user_exists("ALICE"))
+        self.assertFalse(database.request_user_deletion("GHOST"))
+
+    def test_batches(self):
+        """Test that batches record their progress and only remove files no one references."""
+        database.request_user_deletion("ALICE")
+        self.assertEqual(database.delete_user_batch("ALICE", 2, 0, self.removed.extend), (2, 2, 1, False))
+        self.assertEqual(database.user_deletions("ALICE")[0][2:7], (5, 3, 2, 2, 1))
+        self.assertEqual(database.delete_user_batch("ALICE", 2, 0, self.removed.extend), (2, 1, 1, False))
+        self.assertEqual(database.delete_user_batch("ALICE", 2, 0, self.removed.extend), (1, 0, 0, True))
+
+        self.assertEqual(sorted(self.removed), ["h1.png", "h2.png"])
+        self.assertFalse(database.user_exists("ALICE"))
+        self.assertEqual(database.user_deletions(), [])
+        self.assertEqual(len(database.export_items("BOB")[1]), 1)
+        self.assertIsNone(database.delete_user_batch("ALICE", 2, 0))
+
+    def test_files_removed_after_commit(self):
+        """Test that files are only removed once their batch is committed, without the write lock."""
+        database.request_user_deletion("ALICE")
+
+        def remove(paths):
+            # a new transaction can start: the batch is committed
+            database.write_session("other", "BOB", b"{}", time.time() + 60)
+            self.removed.append(len(database.read_note_from_db("ALICE")))
+            raise OSError("disk gone")
+
+        with self.assertRaises(OSError):
+            database.delete_user_batch("ALICE", 10, 0, remove)
+        self.assertEqual(self.removed, [0])
+        self.assertFalse(database.user_exists("ALICE"))
+
+    def test_lease(self):
+        """Test that a job can only be claimed once its lease has expired."""
+        database.request_user_deletion("ALICE", lease=100)
+        self.assertFalse(database.claim_user_deletion("ALICE", 50, 200))
+        self.assertTrue(database.claim_user_deletion("ALICE", 100, 200))
+        self.assertEqual(database.user_deletions("ALICE")[0][7], 200)
+
+
+class TestUserDeleter(TemporaryDatabaseTestCase):
+    """Test cases for UserDeleter against a temporary database."""
+
+    def setUp(self):
+        """Create a user with more notes than one batch holds."""
+        super().setUp()
+        database.add_user("alice", "pw")
+        database.write_notes_into_db([database.new_note("alice", "note") for _ in range(25)])
+        self.removed = []
+
+    def _deleter(self):
+        deleter = user_deletion.UserDeleter(self.removed.extend, batch_size=10, workers=2, lease=30)
+        self.addCleanup(deleter.close)
+        return deleter
+
+    def test_submit(self):
+        """Test that a submitted user is deleted in the background."""
+        deleter = self._deleter()
+        self.assertTrue(deleter.submit("ALICE"))
+        deleter.wait()
+        self.assertFalse(database.user_exists("ALICE"))
+
+    def test_resume_after_crash(self):
+        """Test that a job left behind by a dead process is resumed once its lease expired."""
+        database.request_user_deletion("ALICE", lease=int(time.time()) + 30)
+        database.delete_user_batch("ALICE", 10, 0)
+        self._deleter().wait()
+        self.assertTrue(database.user_exists("ALICE"))
+
+        _conn = database._connect(database.DB_FILE_LOCATION)
+        _conn.execute("UPDATE user_deletions SET lease = 0;")
+        _conn.commit()
+        deleter = self._deleter()
+        # the start-up scan queues the job, which is done once wait() returns
+        deleter.wait()
+        self.assertFalse(database.user_exists("ALICE"))
+
+
+if __name__ == "__main__":
+    unittest.main()
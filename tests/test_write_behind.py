@@ -0,0 +1,100 @@
+"""
+Unit tests for the write-behind queue of notes.
+"""
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import database
+import write_behind
+from tests.test_fonctionnel import TemporaryDatabaseTestCase
+
+
+class TestNoteWriter(TemporaryDatabaseTestCase):
+    """Test cases for NoteWriter against a temporary database."""
+
+    def setUp(self):
+        """Create a user and a writer with a long group-commit interval."""
+        super().setUp()
+        database.add_user("writer", "pw")
+        self.writer = write_behind.NoteWriter(batch_size=100, interval=0.3)
+
+    def tearDown(self):
+        """Stop the writer before removing the database."""
+        self.writer.close()
+        super().tearDown()
+
+    def test_pending_then_committed(self):
+        """Test that queued notes are visible to their author until committed."""
+        first = self.writer.submit("writer", "first")
+        second = self.writer.submit("writer", "second")
+        self.assertEqual(self.writer.pending("WRITER"), [
+            (second[3], second[1], "second"), (first[3], first[1], "first")
+        ])
+        self.assertTrue(self.writer.is_pending(first[3]))
+
+        self.writer.flush()
+        self.assertEqual(self.writer.pending("WRITER"), [])
+        self.assertEqual(len(database.read_note_from_db("writer")), 2)
+
+    def test_notes_are_committed_in_batches(self):
+        """Test that notes queued within the interval share one transaction."""
+        with patch('write_behind.database.write_notes_into_db',
+                   wraps=database.write_notes_into_db) as write:
+            for i in range(10):
+                self.writer.submit("writer", "note %d" % i)
+            self.writer.flush()
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(len(write.call_args[0][0]), 10)
+
+    def test_flush_does_not_wait_for_later_notes(self):
+        """Test that flush returns once the notes queued before it are committed, despite later writes."""
+        database.add_user("other", "pw")
+        self.writer.submit("writer", "first")
+        flushed = threading.Event()
+
+        def keep_writing():
+            while not flushed.is_set():
+                self.writer.submit("other", "more")
+                time.sleep(0.01)
+
+        thread = threading.Thread(target=keep_writing)
+        thread.start()
+        try:
+            self.writer.flush()
+        finally:
+            flushed.set()
+            thread.join()
+        self.assertEqual(self.writer.pending("writer"), [])
+
+    def test_flush_for_user(self):
+        """Test that flushing for a user without queued notes returns at once."""
+        self.writer.submit("writer", "queued")
+        self.writer.flush("other")
+        self.assertEqual(len(self.writer.pending("writer")), 1)
+        self.writer.flush("writer")
+        self.assertEqual(self.writer.pending("writer"), [])
+
+    def test_on_commit(self):
+        """Test that every author of a committed batch is passed to on_commit, once."""
+        committed = []
+        self.writer.on_commit = committed.append
+        database.add_user("other", "pw")
+        for user in ("writer", "other", "writer"):
+            self.writer.submit(user, "note")
+        self.writer.flush()
+        self.assertEqual(sorted(committed), ["OTHER", "WRITER"])
+
+    def test_bad_note_does_not_lose_batch(self):
+        """Test that a note of an unknown user is dropped alone."""
+        self.writer.submit("ghost", "lost")
+        self.writer.submit("writer", "kept")
+        with self.assertLogs("write_behind"):
+            self.writer.flush()
+        self.assertEqual([row[2] for row in database.read_note_from_db("writer")], ["kept"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Resized variants of stored images.
+
+Variants are stored in the image store next to their original, under the
+original key with '@<variant>' appended to the name. Uploads queue their
+variants on a thread pool so that requests do not wait for the resizing;
+variants that are still missing when requested are generated on demand and
+kept for the following requests.
+"""
+
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+from PIL import Image
+
+import image_store
+
+# Bounding box of every variant, in pixels.
+VARIANTS = {
+    "thumb": (200, 200),
+    "medium": (800, 800),
+}
+
+# Threads resizing freshly uploaded images.
+WORKERS = 2
+
+# Errors of images Pillow cannot or will not decode, e.g. files that are not
+# images, or that exceed Image.MAX_IMAGE_PIXELS twice over.
+DECODE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _forget_executor():
+    # the threads of the pool do not survive a fork
+    global _executor, _executor_lock
+    _executor, _executor_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_executor)
+
+
+def variant_key(key, variant):
+    """Storage key of a variant, e.g. 'ab/cd/abcd...@thumb.png'."""
+    base, extension = os.path.splitext(key)
+    return f"{base}@{variant}{extension}"
+
+
+def generate(root, key, variant):
+    """
+    Create a variant of the image stored under key unless it already exists,
+    and return its key. The variant is written to a temporary file and
+    renamed, so readers never see a partial file.
+
+    Raises FileNotFoundError when the image is removed meanwhile: a variant
+    renamed after remove_variants() ran is removed again, since nothing
+    would remove it later.
+    """
+    target_key = variant_key(key, variant)
+    target = image_store.path_for(root, target_key)
+    if os.path.exists(target):
+        return target_key
+
+    with Image.open(image_store.path_for(root, key)) as image:
+        image_format = image.format
+        image.thumbnail(VARIANTS[variant])
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".variant-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                image.save(out, format=image_format)
+            os.replace(tmp_path, target)
+        except BaseException:
+            image_store.discard(tmp_path)
+            raise
+
+    # images are removed before their variants (see app._remove_image_file)
+    if not os.path.exists(image_store.path_for(root, key)):
+        image_store.remove(root, target_key)
+        raise FileNotFoundError(image_store.path_for(root, key))
+    return target_key
+
+
+def generate_all(root, key):
+    """Create every missing variant of the image stored under key."""
+    return [generate(root, key, variant) for variant in VARIANTS]
+
+
+def queue(root, key):
+    """Generate the variants of an image in the background."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="thumbnails")
+    return _executor.submit(generate_all, root, key)
+
+
+def remove_variants(root, key):
+    """Remove every variant of the image stored under key."""
+    for variant in VARIANTS:
+        image_store.remove(root, variant_key(key, variant))
+
+
+def backfill(root, keys, workers=None):
+    """
+    Generate the missing variants of many images in parallel, using one
+    process per core by default. Returns the number of images processed;
+    images that cannot be decoded are skipped.
+    """
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(_generate_all_or_none, repeat(root), keys, chunksize=16):
+            done += result is not None
+    return done
+
+
+def _generate_all_or_none(root, key):
+    try:
+        return generate_all(root, key)
+    except DECODE_ERRORS:
+        return None
@@ -0,0 +1,121 @@
+"""
+Background deletion of users.
+
+GET /delete_user/<id>/ only tombstones the user (database.request_user_deletion):
+it can no longer log in and its sessions are gone. A UserDeleter then
+deletes its notes and images USER_DELETE_BATCH_SIZE at a time, one
+transaction per batch, removing the image files of each batch in parallel,
+and finally the user itself. Several users are deleted at once on
+USER_DELETE_WORKERS threads.
+
+The progress of every job is stored with its tombstone, so a job survives
+the process: each process looks for jobs whose lease (USER_DELETE_LEASE
+seconds, extended with every batch) has expired every USER_DELETE_LEASE
+seconds and resumes them, and at start-up.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import database
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class UserDeleter:
+    """Threads deleting the data of tombstoned users in batches."""
+
+    def __init__(self, remove_files=None, batch_size=500, workers=2, lease=60):
+        self.remove_files = remove_files
+        self.batch_size = batch_size
+        self.workers = workers
+        self.lease = lease
+        self._closed = False
+        self._start()
+        atexit.register(self.close)
+        # threads do not survive a fork: processes forked by serve.py start their own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start(self):
+        self._queue = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._run, name="user-deleter-%d" % i, daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        self._queue.put(None)
+
+    def _after_fork(self):
+        if not self._closed:
+            self._start()
+
+    def submit(self, user_id):
+        """Tombstone a user and queue the deletion of its data. Returns False for an unknown user."""
+        if not database.request_user_deletion(user_id, int(time.time()) + self.lease):
+            return False
+        self._queue.put(user_id)
+        return True
+
+    def wait(self):
+        """Wait until every job queued so far is done or owned by another process."""
+        self._queue.join()
+
+    def close(self):
+        """Stop the threads after their current batch; unfinished jobs resume at the next start."""
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.lease)
+            except queue.Empty:
+                self._work(None)
+                continue
+            try:
+                if item is _STOP:
+                    break
+                self._work(item)
+            finally:
+                self._queue.task_done()
+        database.close_connections()
+
+    def _work(self, user_id):
+        """Delete user_id, or look for jobs to resume when it is None."""
+        try:
+            if user_id is None:
+                self._resume()
+            else:
+                self._delete(user_id)
+        except Exception:
+            # the job is resumed once its lease expires
+            logger.exception("deleting user %s failed", user_id)
+
+    def _resume(self):
+        """Queue the jobs no process owns any more."""
+        now = int(time.time())
+        for row in database.user_deletions():
+            if row[7] <= now and database.claim_user_deletion(row[0], now, now + self.lease):
+                logger.info("resuming the deletion of user %s", row[0])
+                self._queue.put(row[0])
+
+    def _delete(self, user_id):
+        while not self._closed:
+            result = database.delete_user_batch(
+                user_id, self.batch_size, int(time.time()) + self.lease, self.remove_files
+            )
+            if result is None or result[3]:
+                if result is not None:
+                    logger.info("user %s deleted", user_id)
+                return
@@ -0,0 +1,140 @@
+"""
+Write-behind queue for new notes.
+
+When NOTE_WRITE_BEHIND is enabled, POST /write_note hands the note to a
+NoteWriter instead of committing it. A single writer thread drains the queue
+and commits the notes in batches: it waits at most NOTE_WRITE_INTERVAL
+seconds after the first queued note for more notes to arrive, and commits at
+most NOTE_WRITE_BATCH_SIZE notes per transaction. Notes still queued are
+visible to their author through pending(), so users always see their own
+writes, and on_commit is called with every author of a batch once it is
+committed, so that what was cached without their notes is dropped. A note is
+lost if the process dies before its batch is committed.
+
+pending() only covers the notes queued by the calling process: with several
+serve.py workers, the others see a note once it is committed.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import database
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class NoteWriter:
+    """Queue of notes committed in batches by a background thread."""
+
+    def __init__(self, batch_size=100, interval=0.05, on_commit=None):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.on_commit = on_commit
+        self._closed = False
+        self._start()
+        atexit.register(self.close)
+        # threads do not survive a fork: processes forked by serve.py start their own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start(self):
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="note-writer", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        if not self._closed:
+            self._start()
+
+    def submit(self, user_id, note):
+        """Queue a new note and return its (user, timestamp, note, note_id) row."""
+        row = database.new_note(user_id, note)
+        with self._lock:
+            self._pending.setdefault(row[0], {})[row[3]] = row
+        self._queue.put(row)
+        return row
+
+    def pending(self, user_id):
+        """(note_id, timestamp, note) rows of the user not committed yet, newest first."""
+        with self._lock:
+            rows = list(self._pending.get(user_id.upper(), {}).values())
+        return [(row[3], row[1], row[2]) for row in reversed(rows)]
+
+    def is_pending(self, note_id):
+        with self._lock:
+            return any(note_id in notes for notes in self._pending.values())
+
+    def flush(self, user_id=None):
+        """
+        Wait until every note queued so far is committed, or only return once
+        user_id has no note left when given. Notes queued afterwards, by other
+        users or not, are not waited for.
+        """
+        if user_id is not None and not self.pending(user_id):
+            return
+        if not self._thread.is_alive():
+            return
+        committed = threading.Event()
+        self._queue.put(committed)
+        committed.wait()
+
+    def close(self):
+        """Commit the queued notes and stop the writer thread."""
+        self._closed = True
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            # a flush() marker ends the batch: someone is waiting for it
+            while len(batch) < self.batch_size and not isinstance(batch[-1], threading.Event):
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            rows = [item for item in batch if isinstance(item, tuple)]
+            stopping = _STOP in batch
+            if rows:
+                self._commit(rows)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+        database.close_connections()
+
+    def _commit(self, rows):
+        try:
+            database.write_notes_into_db(rows)
+        except database.sqlite3.Error:
+            # one bad row (e.g. its author was deleted meanwhile) must not
+            # lose the whole batch: retry the notes one by one
+            for row in rows:
+                try:
+                    database.write_notes_into_db([row])
+                except database.sqlite3.Error:
+                    logger.exception("dropping note %s of %s", row[3], row[0])
+
+        with self._lock:
+            for row in rows:
+                notes = self._pending.get(row[0], {})
+                notes.pop(row[3], None)
+                if not notes:
+                    self._pending.pop(row[0], None)
+
+        if self.on_commit is not None:
+            for user in {row[0] for row in rows}:
+                try:
+                    self.on_commit(user)
+                except Exception:
+                    logger.exception("on_commit failed for %s", user)